@@ -0,0 +1,49 @@
+"""
+Compare the cost of receiving an event from another node and encoding it for
+one wamp.2.json subscriber, with both broadcast message formats, for several
+payload sizes.
+
+Run with:
+
+    python -m benchmarks.broadcast
+"""
+import timeit
+
+from tornwamp import messages
+from tornwamp.messages import BroadcastMessage, EventMessage
+
+PAYLOAD_SIZES = (0, 10, 100, 1000, 10000)
+
+
+def build_message(size):
+    args = [{"id": index, "name": "item {0}".format(index), "tags": ["a", "b"]} for index in range(size)]
+    return BroadcastMessage("benchmark.topic", EventMessage(publication_id=1, args=args), None)
+
+
+def receive(text):
+    msg = BroadcastMessage.from_text(text)
+    return msg.event_message.json_template.render(1)
+
+
+def encode(msg, version):
+    messages.BROADCAST_FORMAT_VERSION = version
+    try:
+        return msg.json
+    finally:
+        messages.BROADCAST_FORMAT_VERSION = 2
+
+
+def run():
+    print("{0:>8} {1:>16} {2:>16}".format("items", "version 1 (us)", "version 2 (us)"))
+    for size in PAYLOAD_SIZES:
+        msg = build_message(size)
+        legacy_text, text = encode(msg, 1), encode(msg, 2)
+        assert receive(legacy_text) == receive(text)
+        number = max(10, 100000 // (size + 1))
+        old = timeit.timeit(lambda: receive(legacy_text), number=number) / number
+        new = timeit.timeit(lambda: receive(text), number=number) / number
+        print("{0:>8} {1:>16.2f} {2:>16.2f}".format(size, old * 1e6, new * 1e6))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,46 @@
+"""
+Compare how Message.json used to encode messages (deep-copying the whole
+message value) with the current encoding, for several payload sizes.
+
+Run with:
+
+    python -m benchmarks.encoding
+"""
+import json
+import timeit
+from copy import deepcopy
+
+from tornwamp.messages import Code, ResultMessage
+
+PAYLOAD_SIZES = (0, 10, 100, 1000, 10000)
+
+
+def deepcopy_json(message):
+    """
+    How Message.json used to work.
+    """
+    message_value = deepcopy(message.value)
+    for index, item in enumerate(message_value):
+        if isinstance(item, Code):
+            message_value[index] = item.value
+    return json.dumps(message_value)
+
+
+def build_message(size):
+    args = [{"id": index, "name": "item {0}".format(index), "tags": ["a", "b"]} for index in range(size)]
+    return ResultMessage(request_id=1, args=args, kwargs={"total": size})
+
+
+def run():
+    print("{0:>8} {1:>16} {2:>16}".format("items", "deepcopy (us)", "current (us)"))
+    for size in PAYLOAD_SIZES:
+        message = build_message(size)
+        assert deepcopy_json(message) == message.json
+        number = max(10, 100000 // (size + 1))
+        old = timeit.timeit(lambda: deepcopy_json(message), number=number) / number
+        new = timeit.timeit(lambda: message.json, number=number) / number
+        print("{0:>8} {1:>16.2f} {2:>16.2f}".format(size, old * 1e6, new * 1e6))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,98 @@
+"""
+Measure how long the IOLoop is held when events are published to a topic
+with 100k subscribers, while a heartbeat callback runs every millisecond,
+with and without delivery in slices (see tornwamp.topic.fanout).
+
+Run with:
+
+    python -m benchmarks.fanout
+"""
+import gc
+import time
+
+from tornado import gen, ioloop
+
+from tornwamp.messages import EventMessage
+from tornwamp.serializer import json_serializer
+from tornwamp.topic import Topic, fanout
+
+SUBSCRIBERS = 100000
+PUBLICATIONS = 5
+HEARTBEAT_INTERVAL = 0.001
+
+
+class Subscriber(object):
+    serializer = json_serializer
+
+    def __init__(self, id_):
+        self.id = id_
+
+    def send(self, data, binary=False, key=None):
+        pass
+
+
+def build_topic(name):
+    topic = Topic(name)
+    for subscription_id in range(SUBSCRIBERS):
+        topic.subscribers[subscription_id] = Subscriber(subscription_id)
+    return topic
+
+
+async def measure(slice_size):
+    """
+    Publish PUBLICATIONS events to each of two large topics, and return the
+    longest gap between heartbeats and the time it took to deliver them.
+    """
+    fanout.SLICE_SIZE = slice_size
+    topics = [build_topic("benchmark.first"), build_topic("benchmark.second")]
+    if hasattr(gc, "freeze"):
+        # keep full collections of the (long-lived) subscribers out of the
+        # measurements
+        gc.collect()
+        gc.freeze()
+    gaps = []
+    last_beat = [time.monotonic()]
+
+    def heartbeat():
+        now = time.monotonic()
+        gaps.append(now - last_beat[0])
+        last_beat[0] = now
+    beats = ioloop.PeriodicCallback(heartbeat, HEARTBEAT_INTERVAL * 1000)
+    beats.start()
+    await gen.sleep(0.01)
+
+    started_at = time.monotonic()
+    for publication_id in range(PUBLICATIONS):
+        for topic in topics:
+            fanout.scheduler.deliver(topic, EventMessage(publication_id=publication_id, args=["payload"]))
+        await gen.sleep(0)
+    while len(fanout.scheduler):
+        await gen.sleep(HEARTBEAT_INTERVAL)
+    elapsed = time.monotonic() - started_at
+    beats.stop()
+    if hasattr(gc, "unfreeze"):
+        gc.unfreeze()
+    return max(gaps), elapsed
+
+
+def print_histogram(name):
+    histogram = fanout.latency_histograms[name]
+    print("  {0} latency:".format(name))
+    for bound in fanout.LATENCY_BUCKETS:
+        if histogram[bound]:
+            print("    <= {0:>8} s: {1}".format(bound, histogram[bound]))
+    histogram.clear()
+
+
+def run():
+    print("{0} subscribers, {1} publications to each of 2 topics".format(SUBSCRIBERS, PUBLICATIONS))
+    for slice_size in (SUBSCRIBERS, 1000):
+        max_gap, elapsed = ioloop.IOLoop.current().run_sync(lambda: measure(slice_size))
+        label = "at once" if slice_size == SUBSCRIBERS else "slices of {0}".format(slice_size)
+        print("{0}: longest heartbeat gap {1:.1f} ms, total {2:.1f} ms".format(label, max_gap * 1e3, elapsed * 1e3))
+        print_histogram("delivery")
+        print_histogram("tick")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,53 @@
+"""
+Compare the cost of finding the pattern-based subscriptions which match a
+published topic, with TopicMatcher and by checking every pattern, for
+several numbers of patterns (up to 100k).
+
+Run with:
+
+    python -m benchmarks.patterns
+"""
+import timeit
+
+from tornwamp.topic.matcher import TopicMatcher, matches
+
+PATTERN_COUNTS = (100, 1000, 10000, 100000)
+
+
+def build_patterns(count):
+    """
+    Return count patterns, half of them prefixes (market.<n>.<m>) and half
+    wildcards (market..<n>.<m>).
+    """
+    patterns = []
+    for index in range(count):
+        group, item = divmod(index, 100)
+        if index % 2:
+            patterns.append(("prefix", "market.{0}.{1}".format(group, item)))
+        else:
+            patterns.append(("wildcard", "market..{0}.{1}".format(group, item)))
+    return patterns
+
+
+def scan(patterns, topic_name):
+    return [pattern for match, pattern in patterns if matches(match, pattern, topic_name)]
+
+
+def run():
+    topic_name = "market.7.15.spot"
+    print("{0:>8} {1:>12} {2:>12}".format("patterns", "scan (us)", "trie (us)"))
+    for count in PATTERN_COUNTS:
+        patterns = build_patterns(count)
+        matcher = TopicMatcher()
+        for match, pattern in patterns:
+            matcher.add(match, pattern, pattern)
+        assert sorted(matcher.match(topic_name)) == sorted(scan(patterns, topic_name))
+        number = max(10, 1000000 // count)
+        old = timeit.timeit(lambda: scan(patterns, topic_name), number=number) / number
+        number = 100000
+        new = timeit.timeit(lambda: matcher.match(topic_name), number=number) / number
+        print("{0:>8} {1:>12.2f} {2:>12.2f}".format(count, old * 1e6, new * 1e6))
+
+
+if __name__ == "__main__":
+    run()
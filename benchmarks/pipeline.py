@@ -0,0 +1,97 @@
+"""
+Compare how WAMPHandler.on_message used to handle messages (in a new greenlet
+per message, with utils.run_async to wait for futures such as redis
+replies) with the coroutine pipeline, for processors which answer right away
+and for processors which wait for a future.
+
+Requires greenlet. Run with:
+
+    python -m benchmarks.pipeline
+"""
+import time
+import warnings
+from functools import partial
+
+import greenlet
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from tornwamp import utils
+from tornwamp.messages import HelloMessage, decode_message
+from tornwamp.processors import HelloProcessor
+
+MESSAGES = 20000
+TEXT = HelloMessage(realm="benchmark").json
+
+
+class Connection(object):
+    id = 1
+
+
+def reply_soon():
+    """
+    Future resolved in the next IOLoop iteration, as a redis reply would be.
+    """
+    future = Future()
+    IOLoop.current().add_callback(future.set_result, True)
+    return future
+
+
+class GreenletWaitingProcessor(HelloProcessor):
+
+    def process(self):
+        utils.run_async(reply_soon())
+        super(GreenletWaitingProcessor, self).process()
+
+
+class WaitingProcessor(HelloProcessor):
+
+    async def process(self):
+        await reply_soon()
+        super(WaitingProcessor, self).process()
+
+
+def handle_in_greenlet(Processor, done):
+    processor = Processor(decode_message(TEXT), Connection())
+    done.set_result(processor.answer_message.json)
+
+
+async def handle(Processor):
+    processor = Processor(decode_message(TEXT), Connection())
+    await processor.wait()
+    return processor.answer_message.json
+
+
+async def run_greenlets(Processor):
+    for _ in range(MESSAGES):
+        done = Future()
+        greenlet.greenlet(partial(handle_in_greenlet, Processor, done)).switch()
+        await done
+
+
+async def run_coroutines(Processor):
+    for _ in range(MESSAGES):
+        await handle(Processor)
+
+
+def measure(coroutine_function, Processor):
+    start = time.perf_counter()
+    IOLoop.current().run_sync(partial(coroutine_function, Processor))
+    return (time.perf_counter() - start) / MESSAGES
+
+
+def run():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    print("{0:>10} {1:>16} {2:>16}".format("processor", "greenlet (us)", "coroutine (us)"))
+    cases = [
+        ("answers", HelloProcessor, HelloProcessor),
+        ("waits", GreenletWaitingProcessor, WaitingProcessor),
+    ]
+    for name, GreenletProcessor, CoroutineProcessor in cases:
+        old = measure(run_greenlets, GreenletProcessor)
+        new = measure(run_coroutines, CoroutineProcessor)
+        print("{0:>10} {1:>16.2f} {2:>16.2f}".format(name, old * 1e6, new * 1e6))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,64 @@
+"""
+Measure the cost of publishing to a topic which already exists.
+
+Run with:
+
+    python -m benchmarks.topics
+"""
+import timeit
+
+from tornwamp.messages import BroadcastMessage, EventMessage
+from tornwamp.topic import Topic, TopicsManager
+
+ROUNDS = 100000
+
+
+def create_topic_if_not_exists_eager(manager, topic_name):
+    """
+    How create_topic_if_not_exists used to work: a Topic was built even if
+    there was already one with topic_name.
+    """
+    topic = manager.get(topic_name, Topic(topic_name, manager.redis))
+    manager[topic_name] = topic
+    return topic
+
+
+def run():
+    for redis in (None, {"host": "127.0.0.1", "port": 6379}):
+        manager = TopicsManager()
+        manager.redis = redis
+        manager.create_topic_if_not_exists("benchmark.topic")
+        print("redis: {0}".format(redis))
+
+        def lookup_eager():
+            create_topic_if_not_exists_eager(manager, "benchmark.topic")
+
+        def lookup():
+            manager.create_topic_if_not_exists("benchmark.topic")
+
+        report("eager lookup", lookup_eager)
+        report("lazy lookup", lookup)
+
+    # publishing to redis requires a server, so only local delivery is measured
+    manager = TopicsManager()
+    manager.create_topic_if_not_exists("benchmark.topic")
+    msg = BroadcastMessage("benchmark.topic", EventMessage(publication_id=1, args=["payload"]), None)
+    print("publish (local delivery only)")
+
+    def publish_eager():
+        create_topic_if_not_exists_eager(manager, msg.topic_name).publish(msg)
+
+    def publish():
+        manager.create_topic_if_not_exists(msg.topic_name).publish(msg)
+
+    report("eager lookup", publish_eager)
+    report("lazy lookup", publish)
+
+
+def report(name, function):
+    seconds = timeit.timeit(function, number=ROUNDS)
+    print("  {0:<14} {1:8.3f} us/call".format(name, seconds / ROUNDS * 1e6))
+
+
+if __name__ == "__main__":
+    run()
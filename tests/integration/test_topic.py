@@ -3,7 +3,6 @@ import socket
 import uuid
 import time
 
-import greenlet
 from tornadis import Client, PubSubClient
 from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.testing import gen_test, AsyncTestCase
@@ -18,17 +17,26 @@ from tornwamp.topic import Topic, RedisUnavailableError, TopicsManager
 
 class AsyncMixin(object):
 
-    def run_greenlet(self, method, *args, **kwargs):
-        def run():
-            self.stop(method(*args, **kwargs))
-        gr = greenlet.greenlet(run)
-        gr.switch()
-        return self.wait()
+    def subscribe(self, topic, subscription_id, connection):
+        """
+        Add subscriber to topic and wait for redis to confirm the
+        subscription, if it was needed.
+        """
+        future = topic.add_subscriber(subscription_id, connection)
+        if future is not None:
+            return self.wait_for(future)
 
     def wait_for(self, future):
         self.io_loop.add_future(future, lambda x: self.stop(x.result()))
         return self.wait()
 
+    def wait_for_exception(self, future):
+        """
+        Wait for future to be resolved and return its exception, if any.
+        """
+        self.io_loop.add_future(future, lambda x: self.stop(x.exception()))
+        return self.wait()
+
 
 class TopicTestCase(AsyncTestCase, AsyncMixin):
 
@@ -46,9 +54,20 @@ class TopicTestCase(AsyncTestCase, AsyncMixin):
         super(TopicTestCase, self).tearDown()
 
     def test_create_connection(self):
-        self.assertIsInstance(self.topic._publisher_connection, Client)
-        self.assertFalse(self.topic._publisher_connection.is_connected())
-        self.assertTrue(self.topic._publisher_connection.autoconnect)
+        self.assertIsInstance(self.topic._bridge._publisher_connection, Client)
+        self.assertFalse(self.topic._bridge._publisher_connection.is_connected())
+        self.assertTrue(self.topic._bridge._publisher_connection.autoconnect)
+
+    def test_topics_share_bridge(self):
+        other_topic = Topic(name="other", redis={"host": "127.0.0.1", "port": 6379})
+        self.assertIs(other_topic._bridge, self.topic._bridge)
+
+    def test_topics_share_subscriber_connection(self):
+        other_topic = Topic(name="other", redis={"host": "127.0.0.1", "port": 6379})
+        self.subscribe(self.topic, "7", mock.MagicMock())
+        self.subscribe(other_topic, "8", mock.MagicMock())
+        self.assertEqual(set(self.topic._bridge.channels), {"tornwamp:topic:test", "tornwamp:topic:other"})
+        self.assertTrue(self.topic._bridge._subscriber_connection.is_connected())
 
     def test_publish_message(self):
         # We use a dummy connection id as we are not testing local delivery
@@ -59,36 +78,36 @@ class TopicTestCase(AsyncTestCase, AsyncMixin):
         )
         client = PubSubClient(autoconnect=True, ioloop=IOLoop.current())
 
-        self.wait_for(client.pubsub_subscribe("test"))
-        ret = self.run_greenlet(self.topic.publish, msg)
+        self.wait_for(client.pubsub_subscribe("tornwamp:topic:test"))
+        ret = self.wait_for(self.topic.publish(msg))
         self.assertTrue(ret)
         type_, topic, received_msg = self.wait_for(client.pubsub_pop_message())
         self.assertEqual(type_.decode("utf-8"), u"message")
-        self.assertEqual(topic.decode("utf-8"), u"test")
+        self.assertEqual(topic.decode("utf-8"), u"tornwamp:topic:test")
         received_msg = BroadcastMessage.from_text(received_msg.decode("utf-8"))
         self.assertEqual(received_msg.json, msg.json)
 
     def test_publish_redis_fails(self):
-        with self.assertRaises(RedisUnavailableError):
-            with mock.patch.object(self.topic._publisher_connection, "is_connected", return_value=False):
-                msg = BroadcastMessage("test", EventMessage(subscription_id="1", publication_id="1"), 1)
-                # We use a dummy connection id as we are not testing local delivery
-                self.run_greenlet(self.topic.publish, msg)
+        with mock.patch.object(self.topic._bridge._publisher_connection, "is_connected", return_value=False):
+            msg = BroadcastMessage("test", EventMessage(subscription_id="1", publication_id="1"), 1)
+            # We use a dummy connection id as we are not testing local delivery
+            error = self.wait_for_exception(self.topic.publish(msg))
+            self.assertIsInstance(error, RedisUnavailableError)
 
     def test_receive_message_from_other_node(self):
         handler_mock = mock.MagicMock()
 
         connection = session.ClientConnection(handler_mock)
-        self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        self.subscribe(self.topic, "7", connection)
 
         event_msg = EventMessage(subscription_id="1", publication_id="1", kwargs={"type": "test"})
         msg = BroadcastMessage("test", event_msg, 1)
         msg.publisher_node_id = uuid.uuid4().hex
         node2_topic = Topic(name="test", redis={"host": "127.0.0.1", "port": 6379})
-        self.run_greenlet(node2_topic.publish, msg)
+        self.wait_for(node2_topic.publish(msg))
 
         # wait for all futures to execute
-        self.wait_for(self.topic._publisher_connection.call("GET", "a"))
+        self.wait_for(self.topic._bridge._publisher_connection.call("GET", "a"))
         self.io_loop.clear_instance()
 
         event_msg.subscription_id = "7"
@@ -98,19 +117,19 @@ class TopicTestCase(AsyncTestCase, AsyncMixin):
         handler_mock = mock.MagicMock()
 
         connection = session.ClientConnection(handler_mock)
-        self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        self.subscribe(self.topic, "7", connection)
 
         event_msg = EventMessage(subscription_id="1", publication_id="1", kwargs={"type": "test"})
         msg = BroadcastMessage("test", event_msg, 1)
         msg.publisher_node_id = uuid.uuid4().hex
         node2_topic = Topic(name="test", redis={"host": "127.0.0.1", "port": 6379})
-        self.run_greenlet(node2_topic.publish, msg)
+        self.wait_for(node2_topic.publish(msg))
 
         event_msg.kwargs["type"] = "test2"
-        self.run_greenlet(node2_topic.publish, msg)
+        self.wait_for(node2_topic.publish(msg))
 
         # wait for all futures to execute
-        self.wait_for(self.topic._publisher_connection.call("GET", "a"))
+        self.wait_for(self.topic._bridge._publisher_connection.call("GET", "a"))
         self.io_loop.clear_instance()
 
         event_msg.subscription_id = "7"
@@ -124,14 +143,14 @@ class TopicTestCase(AsyncTestCase, AsyncMixin):
         handler_mock = mock.MagicMock()
 
         connection = session.ClientConnection(handler_mock)
-        self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        self.subscribe(self.topic, "7", connection)
 
         event_msg = EventMessage(subscription_id="1", publication_id="1", kwargs={"type": "test"})
         msg = BroadcastMessage("test", event_msg, 1)
-        self.run_greenlet(self.topic.publish, msg)
+        self.wait_for(self.topic.publish(msg))
 
         # wait for all futures to execute
-        self.wait_for(self.topic._publisher_connection.call("GET", "a"))
+        self.wait_for(self.topic._bridge._publisher_connection.call("GET", "a"))
         self.io_loop.clear_instance()
 
         event_msg.subscription_id = "7"
@@ -140,27 +159,32 @@ class TopicTestCase(AsyncTestCase, AsyncMixin):
     def test_redis_fails_on_publish(self):
         event_msg = EventMessage(subscription_id="1", publication_id="1", kwargs={"type": "test"})
         msg = BroadcastMessage("test", event_msg, 1)
-        with self.assertRaises(RedisUnavailableError):
-            with mock.patch.object(self.topic._publisher_connection, "is_connected", return_value=False):
-                self.run_greenlet(self.topic.publish, msg)
+        with mock.patch.object(self.topic._bridge._publisher_connection, "is_connected", return_value=False):
+            error = self.wait_for_exception(self.topic.publish(msg))
+            self.assertIsInstance(error, RedisUnavailableError)
 
     def test_redis_fails_on_subscribe(self):
-        connection = session.ClientConnection(mock.MagicMock())
-        with self.assertRaises(RedisUnavailableError):
-            with mock.patch("tornadis.PubSubClient.is_connected", return_value=False):
-                self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        handler_mock = mock.MagicMock()
+        connection = session.ClientConnection(handler_mock)
+        with mock.patch("tornadis.PubSubClient.is_connected", return_value=False):
+            self.assertFalse(self.subscribe(self.topic, "7", connection))
+        self.assertTrue(handler_mock.close.called)
+        self.assertEqual(len(self.topic.subscribers), 0)
+        self.assertFalse(self.topic._bridge.is_subscribed(self.topic.channel))
 
     def test_redis_fails_to_connect(self):
-        connection = session.ClientConnection(mock.MagicMock())
-        with self.assertRaises(RedisUnavailableError):
-            with mock.patch("socket.socket.connect", side_effect=socket.error):
-                self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        handler_mock = mock.MagicMock()
+        connection = session.ClientConnection(handler_mock)
+        with mock.patch("socket.socket.connect", side_effect=socket.error):
+            self.assertFalse(self.subscribe(self.topic, "7", connection))
+        self.assertTrue(handler_mock.close.called)
+        self.assertIsNone(self.topic._bridge._subscriber_connection)
 
     def test_pop_message_timeout(self):
         handler_mock = mock.MagicMock()
 
         connection = session.ClientConnection(handler_mock)
-        self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        self.subscribe(self.topic, "7", connection)
 
         self.io_loop.call_later(1.5, self.stop)
         self.wait()
@@ -168,7 +192,7 @@ class TopicTestCase(AsyncTestCase, AsyncMixin):
         event_msg = EventMessage(subscription_id="1", publication_id="1", kwargs={"type": "test"})
         msg = BroadcastMessage("test", event_msg, 1)
         msg.publisher_node_id = uuid.uuid4().hex
-        self.wait_for(self.topic._publisher_connection.call("PUBLISH", self.topic.name, msg.json))
+        self.wait_for(self.topic._bridge._publisher_connection.call("PUBLISH", self.topic.channel, msg.json))
 
         # force ioloop to run
         self.io_loop.call_later(0.2, self.stop)
@@ -181,65 +205,60 @@ class TopicTestCase(AsyncTestCase, AsyncMixin):
         handler_mock = mock.MagicMock()
 
         connection = session.ClientConnection(handler_mock)
-        self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        self.subscribe(self.topic, "7", connection)
 
-        self.topic._subscriber_connection = None
-
-        self.io_loop.call_later(1.5, self.stop)
-        self.wait()
+        with mock.patch.object(self.topic._bridge._subscriber_connection, "is_connected", return_value=False):
+            self.io_loop.call_later(1.5, self.stop)
+            self.wait()
 
         self.assertTrue(handler_mock.close.called)
         self.assertEqual(len(self.topic.subscribers), 0)
 
     def test_topic_disconnect_publisher(self):
-        self.wait_for(self.topic._publisher_connection.call("GET", "a"))
-        self.assertTrue(self.topic._publisher_connection.is_connected())
-        self.topic._disconnect_publisher()
-        self.assertFalse(self.topic._publisher_connection.is_connected())
-
-    def test_topic_disconnect_publisher_do_nothing(self):
-        self.topic._publisher_connection = None
-        self.assertIsNone(self.topic._disconnect_publisher())
+        self.wait_for(self.topic._bridge._publisher_connection.call("GET", "a"))
+        self.assertTrue(self.topic._bridge._publisher_connection.is_connected())
+        self.topic._bridge._disconnect_publisher()
+        self.assertFalse(self.topic._bridge._publisher_connection.is_connected())
 
     def test_disconnect_redis_drop_subscribers(self):
         handler_mock = mock.MagicMock()
 
         connection = session.ClientConnection(handler_mock)
-        self.run_greenlet(self.topic.add_subscriber, "7", connection)
+        self.subscribe(self.topic, "7", connection)
 
-        self.topic._subscriber_connection.disconnect()
+        self.topic._bridge._subscriber_connection.disconnect()
 
         # wait for all futures to execute
-        self.wait_for(self.topic._publisher_connection.call("GET", "a"))
+        self.wait_for(self.topic._bridge._publisher_connection.call("GET", "a"))
         self.io_loop.clear_instance()
 
         self.assertTrue(handler_mock.close.called)
         self.assertEqual(len(self.topic.subscribers), 0)
 
     def test_remove_last_subscriber(self):
-        self.run_greenlet(self.topic.add_subscriber, "7", mock.MagicMock())
+        self.subscribe(self.topic, "7", mock.MagicMock())
 
-        connection = self.topic._subscriber_connection
+        connection = self.topic._bridge._subscriber_connection
         self.assertTrue(connection.is_connected())
 
         subscriber = self.topic.remove_subscriber("7")
         self.assertTrue(subscriber)
 
         self.assertFalse(connection.is_connected())
-        self.assertIsNone(self.topic._subscriber_connection)
+        self.assertIsNone(self.topic._bridge._subscriber_connection)
 
     def test_remove_one_subscriber(self):
-        self.run_greenlet(self.topic.add_subscriber, "7", mock.MagicMock())
-        self.run_greenlet(self.topic.add_subscriber, "8", mock.MagicMock())
+        self.subscribe(self.topic, "7", mock.MagicMock())
+        self.subscribe(self.topic, "8", mock.MagicMock())
 
-        connection = self.topic._subscriber_connection
+        connection = self.topic._bridge._subscriber_connection
         self.assertTrue(connection.is_connected())
 
         subscriber = self.topic.remove_subscriber("7")
         self.assertTrue(subscriber)
 
         self.assertTrue(connection.is_connected())
-        self.assertIsNotNone(self.topic._subscriber_connection)
+        self.assertIsNotNone(self.topic._bridge._subscriber_connection)
 
     def test_remove_empty_subscriber(self):
         subscriber = self.topic.remove_subscriber("7")
@@ -266,7 +285,7 @@ class TopicManagerTestCase(AsyncTestCase, AsyncMixin):
 
         connection = session.ClientConnection(handler_mock)
 
-        sub_id = self.run_greenlet(tornwamp_topic.topics.add_subscriber, "test", connection)
+        sub_id = tornwamp_topic.topics.add_subscriber("test", connection)
         self.assertIsNotNone(sub_id)
 
         # We use a dummy connection id as we are not testing local delivery
@@ -277,25 +296,25 @@ class TopicManagerTestCase(AsyncTestCase, AsyncMixin):
         )
         client = PubSubClient(autoconnect=True, ioloop=IOLoop.current())
 
-        self.wait_for(client.pubsub_subscribe("test"))
-        ret = self.run_greenlet(tornwamp_topic.topics["test"].publish, msg)
+        self.wait_for(client.pubsub_subscribe("tornwamp:topic:test"))
+        ret = self.wait_for(tornwamp_topic.topics["test"].publish(msg))
         self.assertTrue(ret)
         type_, topic, received_msg = self.wait_for(client.pubsub_pop_message())
         self.assertEqual(type_.decode("utf-8"), u"message")
-        self.assertEqual(topic.decode("utf-8"), u"test")
+        self.assertEqual(topic.decode("utf-8"), u"tornwamp:topic:test")
         received_msg = BroadcastMessage.from_text(received_msg.decode("utf-8"))
         self.assertEqual(received_msg.json, msg.json)
 
     def test_create_topic(self):
-        self.run_greenlet(tornwamp_topic.topics.create_topic_if_not_exists, "hello")
+        tornwamp_topic.topics.create_topic_if_not_exists("hello")
         self.assertEqual(tornwamp_topic.topics["hello"].name, "hello")
         self.assertEqual(tornwamp_topic.topics["hello"].redis_params, tornwamp_topic.topics.redis)
 
     def test_create_existing_topic(self):
-        self.run_greenlet(tornwamp_topic.topics.create_topic_if_not_exists, "hello")
+        tornwamp_topic.topics.create_topic_if_not_exists("hello")
         hello = tornwamp_topic.topics["hello"]
 
-        self.run_greenlet(tornwamp_topic.topics.create_topic_if_not_exists, "hello")
+        tornwamp_topic.topics.create_topic_if_not_exists("hello")
         second_hello = tornwamp_topic.topics["hello"]
 
         self.assertIs(hello, second_hello)
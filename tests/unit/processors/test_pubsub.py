@@ -1,8 +1,11 @@
 import unittest
 from mock import patch
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
 
-from tornwamp.messages import Code, ErrorMessage, PublishMessage, SubscribeMessage
-from tornwamp.processors.pubsub import PublishProcessor, SubscribeProcessor, customize
+from tornwamp import topic as tornwamp_topic
+from tornwamp.messages import Code, ErrorMessage, PublishMessage, SubscribeMessage, UnsubscribeMessage
+from tornwamp.processors.pubsub import PublishProcessor, SubscribeProcessor, UnsubscribeProcessor, customize
 from tornwamp.session import ClientConnection
 
 
@@ -29,6 +32,89 @@ class SubscribeProcessorTestCase(unittest.TestCase):
         self.assertEqual(answer.uri, "tornwamp.subscribe.unauthorized")
 
 
+class PatternSubscribeProcessorTestCase(unittest.TestCase):
+
+    def test_succeed(self):
+        connection = ClientConnection(None)
+        self.addCleanup(tornwamp_topic.topics.remove_connection, connection)
+        message = SubscribeMessage(request_id=123, options={"match": "prefix"}, topic="olympic")
+        answer = SubscribeProcessor(message, connection).answer_message
+        self.assertEqual(answer.code, Code.SUBSCRIBED)
+        self.assertEqual(tornwamp_topic.topics["prefix#olympic"].subscribers, {answer.subscription_id: connection})
+
+    def test_authorize_subscription_gets_match(self):
+        connection = ClientConnection(None)
+        self.addCleanup(tornwamp_topic.topics.remove_connection, connection)
+        message = SubscribeMessage(request_id=123, options={"match": "prefix"}, topic="olympic")
+        with patch("tornwamp.processors.pubsub.customize.authorize_subscription", return_value=(False, "Only exact topics")) as authorize:
+            answer = SubscribeProcessor(message, connection).answer_message
+        authorize.assert_called_once_with("olympic", connection, match="prefix")
+        self.assertEqual(answer.code, Code.ERROR)
+        self.assertEqual(answer.uri, "tornwamp.subscribe.unauthorized")
+
+    def test_authorize_subscription_without_match_denies_patterns(self):
+        def authorize_subscription(topic_name, connection):
+            return topic_name == "user.123", ""
+
+        connection = ClientConnection(None)
+        self.addCleanup(tornwamp_topic.topics.remove_connection, connection)
+        with patch("tornwamp.processors.pubsub.customize.authorize_subscription", authorize_subscription):
+            answer = SubscribeProcessor(SubscribeMessage(request_id=1, options={"match": "prefix"}, topic="user.123"), connection).answer_message
+            self.assertEqual(answer.code, Code.ERROR)
+            self.assertEqual(answer.uri, "tornwamp.subscribe.unauthorized")
+            answer = SubscribeProcessor(SubscribeMessage(request_id=2, topic="user.123"), connection).answer_message
+            self.assertEqual(answer.code, Code.SUBSCRIBED)
+
+    def test_fail_unsupported_match_policy(self):
+        connection = ClientConnection(None)
+        message = SubscribeMessage(request_id=124, options={"match": "regex"}, topic="olympic.*")
+        answer = SubscribeProcessor(message, connection).answer_message
+        self.assertEqual(answer.code, Code.ERROR)
+        self.assertEqual(answer.request_code, Code.SUBSCRIBE)
+        self.assertEqual(answer.uri, "wamp.error.invalid_argument")
+        self.assertEqual(connection.topics["subscriber"], {})
+
+
+class UnsubscribeProcessorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(UnsubscribeProcessorTestCase, self).setUp()
+        self.connection = ClientConnection(None)
+        message = SubscribeMessage(request_id=123, topic="paralympic.games")
+        self.subscription_id = SubscribeProcessor(message, self.connection).answer_message.subscription_id
+
+    def tearDown(self):
+        super(UnsubscribeProcessorTestCase, self).tearDown()
+        tornwamp_topic.topics.remove_connection(self.connection)
+
+    def test_succeed(self):
+        message = UnsubscribeMessage(request_id=124, subscription_id=self.subscription_id)
+        processor = UnsubscribeProcessor(message, self.connection)
+        answer = processor.answer_message
+        self.assertEqual(answer.code, Code.UNSUBSCRIBED)
+        self.assertEqual(answer.request_id, 124)
+        self.assertEqual(processor.broadcast_messages, [])
+        self.assertNotIn("paralympic.games", tornwamp_topic.topics)
+        self.assertEqual(self.connection.topics["subscriber"], {})
+
+    def test_fail_inexistent_subscription(self):
+        message = UnsubscribeMessage(request_id=125, subscription_id=self.subscription_id + 1)
+        processor = UnsubscribeProcessor(message, self.connection)
+        answer = processor.answer_message
+        self.assertEqual(answer.code, Code.ERROR)
+        self.assertEqual(answer.request_id, 125)
+        self.assertEqual(answer.request_code, Code.UNSUBSCRIBE)
+        self.assertEqual(answer.uri, "wamp.error.no_such_subscription")
+
+    def test_fail_subscription_of_other_connection(self):
+        message = UnsubscribeMessage(request_id=126, subscription_id=self.subscription_id)
+        processor = UnsubscribeProcessor(message, ClientConnection(None))
+        answer = processor.answer_message
+        self.assertEqual(answer.code, Code.ERROR)
+        self.assertEqual(answer.uri, "wamp.error.no_such_subscription")
+        self.assertEqual(len(tornwamp_topic.topics["paralympic.games"].subscribers), 1)
+
+
 class PublishProcessorTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -81,3 +167,44 @@ class PublishProcessorTestCase(unittest.TestCase):
         processor = PublishProcessor(message, connection)
         answer = processor.answer_message
         self.assertEqual(answer, expected_answer)
+
+
+class PublishAcknowledgeTestCase(AsyncTestCase):
+
+    @gen_test
+    def test_acknowledge_once_redis_received_the_publication(self):
+        future = Future()
+        message = PublishMessage(request_id=345, topic="world.cup", options={"acknowledge": True})
+        with patch("tornwamp.processors.pubsub.tornwamp_topic.topics.publish", return_value=future) as publish:
+            processor = PublishProcessor(message, ClientConnection(None))
+        self.assertEqual(publish.call_count, 1)
+        self.assertEqual(processor.broadcast_messages, [])
+        self.assertIsNone(processor.answer_message)
+        future.set_result(1)
+        yield processor.wait()
+        self.assertEqual(processor.answer_message.code, Code.PUBLISHED)
+        self.assertEqual(processor.answer_message.request_id, 345)
+
+    @gen_test
+    def test_acknowledge_publication_redis_failed_to_receive(self):
+        future = Future()
+        future.set_exception(tornwamp_topic.RedisUnavailableError("redis is down"))
+        message = PublishMessage(request_id=345, topic="world.cup", options={"acknowledge": True})
+        with patch("tornwamp.processors.pubsub.tornwamp_topic.topics.publish", return_value=future):
+            processor = PublishProcessor(message, ClientConnection(None))
+        yield processor.wait()
+        answer = processor.answer_message
+        self.assertEqual(answer.code, Code.ERROR)
+        self.assertEqual(answer.request_id, 345)
+        self.assertEqual(answer.request_code, Code.PUBLISH)
+        self.assertEqual(answer.uri, "tornwamp.publish.failed")
+
+    @gen_test
+    def test_acknowledge_publication_with_full_queue(self):
+        message = PublishMessage(request_id=345, topic="world.cup", options={"acknowledge": True})
+        error = tornwamp_topic.RedisUnavailableError("too many publications")
+        with patch("tornwamp.processors.pubsub.tornwamp_topic.topics.publish", side_effect=error):
+            processor = PublishProcessor(message, ClientConnection(None))
+        yield processor.wait()
+        self.assertEqual(processor.answer_message.code, Code.ERROR)
+        self.assertEqual(processor.answer_message.uri, "tornwamp.publish.failed")
@@ -1,11 +1,26 @@
+import threading
 import unittest
 
-from tornwamp.messages import CallMessage, ResultMessage, Code
-from tornwamp.processors.rpc import CallProcessor
+from mock import MagicMock, patch
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from tornwamp import dealer
+from tornwamp.messages import BroadcastMessage, CallMessage, CancelMessage, Code, ErrorMessage, EventMessage, RegisterMessage, ResultMessage, UnregisterMessage, YieldMessage
+from tornwamp.processors import rpc
+from tornwamp.processors.rpc import CallProcessor, CancelProcessor, ErrorProcessor, RegisterProcessor, UnregisterProcessor, YieldProcessor, executors
 
 
 class MockConnection(object):
     id = 1
+    zombie = False
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, msg):
+        self.sent.append(msg)
 
 
 connection = MockConnection()
@@ -29,3 +44,389 @@ class CallProcessorTestCase(unittest.TestCase):
         self.assertEqual(response.request_id, 192837)
         self.assertEqual(response.uri, 'wamp.rpc.unsupported.procedure')
         self.assertEqual(response.details["message"], "The procedure abc doesn't exist")
+
+
+async def slow_echo(*args, **kwargs):
+    call_message = kwargs.pop("call_message")
+    kwargs.pop("connection")
+    await gen.sleep(kwargs.pop("delay", 0))
+    answer = ResultMessage(request_id=call_message.request_id, args=list(args))
+    event = EventMessage(publication_id=1, args=list(args))
+    return answer, [BroadcastMessage("echoes", event, 1)]
+
+
+async def broken(call_message, connection):
+    raise ValueError("out of order")
+
+
+@patch.dict(rpc.customize.procedures, {"slow_echo": slow_echo, "broken": broken})
+@patch("tornwamp.customize.broadcast_messages")
+class AsyncCallProcessorTestCase(AsyncTestCase):
+
+    @gen_test
+    def test_async_procedure(self, mock_broadcast):
+        connection = MockConnection()
+        processor = CallProcessor(CallMessage(request_id=1, procedure="slow_echo", args=["a"]), connection)
+        self.assertIsNone(processor.answer_message)
+        yield processor.pending_call
+        self.assertEqual(len(connection.sent), 1)
+        self.assertEqual(connection.sent[0].code, Code.RESULT)
+        self.assertEqual(connection.sent[0].args, ["a"])
+        mock_broadcast.assert_called_once_with(processor)
+        self.assertEqual(processor.broadcast_messages[0].topic_name, "echoes")
+
+    @gen_test
+    def test_calls_in_flight(self, mock_broadcast):
+        connection = MockConnection()
+        first = CallProcessor(CallMessage(request_id=1, procedure="slow_echo", kwargs={"delay": 0.05}), connection)
+        second = CallProcessor(CallMessage(request_id=2, procedure="slow_echo"), connection)
+        yield [first.pending_call, second.pending_call]
+        self.assertEqual([msg.request_id for msg in connection.sent], [2, 1])
+
+    @gen_test
+    def test_timeout_option(self, mock_broadcast):
+        connection = MockConnection()
+        message = CallMessage(request_id=3, procedure="slow_echo", options={"timeout": 10}, kwargs={"delay": 1})
+        processor = CallProcessor(message, connection)
+        self.assertEqual(processor.timeout, 0.01)
+        yield processor.pending_call
+        self.assertEqual(connection.sent[0].code, Code.ERROR)
+        self.assertEqual(connection.sent[0].uri, "wamp.error.timeout")
+        self.assertEqual(processor.broadcast_messages, [])
+
+    @patch("tornwamp.processors.rpc.CALL_TIMEOUT", 0.01)
+    @gen_test
+    def test_default_timeout(self, mock_broadcast):
+        connection = MockConnection()
+        processor = CallProcessor(CallMessage(request_id=4, procedure="slow_echo", options={"timeout": 5000}), connection)
+        self.assertEqual(processor.timeout, 0.01)
+        processor = CallProcessor(CallMessage(request_id=4, procedure="slow_echo"), connection)
+        self.assertEqual(processor.timeout, 0.01)
+
+    @gen_test
+    def test_procedure_fails(self, mock_broadcast):
+        connection = MockConnection()
+        processor = CallProcessor(CallMessage(request_id=5, procedure="broken"), connection)
+        yield processor.pending_call
+        self.assertEqual(connection.sent[0].uri, "wamp.error.runtime_error")
+        self.assertEqual(connection.sent[0].details["message"], "out of order")
+
+    @gen_test
+    def test_zombie_connection(self, mock_broadcast):
+        connection = MockConnection()
+        connection.zombie = True
+        processor = CallProcessor(CallMessage(request_id=6, procedure="slow_echo"), connection)
+        yield processor.pending_call
+        self.assertEqual(connection.sent, [])
+        self.assertTrue(mock_broadcast.called)
+
+
+def total(*args, **kwargs):
+    call_message = kwargs["call_message"]
+    answer = ResultMessage(request_id=call_message.request_id, args=[sum(args), kwargs["connection"] is None])
+    return answer, []
+
+
+@patch("tornwamp.customize.broadcast_messages")
+class ExecutorCallProcessorTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(ExecutorCallProcessorTestCase, self).setUp()
+        self.addCleanup(executors.shutdown)
+        for name in ("total_in_thread", "total_in_process"):
+            self.addCleanup(rpc.customize.procedures.pop, name, None)
+            self.addCleanup(rpc.customize.procedure_options.pop, name, None)
+        rpc.customize.register_procedure("total_in_thread", total, executor="thread")
+        rpc.customize.register_procedure("total_in_process", total, executor="process")
+
+    @gen_test
+    def test_thread_executor(self, mock_broadcast):
+        connection = MockConnection()
+        processor = CallProcessor(CallMessage(request_id=7, procedure="total_in_thread", args=[1, 2, 3]), connection)
+        self.assertIsNone(processor.answer_message)
+        self.assertEqual(executors.pending_calls["thread"], 1)
+        yield processor.pending_call
+        self.assertEqual(connection.sent[0].args, [6, True])
+        self.assertEqual(executors.pending_calls["thread"], 0)
+
+    @gen_test(timeout=30)
+    def test_process_executor(self, mock_broadcast):
+        connection = MockConnection()
+        processor = CallProcessor(CallMessage(request_id=8, procedure="total_in_process", args=[4, 5]), connection)
+        yield processor.pending_call
+        self.assertEqual(connection.sent[0].request_id, 8)
+        self.assertEqual(connection.sent[0].args, [9, True])
+
+    def test_unknown_executor(self, mock_broadcast):
+        with self.assertRaises(ValueError):
+            rpc.customize.register_procedure("total_in_gpu", total, executor="gpu")
+        self.assertNotIn("total_in_gpu", rpc.customize.procedures)
+
+
+class ExecutorsTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(ExecutorsTestCase, self).setUp()
+        self.addCleanup(executors.shutdown)
+
+    @patch.dict(executors.POOL_SIZES, {"thread": 1})
+    @gen_test
+    def test_queue_depth(self):
+        self.assertEqual(executors.queue_depth("thread"), 0)
+        event = threading.Event()
+        futures = [executors.submit("thread", event.wait) for _ in range(3)]
+        self.assertEqual(executors.pending_calls["thread"], 3)
+        self.assertEqual(executors.queue_depth("thread"), 2)
+        event.set()
+        yield futures
+        self.assertEqual(executors.queue_depth("thread"), 0)
+
+    def test_unknown_executor(self):
+        self.assertRaises(ValueError, executors.get_pool, "gpu")
+
+
+class MockCallee(MockConnection):
+    id = 2
+
+
+@patch("tornwamp.customize.broadcast_messages")
+class DealerProcessorsTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(DealerProcessorsTestCase, self).setUp()
+        self.callee = MockCallee()
+        self.addCleanup(dealer.registrations.remove_connection, self.callee)
+
+    def register(self, procedure="com.myapp.add"):
+        processor = RegisterProcessor(RegisterMessage(request_id=1, procedure=procedure), self.callee)
+        return processor.answer_message
+
+    def test_register(self, mock_broadcast):
+        answer = self.register()
+        self.assertEqual(answer.code, Code.REGISTERED)
+        self.assertEqual(answer.request_id, 1)
+        self.assertIs(dealer.registrations["com.myapp.add"].callee, self.callee)
+
+    def test_register_existing_procedure(self, mock_broadcast):
+        self.register()
+        self.assertEqual(self.register().uri, "wamp.error.procedure_already_exists")
+        self.assertEqual(self.register("ping").uri, "wamp.error.procedure_already_exists")
+
+    def test_register_shared(self, mock_broadcast):
+        options = {"invoke": "roundrobin"}
+        first = RegisterProcessor(RegisterMessage(request_id=1, options=options, procedure="com.myapp.add"), self.callee)
+        other_callee = MockConnection()
+        self.addCleanup(dealer.registrations.remove_connection, other_callee)
+        second = RegisterProcessor(RegisterMessage(request_id=1, options=options, procedure="com.myapp.add"), other_callee)
+        self.assertEqual(second.answer_message.code, Code.REGISTERED)
+        self.assertEqual(second.answer_message.registration_id, first.answer_message.registration_id)
+
+    def test_register_unsupported_policy(self, mock_broadcast):
+        message = RegisterMessage(request_id=1, options={"invoke": "busiest"}, procedure="com.myapp.add")
+        processor = RegisterProcessor(message, self.callee)
+        self.assertEqual(processor.answer_message.uri, "wamp.error.invalid_argument")
+        self.assertNotIn("com.myapp.add", dealer.registrations)
+
+    @patch("tornwamp.processors.rpc.customize.authorize_registration", return_value=(False, "callees only"))
+    def test_register_unauthorized(self, mock_authorize, mock_broadcast):
+        answer = self.register()
+        self.assertEqual(answer.uri, "tornwamp.register.unauthorized")
+        self.assertEqual(answer.details["message"], "callees only")
+        self.assertNotIn("com.myapp.add", dealer.registrations)
+
+    def test_unregister(self, mock_broadcast):
+        registration_id = self.register().registration_id
+        processor = UnregisterProcessor(UnregisterMessage(request_id=2, registration_id=registration_id), self.callee)
+        self.assertEqual(processor.answer_message.code, Code.UNREGISTERED)
+        self.assertNotIn("com.myapp.add", dealer.registrations)
+        processor = UnregisterProcessor(UnregisterMessage(request_id=3, registration_id=registration_id), self.callee)
+        self.assertEqual(processor.answer_message.uri, "wamp.error.no_such_registration")
+
+    @gen_test
+    def test_call_registered_procedure(self, mock_broadcast):
+        self.register()
+        caller = MockConnection()
+        call = CallProcessor(CallMessage(request_id=5, procedure="com.myapp.add", args=[2, 3]), caller)
+        self.assertIsNone(call.answer_message)
+        invocation = self.callee.sent[0]
+        self.assertEqual(invocation.args, [2, 3])
+
+        processor = YieldProcessor(YieldMessage(request_id=invocation.request_id, args=[5]), self.callee)
+        self.assertIsNone(processor.answer_message)
+        yield call.pending_call
+        self.assertEqual(caller.sent[0].code, Code.RESULT)
+        self.assertEqual(caller.sent[0].request_id, 5)
+        self.assertEqual(caller.sent[0].args, [5])
+
+    @gen_test
+    def test_call_remote_procedure(self, mock_broadcast):
+        caller = MockConnection()
+        message = CallMessage(request_id=5, procedure="com.myapp.remote")
+        remote = MagicMock()
+        remote.call.return_value = Future()
+        remote.call.return_value.set_result((ResultMessage(request_id=5, args=[1]), []))
+        with patch.object(dealer.RegistrationsManager, "remote", remote):
+            processor = CallProcessor(message, caller)
+        yield processor.pending_call
+        remote.call.assert_called_once_with(message, caller)
+        self.assertEqual(caller.sent[0].args, [1])
+
+    @gen_test
+    def test_invocation_error(self, mock_broadcast):
+        self.register()
+        caller = MockConnection()
+        processor = CallProcessor(CallMessage(request_id=5, procedure="com.myapp.add"), caller)
+        error = ErrorMessage(request_code=Code.INVOCATION, request_id=self.callee.sent[0].request_id, uri="com.myapp.error")
+        ErrorProcessor(error, self.callee)
+        yield processor.pending_call
+        self.assertEqual(caller.sent[0].code, Code.ERROR)
+        self.assertEqual(caller.sent[0].request_id, 5)
+        self.assertEqual(caller.sent[0].uri, "com.myapp.error")
+
+    @gen_test
+    def test_call_timeout(self, mock_broadcast):
+        self.register()
+        caller = MockConnection()
+        processor = CallProcessor(CallMessage(request_id=5, procedure="com.myapp.add", options={"timeout": 10}), caller)
+        yield processor.pending_call
+        self.assertEqual(caller.sent[0].uri, "wamp.error.timeout")
+        yield gen.sleep(0)
+        self.assertEqual(dealer.registrations.invocations, {})
+
+
+def export(call_message, connection):
+    for row in range(3):
+        yield ResultMessage(request_id=call_message.request_id, args=[row])
+
+
+async def export_async(call_message, connection):
+    for row in range(3):
+        await gen.sleep(0)
+        yield ResultMessage(request_id=call_message.request_id, args=[row])
+
+
+async def export_slowly(call_message, connection, delays):
+    for row, delay in enumerate(delays):
+        await gen.sleep(delay)
+        yield ResultMessage(request_id=call_message.request_id, args=[row])
+
+
+closed_exports = []
+
+
+def export_forever(call_message, connection):
+    try:
+        while True:
+            yield ResultMessage(request_id=call_message.request_id)
+    finally:
+        closed_exports.append(call_message.request_id)
+
+
+class MockCaller(MockConnection):
+
+    def __init__(self):
+        super(MockCaller, self).__init__()
+        self.drained = []
+
+    async def drain(self, max_messages=0):
+        self.drained.append(max_messages)
+
+
+procedures = {
+    "export": export,
+    "export_async": export_async,
+    "export_forever": export_forever,
+    "export_slowly": export_slowly,
+    "slow_echo": slow_echo
+}
+
+
+@patch.dict(rpc.customize.procedures, procedures)
+@patch("tornwamp.customize.broadcast_messages")
+class ProgressiveResultsTestCase(AsyncTestCase):
+
+    def call(self, procedure, request_id=1, receive_progress=True, connection=None):
+        options = {"receive_progress": True} if receive_progress else {}
+        return CallProcessor(CallMessage(request_id=request_id, procedure=procedure, options=options), connection or self.caller)
+
+    def setUp(self):
+        super(ProgressiveResultsTestCase, self).setUp()
+        self.caller = MockCaller()
+
+    @gen_test
+    def test_generator_procedure(self, mock_broadcast):
+        processor = self.call("export")
+        yield processor.pending_call
+        self.assertEqual([msg.args for msg in self.caller.sent], [[0], [1], [2]])
+        self.assertEqual([msg.details for msg in self.caller.sent], [{"progress": True}, {"progress": True}, {}])
+        self.assertEqual(self.caller.drained, [rpc.PROGRESS_BUFFER_SIZE] * 2)
+
+    @gen_test
+    def test_async_generator_procedure(self, mock_broadcast):
+        processor = self.call("export_async")
+        yield processor.pending_call
+        self.assertEqual([msg.args for msg in self.caller.sent], [[0], [1], [2]])
+        self.assertEqual(self.caller.sent[-1].details, {})
+
+    @patch("tornwamp.processors.rpc.CALL_TIMEOUT", 0.05)
+    @gen_test
+    def test_async_generator_procedure_longer_than_timeout(self, mock_broadcast):
+        message = CallMessage(request_id=5, procedure="export_slowly", options={"receive_progress": True}, kwargs={"delays": [0.02] * 5})
+        processor = CallProcessor(message, self.caller)
+        yield processor.pending_call
+        self.assertEqual([msg.args for msg in self.caller.sent], [[0], [1], [2], [3], [4]])
+        self.assertEqual(self.caller.sent[-1].code, Code.RESULT)
+
+    @patch("tornwamp.processors.rpc.CALL_TIMEOUT", 0.05)
+    @gen_test
+    def test_async_generator_procedure_stops_producing(self, mock_broadcast):
+        message = CallMessage(request_id=6, procedure="export_slowly", options={"receive_progress": True}, kwargs={"delays": [0, 0.2]})
+        processor = CallProcessor(message, self.caller)
+        yield processor.pending_call
+        # the first result was waiting for the next one to be sent as progress
+        self.assertEqual([msg.code for msg in self.caller.sent], [Code.ERROR])
+        self.assertEqual(self.caller.sent[0].uri, "wamp.error.timeout")
+        self.assertNotIn(1, rpc.calls_in_flight)
+
+    @gen_test
+    def test_progress_not_requested(self, mock_broadcast):
+        processor = self.call("export", receive_progress=False)
+        yield processor.pending_call
+        self.assertEqual([msg.args for msg in self.caller.sent], [[2]])
+
+    @gen_test
+    def test_cancel_generator_procedure(self, mock_broadcast):
+        processor = self.call("export_forever", request_id=9)
+        self.assertIs(rpc.calls_in_flight[1][9], processor)
+        yield gen.sleep(0.01)
+        CancelProcessor(CancelMessage(request_id=9), self.caller)
+        yield processor.pending_call
+        self.assertEqual(self.caller.sent[-1].code, Code.ERROR)
+        self.assertEqual(self.caller.sent[-1].uri, "wamp.error.canceled")
+        self.assertEqual(closed_exports, [9])
+        self.assertNotIn(1, rpc.calls_in_flight)
+
+    @gen_test
+    def test_cancel_async_procedure(self, mock_broadcast):
+        processor = self.call("slow_echo", request_id=4)
+        CancelProcessor(CancelMessage(request_id=4, options={"mode": "skip"}), self.caller)
+        yield processor.pending_call
+        self.assertEqual(self.caller.sent[0].uri, "wamp.error.canceled")
+        self.assertFalse(processor.cancel())
+
+    def test_cancel_unknown_call(self, mock_broadcast):
+        processor = CancelProcessor(CancelMessage(request_id=4), self.caller)
+        self.assertIsNone(processor.answer_message)
+
+    def test_cancel_unsupported_mode(self, mock_broadcast):
+        processor = CancelProcessor(CancelMessage(request_id=4, options={"mode": "later"}), self.caller)
+        self.assertEqual(processor.answer_message.uri, "wamp.error.invalid_argument")
+
+    @gen_test
+    def test_cancel_calls(self, mock_broadcast):
+        first = self.call("export_forever", request_id=1)
+        second = self.call("slow_echo", request_id=2)
+        rpc.cancel_calls(self.caller)
+        yield [first.pending_call, second.pending_call]
+        self.assertEqual([msg.uri for msg in self.caller.sent], ["wamp.error.canceled", "wamp.error.canceled"])
+        self.assertEqual(rpc.calls_in_flight, {})
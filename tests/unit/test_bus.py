@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.iostream import StreamBufferFullError
+from tornado.testing import AsyncTestCase, gen_test
+
+from tornwamp import bus as tornwamp_bus
+from tornwamp.messages import BroadcastMessage, EventMessage
+
+
+class LocalBusTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(LocalBusTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.received = Future()
+        self.buses = [
+            tornwamp_bus.LocalBus(self.directory, 0, 3, None),
+            tornwamp_bus.LocalBus(self.directory, 1, 3, self.received.set_result),
+        ]
+        for bus in self.buses:
+            bus.start()
+
+    def tearDown(self):
+        for bus in self.buses:
+            bus.close()
+        super(LocalBusTestCase, self).tearDown()
+
+    def test_socket_path(self):
+        self.assertEqual(self.buses[1].path, os.path.join(self.directory, "worker-1.sock"))
+        self.assertTrue(os.path.exists(self.buses[1].path))
+
+    @gen_test
+    def test_publish(self):
+        event = EventMessage(publication_id=27, args=[u"café"])
+        self.buses[0].publish(BroadcastMessage("a.topic", event, 3))
+        msg = yield gen.with_timeout(self.io_loop.time() + 5, self.received)
+        self.assertEqual(msg.topic_name, "a.topic")
+        self.assertEqual(msg.publisher_connection_id, 3)
+        self.assertEqual(msg.event_message.args, [u"café"])
+
+    @gen_test
+    def test_publish_reuses_connections(self):
+        self.buses[0].publish(BroadcastMessage("a.topic", EventMessage(publication_id=27), 3))
+        stream = self.buses[0]._streams[1]
+        yield gen.with_timeout(self.io_loop.time() + 5, self.received)
+        self.buses[0].publish(BroadcastMessage("a.topic", EventMessage(publication_id=28), 3))
+        self.assertIs(self.buses[0]._streams[1], stream)
+
+    @gen_test
+    def test_publish_to_worker_which_is_down(self):
+        # worker 2 isn't listening
+        self.buses[0].publish(BroadcastMessage("a.topic", EventMessage(publication_id=27), 3))
+        yield gen.with_timeout(self.io_loop.time() + 5, self.received)
+        self.assertNotIn(2, self.buses[0]._streams)
+        self.assertIn(1, self.buses[0]._streams)
+
+    @gen_test
+    def test_receive_after_worker_restarts(self):
+        self.buses[0].publish(BroadcastMessage("a.topic", EventMessage(publication_id=27), 3))
+        yield gen.with_timeout(self.io_loop.time() + 5, self.received)
+        self.buses[1].close()
+        restarted = Future()
+        self.buses[1] = tornwamp_bus.LocalBus(self.directory, 1, 3, restarted.set_result)
+        self.buses[1].start()
+        yield gen.sleep(0.01)
+        self.buses[0].publish(BroadcastMessage("a.topic", EventMessage(publication_id=28), 3))
+        msg = yield gen.with_timeout(self.io_loop.time() + 5, restarted)
+        self.assertEqual(msg.event_message.publication_id, 28)
+
+    @patch("tornwamp.bus.IOStream.write", side_effect=StreamBufferFullError())
+    def test_publish_drops_messages_to_slow_worker(self, mock_write):
+        with patch.object(tornwamp_bus.logger, "warning") as warning:
+            self.buses[0].publish(BroadcastMessage("a.topic", EventMessage(publication_id=27), 3))
+        self.assertEqual(warning.call_count, 2)
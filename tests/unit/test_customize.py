@@ -0,0 +1,47 @@
+from mock import MagicMock, patch
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from tornwamp import customize
+from tornwamp.messages import BroadcastMessage, EventMessage
+from tornwamp.topic import RedisUnavailableError
+
+
+class BroadcastMessagesTestCase(AsyncTestCase):
+
+    @gen_test
+    def test_broadcast_messages_logs_failed_publications(self):
+        future = Future()
+        processor = MagicMock(broadcast_messages=[BroadcastMessage("a.topic", EventMessage(publication_id=1), 2)])
+        with patch("tornwamp.customize.tornwamp_topic.topics.publish", return_value=future), \
+                patch.object(customize.logger, "error") as error:
+            customize.broadcast_messages(processor)
+            future.set_exception(RedisUnavailableError("redis is down"))
+            yield gen.moment
+        self.assertEqual(error.call_count, 1)
+        self.assertEqual(error.call_args[0][1:3], (processor.connection.id, "a.topic"))
+
+    @gen_test
+    def test_broadcast_messages_without_redis(self):
+        processor = MagicMock(broadcast_messages=[BroadcastMessage("a.topic", EventMessage(publication_id=1), 2)])
+        with patch("tornwamp.customize.tornwamp_topic.topics.publish", return_value=None) as publish, \
+                patch.object(customize.logger, "error") as error:
+            customize.broadcast_messages(processor)
+            yield gen.moment
+        publish.assert_called_once_with(processor.broadcast_messages[0])
+        self.assertFalse(error.called)
+
+    @gen_test
+    def test_broadcast_messages_with_full_publish_queue(self):
+        processor = MagicMock(broadcast_messages=[
+            BroadcastMessage("a.topic", EventMessage(publication_id=1), 2),
+            BroadcastMessage("b.topic", EventMessage(publication_id=3), 2)
+        ])
+        failure = RedisUnavailableError("too many publications")
+        with patch("tornwamp.customize.tornwamp_topic.topics.publish", side_effect=failure) as publish, \
+                patch.object(customize.logger, "error") as error:
+            customize.broadcast_messages(processor)
+        self.assertEqual(publish.call_count, 2)
+        self.assertEqual(error.call_count, 2)
+        self.assertEqual(error.call_args[0][1:3], (processor.connection.id, "b.topic"))
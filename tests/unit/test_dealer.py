@@ -0,0 +1,453 @@
+import unittest
+
+from mock import patch
+from tornado import gen, ioloop
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.websocket import WebSocketClosedError
+
+from tornwamp import dealer
+from tornwamp.dealer import Registration, RegistrationsManager
+from tornwamp.messages import CallMessage, Code, ErrorMessage, YieldMessage
+
+
+class MockConnection(object):
+
+    def __init__(self, id_, closed=False):
+        self.id = id_
+        self.closed = closed
+        self.sent = []
+
+    def send_message(self, msg):
+        if self.closed:
+            raise WebSocketClosedError()
+        self.sent.append(msg)
+
+
+class RegistrationsManagerTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(RegistrationsManagerTestCase, self).setUp()
+        self.registrations = RegistrationsManager()
+        self.callee = MockConnection(1)
+        self.caller = MockConnection(2)
+
+    def test_register(self):
+        registration = self.registrations.register("com.myapp.add", self.callee)
+        self.assertIs(self.registrations["com.myapp.add"], registration)
+        self.assertIs(self.registrations.by_id[registration.id], registration)
+        self.assertEqual(self.registrations.dict, {"com.myapp.add": {"id": registration.id, "procedure": "com.myapp.add", "invoke": "single", "callees": [1]}})
+
+    def test_register_twice(self):
+        self.registrations.register("com.myapp.add", self.callee)
+        self.assertIsNone(self.registrations.register("com.myapp.add", MockConnection(3)))
+
+    def test_shared_registration(self):
+        registration = self.registrations.register("com.myapp.add", self.callee, {"invoke": "roundrobin"})
+        other_callee = MockConnection(3)
+        self.assertIs(self.registrations.register("com.myapp.add", other_callee, {"invoke": "roundrobin"}), registration)
+        self.assertEqual(list(registration.callees), [1, 3])
+        self.assertIsNone(self.registrations.register("com.myapp.add", other_callee, {"invoke": "roundrobin"}))
+        self.assertIsNone(self.registrations.register("com.myapp.add", MockConnection(4), {"invoke": "random"}))
+        self.assertIsNone(self.registrations.register("com.myapp.add", MockConnection(4)))
+
+        self.assertIs(self.registrations.unregister(registration.id, self.callee), registration)
+        self.assertIs(self.registrations["com.myapp.add"], registration)
+        self.registrations.remove_connection(other_callee)
+        self.assertEqual(self.registrations, {})
+        self.assertEqual(self.registrations.by_id, {})
+
+    def test_shared_registration_invocations(self):
+        callees = [self.callee, MockConnection(3), MockConnection(4)]
+        for callee in callees:
+            self.registrations.register("com.myapp.add", callee, {"invoke": "roundrobin"})
+        for request_id in range(4):
+            self.registrations.invoke(CallMessage(request_id=request_id, procedure="com.myapp.add"), self.caller)
+        self.assertEqual([len(callee.sent) for callee in callees], [2, 1, 1])
+        self.assertEqual(sorted(self.registrations.invocations), [1, 3, 4])
+
+    def test_unregister(self):
+        registration = self.registrations.register("com.myapp.add", self.callee)
+        self.assertIsNone(self.registrations.unregister(registration.id, self.caller))
+        self.assertIs(self.registrations.unregister(registration.id, self.callee), registration)
+        self.assertEqual(self.registrations, {})
+        self.assertEqual(self.registrations.by_id, {})
+        self.assertIsNone(self.registrations.unregister(registration.id, self.callee))
+
+    @gen_test
+    def test_invoke_and_yield(self):
+        registration = self.registrations.register("com.myapp.add", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.add", args=[1, 2]), self.caller)
+        invocation = self.callee.sent[0]
+        self.assertEqual(invocation.code, Code.INVOCATION)
+        self.assertEqual(invocation.request_id, 1)
+        self.assertEqual(invocation.registration_id, registration.id)
+        self.assertEqual(invocation.args, [1, 2])
+        self.assertEqual(invocation.details, {})
+
+        self.assertTrue(self.registrations.yield_result(YieldMessage(request_id=1, args=[3]), self.callee))
+        answer, broadcast_messages = yield future
+        self.assertEqual(answer.code, Code.RESULT)
+        self.assertEqual(answer.request_id, 7)
+        self.assertEqual(answer.args, [3])
+        self.assertEqual(broadcast_messages, [])
+        self.assertEqual(self.registrations.invocations, {})
+        self.assertFalse(self.registrations.yield_result(YieldMessage(request_id=1), self.callee))
+
+    def test_invocation_request_ids(self):
+        self.registrations.register("com.myapp.add", self.callee)
+        for request_id in (7, 8):
+            self.registrations.invoke(CallMessage(request_id=request_id, procedure="com.myapp.add"), self.caller)
+        self.assertEqual([msg.request_id for msg in self.callee.sent], [1, 2])
+        self.assertEqual(sorted(self.registrations.invocations[1]), [1, 2])
+
+    def test_disclose_caller(self):
+        self.registrations.register("com.myapp.add", self.callee)
+        self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.add", options={"disclose_me": True}), self.caller)
+        self.assertEqual(self.callee.sent[0].details, {"caller": 2})
+
+    @gen_test
+    def test_progressive_results(self):
+        self.registrations.register("com.myapp.export", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.export", options={"receive_progress": True}), self.caller)
+        self.assertEqual(self.callee.sent[0].details, {"receive_progress": True})
+        for rows in (["a"], ["b"]):
+            self.assertTrue(self.registrations.yield_result(YieldMessage(request_id=1, options={"progress": True}, args=rows), self.callee))
+        self.assertFalse(future.done())
+        self.assertEqual([msg.args for msg in self.caller.sent], [["a"], ["b"]])
+        self.assertEqual([msg.details for msg in self.caller.sent], [{"progress": True}, {"progress": True}])
+        self.assertEqual([msg.request_id for msg in self.caller.sent], [7, 7])
+
+        self.registrations.yield_result(YieldMessage(request_id=1, args=["c"]), self.callee)
+        answer, _ = yield future
+        self.assertEqual(answer.details, {})
+        self.assertEqual(answer.args, ["c"])
+
+    def test_progressive_results_not_requested(self):
+        self.registrations.register("com.myapp.export", self.callee)
+        self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.export"), self.caller)
+        self.assertEqual(self.callee.sent[0].details, {})
+        self.registrations.yield_result(YieldMessage(request_id=1, options={"progress": True}, args=["a"]), self.callee)
+        self.assertEqual(self.caller.sent, [])
+        self.assertIn(1, self.registrations.invocations[1])
+
+    @gen_test
+    def test_cancel_skip(self):
+        self.registrations.register("com.myapp.export", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.export"), self.caller)
+        self.assertTrue(self.registrations.cancel(2, 7, "skip"))
+        answer, _ = yield future
+        self.assertEqual(answer.uri, "wamp.error.canceled")
+        self.assertEqual(answer.request_id, 7)
+        self.assertEqual([msg.code for msg in self.callee.sent], [Code.INVOCATION])
+        self.assertEqual(self.registrations.invocations, {})
+        self.assertFalse(self.registrations.cancel(2, 7, "skip"))
+
+    @gen_test
+    def test_cancel_kill(self):
+        self.registrations.register("com.myapp.export", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.export"), self.caller)
+        self.assertTrue(self.registrations.cancel(2, 7, "kill"))
+        interrupt = self.callee.sent[1]
+        self.assertEqual(interrupt.code, Code.INTERRUPT)
+        self.assertEqual(interrupt.request_id, 1)
+        self.assertEqual(interrupt.options, {"mode": "kill"})
+        self.assertFalse(future.done())
+        error = ErrorMessage(request_code=Code.INVOCATION, request_id=1, uri="wamp.error.canceled")
+        self.registrations.invocation_error(error, self.callee)
+        answer, _ = yield future
+        self.assertEqual(answer.uri, "wamp.error.canceled")
+
+    @gen_test
+    def test_cancel_killnowait(self):
+        self.registrations.register("com.myapp.export", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.export"), self.caller)
+        self.assertTrue(self.registrations.cancel(2, 7, "killnowait"))
+        self.assertEqual(self.callee.sent[1].options, {"mode": "killnowait"})
+        answer, _ = yield future
+        self.assertEqual(answer.uri, "wamp.error.canceled")
+        self.assertEqual(self.registrations.invocations, {})
+
+    @gen_test
+    def test_invocation_error(self):
+        self.registrations.register("com.myapp.add", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller)
+        error = ErrorMessage(request_code=Code.INVOCATION, request_id=1, uri="com.myapp.error.overflow", args=["too big"])
+        self.assertTrue(self.registrations.invocation_error(error, self.callee))
+        answer, _ = yield future
+        self.assertEqual(answer.code, Code.ERROR)
+        self.assertEqual(answer.request_code, Code.CALL)
+        self.assertEqual(answer.request_id, 7)
+        self.assertEqual(answer.uri, "com.myapp.error.overflow")
+        self.assertEqual(answer.args, ["too big"])
+
+    @gen_test
+    def test_callee_is_closed(self):
+        self.registrations.register("com.myapp.add", MockConnection(3, closed=True))
+        answer, _ = yield self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller)
+        self.assertEqual(answer.uri, "wamp.error.canceled")
+        self.assertEqual(self.registrations.invocations, {})
+
+    @gen_test
+    def test_remove_callee(self):
+        self.registrations.register("com.myapp.add", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller)
+        self.registrations.remove_connection(self.callee)
+        self.assertEqual(self.registrations, {})
+        self.assertEqual(self.registrations.invocations, {})
+        answer, _ = yield future
+        self.assertEqual(answer.uri, "wamp.error.canceled")
+
+    @gen_test
+    def test_remove_caller(self):
+        self.registrations.register("com.myapp.add", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller)
+        self.registrations.remove_connection(self.caller)
+        self.assertEqual(self.callee.sent[1].code, Code.INTERRUPT)
+        self.assertEqual(self.registrations.invocations, {})
+        answer, _ = yield future
+        self.assertIsNone(answer)
+        self.assertFalse(self.registrations.yield_result(YieldMessage(request_id=1), self.callee))
+
+    @gen_test
+    def test_cancelled_call_is_forgotten(self):
+        self.registrations.register("com.myapp.add", self.callee)
+        future = self.registrations.invoke(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller)
+        future.cancel()
+        yield gen.sleep(0)
+        self.assertEqual(self.registrations.invocations, {})
+        self.assertEqual(self.callee.sent[1].code, Code.INTERRUPT)
+
+
+class RegistrationTestCase(unittest.TestCase):
+
+    def build_registration(self, policy, callees=3):
+        registration = Registration(1, "com.myapp.add", policy)
+        for id_ in range(callees):
+            registration.add_callee(MockConnection(id_))
+        return registration
+
+    def invoke(self, registration, times=1):
+        callees = []
+        for _ in range(times):
+            callee = registration.select_callee()
+            registration.invocation_started(callee)
+            callees.append(callee.id)
+        return callees
+
+    def test_single(self):
+        registration = self.build_registration("single", callees=1)
+        self.assertEqual(self.invoke(registration, 2), [0, 0])
+
+    def test_roundrobin(self):
+        registration = self.build_registration("roundrobin")
+        self.assertEqual(self.invoke(registration, 4), [0, 1, 2, 0])
+        registration.remove_callee(registration.callees[1])
+        self.assertEqual(self.invoke(registration, 3), [2, 0, 2])
+
+    def test_first_and_last(self):
+        self.assertEqual(self.invoke(self.build_registration("first"), 2), [0, 0])
+        registration = self.build_registration("last")
+        self.assertEqual(self.invoke(registration, 2), [2, 2])
+        registration.remove_callee(registration.callees[2])
+        self.assertEqual(self.invoke(registration), [1])
+
+    def test_random(self):
+        registration = self.build_registration("random")
+        registration.remove_callee(registration.callees[0])
+        with patch("random.choice", side_effect=lambda callees: callees[-1]) as mock_choice:
+            self.assertEqual(self.invoke(registration), [1])
+        self.assertEqual(sorted(callee.id for callee in mock_choice.call_args[0][0]), [1, 2])
+
+    def test_least_outstanding(self):
+        registration = self.build_registration("least_outstanding")
+        self.assertEqual(self.invoke(registration, 4), [0, 1, 2, 0])
+        registration.invocation_ended(registration.callees[2])
+        self.assertEqual(self.invoke(registration), [2])
+        registration.invocation_ended(registration.callees[0])
+        registration.invocation_ended(registration.callees[0])
+        self.assertEqual(self.invoke(registration), [0])
+
+    def test_least_outstanding_callee_removed(self):
+        registration = self.build_registration("least_outstanding", callees=2)
+        self.assertEqual(self.invoke(registration, 3), [0, 1, 0])
+        registration.remove_callee(registration.callees[1])
+        self.assertEqual(self.invoke(registration), [0])
+
+
+def resolved(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class MockRedisBridge(object):
+    """
+    In-memory stand-in for the RedisBridge shared by the nodes.
+    """
+    def __init__(self):
+        self.hash = {}
+        self.channels = {}
+        self.published = []
+
+    def call(self, command, *args):
+        reply = None
+        if command == "HSET":
+            _, field, value = args
+            self.hash[field] = value.encode("utf-8")
+        elif command == "HGET":
+            _, field = args
+            reply = self.hash.get(field)
+        elif command == "EVAL":
+            _, _, _, field, value = args
+            if self.hash.get(field) == value.encode("utf-8"):
+                reply = 1
+                del self.hash[field]
+        return resolved(reply)
+
+    def subscribe(self, channel, on_message, on_lost):
+        self.channels[channel] = (on_message, on_lost)
+        return resolved(True)
+
+    def publish(self, channel, payload):
+        self.published.append(channel)
+        on_message, _ = self.channels[channel]
+        ioloop.IOLoop.current().add_callback(on_message, channel, payload.encode("utf-8"))
+        return resolved(1)
+
+
+class RedisDealerTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(RedisDealerTestCase, self).setUp()
+        self.bridge = MockRedisBridge()
+        patcher = patch("tornwamp.dealer.get_redis_bridge", return_value=self.bridge)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.node_a = self.build_node("a")
+        self.node_b = self.build_node("b")
+        self.callee = MockConnection(1)
+        self.caller = MockConnection(2)
+
+    def build_node(self, node_id):
+        registrations = RegistrationsManager()
+        registrations.redis = {"host": "127.0.0.1", "port": 6379}
+        registrations.remote.node_id = node_id
+        registrations.remote.channel = dealer.NODE_CHANNEL_PREFIX + node_id
+        return registrations
+
+    def test_announce_and_withdraw(self):
+        registration = self.node_b.register("com.myapp.add", self.callee)
+        self.assertEqual(self.bridge.hash, {"com.myapp.add": b"b"})
+        self.assertIn("tornwamp:node:b", self.bridge.channels)
+        self.node_b.unregister(registration.id, self.callee)
+        self.assertEqual(self.bridge.hash, {})
+
+    def test_withdraw_keeps_other_node(self):
+        registration = self.node_b.register("com.myapp.add", self.callee)
+        self.node_a.register("com.myapp.add", MockConnection(3))
+        self.node_b.unregister(registration.id, self.callee)
+        self.assertEqual(self.bridge.hash, {"com.myapp.add": b"a"})
+
+    @gen_test
+    def test_remote_call(self):
+        self.node_b.register("com.myapp.add", self.callee)
+        futures = [
+            gen.convert_yielded(self.node_a.remote.call(CallMessage(request_id=request_id, procedure="com.myapp.add", args=[request_id, 1]), self.caller))
+            for request_id in (7, 8)
+        ]
+        while len(self.callee.sent) < 2:
+            yield gen.sleep(0)
+        # both CALLs were forwarded in a single message
+        self.assertEqual(self.bridge.published, ["tornwamp:node:b"])
+        for invocation in self.callee.sent:
+            self.node_b.yield_result(YieldMessage(request_id=invocation.request_id, args=[sum(invocation.args)]), self.callee)
+
+        results = yield futures
+        self.assertEqual([answer.code for answer, _ in results], [Code.RESULT, Code.RESULT])
+        self.assertEqual([answer.request_id for answer, _ in results], [7, 8])
+        self.assertEqual([answer.args for answer, _ in results], [[8], [9]])
+        self.assertEqual(self.node_a.remote._pending_calls, {})
+
+    @gen_test
+    def test_remote_call_error(self):
+        self.node_b.register("com.myapp.add", self.callee)
+        future = gen.convert_yielded(self.node_a.remote.call(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller))
+        while not self.callee.sent:
+            yield gen.sleep(0)
+        error = ErrorMessage(request_code=Code.INVOCATION, request_id=self.callee.sent[0].request_id, uri="com.myapp.error")
+        self.node_b.invocation_error(error, self.callee)
+        answer, _ = yield future
+        self.assertEqual(answer.code, Code.ERROR)
+        self.assertEqual(answer.request_id, 7)
+        self.assertEqual(answer.uri, "com.myapp.error")
+
+    @gen_test
+    def test_remote_call_unknown_procedure(self):
+        answer, _ = yield self.node_a.remote.call(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller)
+        self.assertEqual(answer.uri, "wamp.rpc.unsupported.procedure")
+        self.assertEqual(self.bridge.published, [])
+
+    @gen_test
+    def test_remote_call_after_unregister(self):
+        self.bridge.hash["com.myapp.add"] = b"b"
+        self.node_b.remote.subscribe()
+        answer, _ = yield self.node_a.remote.call(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller)
+        self.assertEqual(answer.request_id, 7)
+        self.assertEqual(answer.uri, "wamp.rpc.unsupported.procedure")
+
+    @gen_test
+    def test_remote_progressive_results(self):
+        self.node_b.register("com.myapp.export", self.callee)
+        message = CallMessage(request_id=7, procedure="com.myapp.export", options={"receive_progress": True})
+        future = gen.convert_yielded(self.node_a.remote.call(message, self.caller))
+        while not self.callee.sent:
+            yield gen.sleep(0)
+        self.node_b.yield_result(YieldMessage(request_id=1, options={"progress": True}, args=["a"]), self.callee)
+        while not self.caller.sent:
+            yield gen.sleep(0)
+        self.assertEqual(self.caller.sent[0].args, ["a"])
+        self.assertEqual(self.caller.sent[0].details, {"progress": True})
+        self.assertFalse(future.done())
+        self.node_b.yield_result(YieldMessage(request_id=1, args=["b"]), self.callee)
+        answer, _ = yield future
+        self.assertEqual(answer.args, ["b"])
+
+    @gen_test
+    def test_remote_cancel(self):
+        self.node_b.register("com.myapp.export", self.callee)
+        future = gen.convert_yielded(self.node_a.remote.call(CallMessage(request_id=7, procedure="com.myapp.export"), self.caller))
+        while not self.callee.sent:
+            yield gen.sleep(0)
+        self.assertTrue(self.node_a.remote.cancel(2, 7, "killnowait"))
+        answer, _ = yield future
+        self.assertEqual(answer.uri, "wamp.error.canceled")
+        while len(self.callee.sent) < 2:
+            yield gen.sleep(0)
+        self.assertEqual(self.callee.sent[1].code, Code.INTERRUPT)
+        self.assertEqual(self.node_b.invocations, {})
+        self.assertFalse(self.node_a.remote.cancel(2, 7, "killnowait"))
+
+    @gen_test
+    def test_remote_call_timeout(self):
+        self.node_b.register("com.myapp.export", self.callee)
+        future = gen.convert_yielded(self.node_a.remote.call(CallMessage(request_id=7, procedure="com.myapp.export"), self.caller))
+        while not self.callee.sent:
+            yield gen.sleep(0)
+        future.cancel()
+        while len(self.callee.sent) < 2:
+            yield gen.sleep(0)
+        self.assertEqual(self.callee.sent[1].code, Code.INTERRUPT)
+        self.assertEqual(self.node_a.remote._pending_calls, {})
+
+    @gen_test
+    def test_connection_lost(self):
+        self.node_b.register("com.myapp.add", self.callee)
+        future = gen.convert_yielded(self.node_a.remote.call(CallMessage(request_id=7, procedure="com.myapp.add"), self.caller))
+        while not self.callee.sent:
+            yield gen.sleep(0)
+        _, on_lost = self.bridge.channels["tornwamp:node:a"]
+        on_lost()
+        answer, _ = yield future
+        self.assertEqual(answer.uri, "wamp.error.network_failure")
+        self.assertEqual(self.node_a.remote._pending_calls, {})
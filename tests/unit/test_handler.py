@@ -1,14 +1,18 @@
+import unittest
+
 from mock import patch
+from tornado import gen
 from tornado.concurrent import Future
 from tornado.httpclient import HTTPRequest
 from tornado.testing import AsyncHTTPTestCase, gen_test
 from tornado.web import Application
 from tornado.websocket import websocket_connect
 
-from tornwamp import messages, session, topic as tornwamp_topic
+from tornwamp import customize, dealer, messages, session, topic as tornwamp_topic
 from tornwamp.handler import WAMPHandler
 from tornwamp.processors.pubsub import customize as pubsub_customize
-from tornwamp.processors import rpc
+from tornwamp.processors import Processor, rpc
+from tornwamp.serializer import msgpack_serializer
 
 
 class MockWebsocket(object):
@@ -23,15 +27,26 @@ class MockConnection(object):
     def __init__(self):
         self._websocket = MockWebsocket()
         self.id = 1
+        self.topics = {"subscriber": {}, "publisher": {}}
 
     def add_subscription_channel(self, *args):
         pass
 
+    def send(self, data, binary=False, key=None):
+        self._websocket.write_message(data)
+
 
 class MockMessage(object):
     json = "mocked message"
 
 
+class SlowHelloProcessor(Processor):
+
+    async def process(self):
+        await gen.sleep(0.01)
+        self.answer_message = messages.WelcomeMessage(session_id=self.session_id)
+
+
 class UnauthorizeWAMPHandler(WAMPHandler):
 
     def authorize(self):
@@ -56,14 +71,15 @@ class WAMPHandlerTestCase(AsyncHTTPTestCase):
         ])
         return application
 
-    def build_request(self, path="ws", headers=None):
+    def build_request(self, path="ws", headers=None, subprotocols="wamp.2.json"):
         port = self.get_http_port()
         url = 'ws://0.0.0.0:{0}/{1}'.format(port, path)
         if not headers:
             headers = {}
         if 'Origin' not in headers:
             headers['Origin'] = 'http://0.0.0.0:%d' % port
-        headers['Sec-WebSocket-Protocol'] = 'wamp.2.json'
+        if subprotocols is not None:
+            headers['Sec-WebSocket-Protocol'] = subprotocols
         return HTTPRequest(url, headers=headers)
 
     @gen_test
@@ -79,6 +95,70 @@ class WAMPHandlerTestCase(AsyncHTTPTestCase):
         self.assertFalse(getattr(ws, "close_code", False))
         ws.close()
 
+    @unittest.skipIf(msgpack_serializer is None, "msgpack is not installed")
+    @gen_test
+    def test_async_processor(self):
+        request = self.build_request()
+        ws = yield websocket_connect(request)
+        with patch.dict(customize.processors, {messages.Code.HELLO: SlowHelloProcessor}):
+            ws.write_message(messages.HelloMessage(realm="burger.monday").json)
+            ws.write_message(messages.GoodbyeMessage(reason="close.up").json)
+
+            welcome = yield ws.read_message()
+            goodbye = yield ws.read_message()
+        self.assertIs(messages.decode_message(welcome).code, messages.Code.WELCOME)
+        self.assertIs(messages.decode_message(goodbye).code, messages.Code.GOODBYE)
+
+    @gen_test
+    def test_connection_without_subprotocol(self):
+        request = self.build_request(subprotocols=None)
+        ws = yield websocket_connect(request)
+        self.assertNotIn("Sec-WebSocket-Protocol", ws.headers)
+        ws.write_message(messages.HelloMessage(realm="burger.thursday").json)
+
+        response = yield ws.read_message()
+        self.assertIs(messages.Message.from_text(response).code, messages.Code.WELCOME)
+        ws.close()
+
+    @gen_test
+    def test_connection_with_unsupported_subprotocol(self):
+        request = self.build_request(subprotocols="wamp.2.cbor")
+        ws = yield websocket_connect(request)
+        self.assertNotIn("Sec-WebSocket-Protocol", ws.headers)
+        ws.write_message(messages.HelloMessage(realm="burger.thursday").json)
+
+        response = yield ws.read_message()
+        self.assertIs(messages.Message.from_text(response).code, messages.Code.WELCOME)
+        ws.close()
+
+    @gen_test
+    def test_connection_negotiates_msgpack(self):
+        request = self.build_request(subprotocols="wamp.2.cbor, wamp.2.msgpack, wamp.2.json")
+        ws = yield websocket_connect(request)
+        self.assertEqual(ws.headers["Sec-WebSocket-Protocol"], "wamp.2.msgpack")
+        msg = messages.HelloMessage(realm="burger.saturday")
+        ws.write_message(msg.encode(msgpack_serializer), binary=True)
+
+        response = yield ws.read_message()
+        self.assertIsInstance(response, bytes)
+        message = messages.decode_message(response, msgpack_serializer)
+        self.assertIs(message.code, messages.Code.WELCOME)
+        ws.close()
+
+    @gen_test
+    def test_connection_negotiates_batched_json(self):
+        request = self.build_request(subprotocols="wamp.2.json.batched")
+        ws = yield websocket_connect(request)
+        hello = messages.HelloMessage(realm="burger.sunday")
+        goodbye = messages.GoodbyeMessage(reason="close.up")
+        ws.write_message(u"{0}\x18{1}\x18".format(hello.json, goodbye.json))
+
+        welcome = yield ws.read_message()
+        self.assertTrue(welcome.endswith(u"\x18"))
+        self.assertIs(messages.decode_message(welcome[:-1]).code, messages.Code.WELCOME)
+        goodbye = yield ws.read_message()
+        self.assertIs(messages.decode_message(goodbye[:-1]).code, messages.Code.GOODBYE)
+
     @gen_test
     def test_connection_with_xforwardedfor(self):
         request = self.build_request(headers={"X-Forwarded-For": "10.0.0.1"})
@@ -111,6 +191,17 @@ class WAMPHandlerTestCase(AsyncHTTPTestCase):
         self.assertEqual(ws.close_code, 1)
         self.assertEqual(ws.close_reason, "Denied")
 
+    @gen_test
+    def test_invalid_message_aborts_connection(self):
+        request = self.build_request()
+        ws = yield websocket_connect(request)
+        ws.write_message('[32, 5, {}]')
+
+        text = yield ws.read_message()
+        message = messages.AbortMessage.from_text(text)
+        self.assertIs(message.code, messages.Code.ABORT)
+        self.assertEqual(message.reason, 'wamp.error.protocol_violation')
+
     @gen_test
     def test_goodbye_message_closes_connection(self):
         request = self.build_request()
@@ -145,7 +236,7 @@ class WAMPHandlerTestCase(AsyncHTTPTestCase):
         msg = messages.GoodbyeMessage(details={"message": "Closing for test purposes"}, reason="close.up")
         ws.write_message(msg.json)
         yield ws.read_message()
-        self.assertEqual(len(tornwamp_topic.topics["announcements"].subscribers), 0)
+        self.assertNotIn("announcements", tornwamp_topic.topics)
 
     @gen_test
     @patch("tornwamp.processors.pubsub.customize.authorize_subscription", return_value=(True, ""))
@@ -171,6 +262,28 @@ class WAMPHandlerTestCase(AsyncHTTPTestCase):
         event_msg = messages.EventMessage.from_text(text)
         self.assertEqual(event_msg.kwargs, {u'review': u'Mind blowing'})
 
+    @gen_test
+    def test_client_close_drops_registrations(self):
+        ws = yield websocket_connect(self.build_request())
+        ws.write_message(messages.RegisterMessage(request_id=1, procedure="test.closed.callee").json)
+        text = yield ws.read_message()
+        self.assertIs(messages.Message.from_text(text).code, messages.Code.REGISTERED)
+        self.assertEqual(len(session.connections), 1)
+
+        ws.close()
+        for _ in range(100):
+            if "test.closed.callee" not in dealer.registrations:
+                break
+            yield gen.sleep(0.01)
+        self.assertNotIn("test.closed.callee", dealer.registrations)
+        self.assertEqual(session.connections, {})
+
+        ws = yield websocket_connect(self.build_request())
+        ws.write_message(messages.RegisterMessage(request_id=2, procedure="test.closed.callee").json)
+        text = yield ws.read_message()
+        self.assertIs(messages.Message.from_text(text).code, messages.Code.REGISTERED)
+        ws.close()
+
     @gen_test
     def test_ping_rpc(self):
         request = self.build_request()
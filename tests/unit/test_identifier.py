@@ -7,23 +7,66 @@ from tornwamp import identifier
 class IdentifierTestCase(unittest.TestCase):
 
     def setUp(self):
-        identifier.existing_ids = []
+        self.old_global_ids = identifier.global_ids
+        identifier.global_ids = identifier.GlobalIdAllocator()
 
     def tearDown(self):
-        identifier.existing_ids = []
+        identifier.global_ids = self.old_global_ids
 
     @patch("tornwamp.identifier.random.randint", return_value=10)
     def test_create_global_id(self, randint):
-        self.assertEqual(identifier.existing_ids, [])
+        self.assertEqual(identifier.global_ids.existing_ids, set())
         new_id = identifier.create_global_id()
         self.assertEqual(new_id, 10)
-        self.assertEqual(identifier.existing_ids, [10])
+        self.assertEqual(identifier.global_ids.existing_ids, {10})
         self.assertEqual(randint.call_count, 1)
 
     @patch("tornwamp.identifier.random.randint", side_effect=[1105184, 604950])
     def test_create_global_id_random_hit(self, randint):
-        identifier.existing_ids = [1105184]
+        identifier.global_ids.existing_ids.add(1105184)
         new_id = identifier.create_global_id()
         self.assertEqual(new_id, 604950)
-        self.assertEqual(identifier.existing_ids, [1105184, 604950])
+        self.assertEqual(identifier.global_ids.existing_ids, {1105184, 604950})
         self.assertEqual(randint.call_count, 2)
+
+    @patch("tornwamp.identifier.random.randint", side_effect=[10, 10])
+    def test_release_global_id(self, randint):
+        self.assertEqual(identifier.create_global_id(), 10)
+        identifier.release_global_id(10)
+        self.assertEqual(identifier.global_ids.existing_ids, set())
+        self.assertEqual(identifier.create_global_id(), 10)
+
+    def test_release_unknown_global_id(self):
+        identifier.release_global_id(42)
+        self.assertEqual(identifier.global_ids.existing_ids, set())
+
+
+class RouterIdAllocatorTestCase(unittest.TestCase):
+
+    def test_create_sequential(self):
+        allocator = identifier.RouterIdAllocator()
+        self.assertEqual([allocator.create() for _ in range(3)], [1, 2, 3])
+
+    def test_create_skips_ids_in_use_after_wrapping(self):
+        allocator = identifier.RouterIdAllocator()
+        first = allocator.create()
+        allocator._last_id = identifier.MAX_ID
+        self.assertEqual(allocator.create(), first + 1)
+
+    def test_release(self):
+        allocator = identifier.RouterIdAllocator()
+        new_id = allocator.create()
+        allocator.release(new_id)
+        self.assertEqual(allocator.existing_ids, set())
+
+
+class SessionIdAllocatorTestCase(unittest.TestCase):
+
+    def test_create_incremental(self):
+        allocator = identifier.SessionIdAllocator()
+        self.assertEqual([allocator.create() for _ in range(3)], [1, 2, 3])
+
+    def test_create_wraps(self):
+        allocator = identifier.SessionIdAllocator()
+        allocator._last_id = identifier.MAX_ID
+        self.assertEqual(allocator.create(), 1)
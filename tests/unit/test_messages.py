@@ -1,5 +1,8 @@
+import json
 import unittest
 
+from mock import patch
+
 from tornwamp import messages as wamp
 from tornwamp.messages import Code
 from tornwamp.identifier import MIN_ID, MAX_ID
@@ -14,6 +17,20 @@ class MessageTestCase(unittest.TestCase):
         self.assertEqual(message.value, raw)
         self.assertEqual(message.json, '[1, "somerealm", {}]')
 
+    def test_wire_value(self):
+        kwargs = {"nested": [{"a": 1}]}
+        message = wamp.ErrorMessage(request_code=Code.CALL, request_id=3, uri="a.b", kwargs=kwargs)
+        wire_value = message.wire_value
+        self.assertEqual(wire_value, [8, 48, 3, {}, "a.b", [], kwargs])
+        self.assertIs(type(wire_value[0]), int)
+        self.assertIs(type(wire_value[1]), int)
+        self.assertIs(wire_value[-1], kwargs)
+        self.assertIs(message.value[0], Code.ERROR)
+
+    def test_json_with_codes(self):
+        message = wamp.ErrorMessage(request_code=Code.CALL, request_id=3, uri="a.b")
+        self.assertEqual(message.json, '[8, 48, 3, {}, "a.b"]')
+
     def test_message_without_id(self):
         raw = [201]
         message = wamp.Message(*raw)
@@ -198,3 +215,230 @@ class MessageTestCase(unittest.TestCase):
         self.assertEqual(unsubscribed_message.request_id, 723)
         expected = [35, 723]
         self.assertEqual(unsubscribed_message.value, expected)
+
+    def test_register_message(self):
+        register_message = wamp.RegisterMessage(request_id=25, procedure="com.myapp.echo")
+        self.assertEqual(register_message.code, Code.REGISTER)
+        self.assertEqual(register_message.options, {})
+        expected = [64, 25, {}, "com.myapp.echo"]
+        self.assertEqual(register_message.value, expected)
+
+    def test_registered_message(self):
+        registered_message = wamp.RegisteredMessage(request_id=25, registration_id=2103)
+        self.assertEqual(registered_message.code, Code.REGISTERED)
+        expected = [65, 25, 2103]
+        self.assertEqual(registered_message.value, expected)
+
+    def test_unregister_message(self):
+        unregister_message = wamp.UnregisterMessage(request_id=788, registration_id=2103)
+        self.assertEqual(unregister_message.code, Code.UNREGISTER)
+        expected = [66, 788, 2103]
+        self.assertEqual(unregister_message.value, expected)
+
+    def test_unregistered_message(self):
+        unregistered_message = wamp.UnregisteredMessage(request_id=788)
+        self.assertEqual(unregistered_message.code, Code.UNREGISTERED)
+        expected = [67, 788]
+        self.assertEqual(unregistered_message.value, expected)
+
+    def test_invocation_message(self):
+        invocation_message = wamp.InvocationMessage(request_id=6131, registration_id=2103, args=["Hello"], kwargs={"lang": "en"})
+        self.assertEqual(invocation_message.code, Code.INVOCATION)
+        expected = [68, 6131, 2103, {}, ["Hello"], {"lang": "en"}]
+        self.assertEqual(invocation_message.value, expected)
+
+    def test_yield_message(self):
+        yield_message = wamp.YieldMessage(request_id=6131, args=["Hello"])
+        self.assertEqual(yield_message.code, Code.YIELD)
+        expected = [70, 6131, {}, ["Hello"]]
+        self.assertEqual(yield_message.value, expected)
+
+    def test_cancel_message(self):
+        cancel_message = wamp.CancelMessage(request_id=7814135, options={"mode": "kill"})
+        self.assertEqual(cancel_message.code, Code.CANCEL)
+        expected = [49, 7814135, {"mode": "kill"}]
+        self.assertEqual(cancel_message.value, expected)
+
+    def test_interrupt_message(self):
+        interrupt_message = wamp.InterruptMessage(request_id=43, options={"mode": "killnowait"})
+        self.assertEqual(interrupt_message.code, Code.INTERRUPT)
+        expected = [69, 43, {"mode": "killnowait"}]
+        self.assertEqual(interrupt_message.value, expected)
+
+    def test_decode_yield_message(self):
+        msg = wamp.decode_message('[70, 6131, {}, [30], {"unit": "s"}]')
+        self.assertIsInstance(msg, wamp.YieldMessage)
+        self.assertEqual(msg.args, [30])
+        self.assertEqual(msg.kwargs, {"unit": "s"})
+
+    def test_event_message_json_template(self):
+        event_message = wamp.EventMessage(publication_id=27, args=["a"], kwargs={"b": 1})
+        template = event_message.json_template
+        expected = wamp.EventMessage(subscription_id=74, publication_id=27, args=["a"], kwargs={"b": 1}).json
+        self.assertEqual(template.render(74), expected)
+
+    def test_event_message_json_template_string_subscription_id(self):
+        event_message = wamp.EventMessage(publication_id="1", kwargs={"type": "test"})
+        template = event_message.json_template
+        self.assertEqual(template.render("7"), '[36, "7", "1", {}, [], {"type": "test"}]')
+
+    def test_event_message_json_template_does_not_change_message(self):
+        event_message = wamp.EventMessage(subscription_id=3, publication_id=27)
+        event_message.json_template.render(74)
+        self.assertEqual(event_message.value, [36, 3, 27, {}])
+
+    def test_event_message_with_topic(self):
+        event_message = wamp.EventMessage(subscription_id=3, publication_id=27, details={"publisher": 1}, args=["a"])
+        copy = event_message.with_topic("a.topic")
+        self.assertEqual(copy.value, [36, None, 27, {"publisher": 1, "topic": "a.topic"}, ["a"]])
+        self.assertEqual(event_message.details, {"publisher": 1})
+
+    def test_decode_message(self):
+        msg = wamp.decode_message('[32, 1395, {}, "lesson.1"]')
+        self.assertIsInstance(msg, wamp.SubscribeMessage)
+        self.assertIs(msg.code, Code.SUBSCRIBE)
+        self.assertEqual(msg.request_id, 1395)
+        self.assertEqual(msg.topic, "lesson.1")
+
+    def test_decode_message_with_args_and_kwargs(self):
+        msg = wamp.decode_message('[16, 514, {}, "zazie", [1], {"a": 2}]')
+        self.assertIsInstance(msg, wamp.PublishMessage)
+        self.assertEqual(msg.args, [1])
+        self.assertEqual(msg.kwargs, {"a": 2})
+
+    def test_decode_message_unsupported_code(self):
+        msg = wamp.decode_message('[456, 34, "wamp.undefined.message"]')
+        self.assertIs(type(msg), wamp.Message)
+        self.assertEqual(msg.code, 456)
+        self.assertEqual(msg.id, 34)
+
+    def test_decode_message_wrong_arity(self):
+        with self.assertRaises(wamp.InvalidMessageError) as error:
+            wamp.decode_message('[32, 1395, {}]')
+        self.assertEqual(str(error.exception), "SUBSCRIBE message must have from 4 to 4 elements: [32, 1395, {}]")
+
+    def test_decode_message_invalid_json(self):
+        with self.assertRaises(wamp.InvalidMessageError):
+            wamp.decode_message('[32, ')
+
+    def test_decode_message_not_a_list(self):
+        with self.assertRaises(wamp.InvalidMessageError):
+            wamp.decode_message('{"code": 32}')
+
+    def test_decode_message_bool_code(self):
+        with self.assertRaises(wamp.InvalidMessageError):
+            wamp.decode_message('[true, "realm", {}]')
+
+    def test_decode_message_null_request_id(self):
+        with self.assertRaises(wamp.InvalidMessageError) as error:
+            wamp.decode_message('[32, null, {}, "t"]')
+        self.assertEqual(str(error.exception), 'SUBSCRIBE message element 1 must be of type int: [32, null, {}, "t"]')
+
+    def test_decode_message_null_procedure(self):
+        with self.assertRaises(wamp.InvalidMessageError):
+            wamp.decode_message('[48, 1, {}, null]')
+
+    def test_decode_message_null_subscription_id(self):
+        with self.assertRaises(wamp.InvalidMessageError):
+            wamp.decode_message('[34, 1, null]')
+
+    def test_decode_message_bool_id(self):
+        with self.assertRaises(wamp.InvalidMessageError):
+            wamp.decode_message('[34, true, {}]')
+
+    def test_decode_message_constructor_fails(self):
+        with patch.object(wamp.CancelMessage, "types", ()):
+            with self.assertRaises(wamp.InvalidMessageError):
+                wamp.decode_message('[49, null, {}]')
+
+    def test_message_types_match_arity(self):
+        for MsgClass in wamp.CODE_TO_CLASS.values():
+            self.assertEqual(len(MsgClass.types), MsgClass.arity[1] - 1, MsgClass.__name__)
+
+
+class BroadcastMessageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.old_format_version = wamp.BROADCAST_FORMAT_VERSION
+        self.event_message = wamp.EventMessage(subscription_id=5, publication_id=27, args=[u"café"], kwargs={"b": "\n"})
+
+    def tearDown(self):
+        wamp.BROADCAST_FORMAT_VERSION = self.old_format_version
+
+    def test_json_is_not_nested(self):
+        text = wamp.BroadcastMessage("a.topic", self.event_message, 3).json
+        version, header, event_text = text.split("\n", 2)
+        self.assertEqual(version, "2")
+        self.assertEqual(json.loads(header), {
+            "publisher_node_id": wamp.PUBLISHER_NODE_ID.hex,
+            "publisher_connection_id": 3,
+            "topic_name": "a.topic",
+        })
+        self.assertEqual(json.loads(event_text), [36, wamp.SUBSCRIPTION_ID_PLACEHOLDER, 27, {}, [u"café"], {"b": "\n"}])
+
+    def test_from_text(self):
+        text = wamp.BroadcastMessage("a.topic", self.event_message, 3).json
+        msg = wamp.BroadcastMessage.from_text(text)
+        self.assertEqual(msg.topic_name, "a.topic")
+        self.assertEqual(msg.publisher_connection_id, 3)
+        self.assertEqual(msg.publisher_node_id, wamp.PUBLISHER_NODE_ID.hex)
+        self.assertIsInstance(msg.event_message, wamp.EncodedEventMessage)
+        self.assertEqual(msg.json, text)
+        self.assertIsNone(msg.publisher_host_id)
+
+    @patch.object(wamp, "PUBLISHER_HOST_ID", "host")
+    def test_from_text_with_host_id(self):
+        text = wamp.BroadcastMessage("a.topic", self.event_message, 3).json
+        self.assertEqual(json.loads(text.split("\n", 2)[1])["publisher_host_id"], "host")
+        msg = wamp.BroadcastMessage.from_text(text)
+        self.assertEqual(msg.publisher_host_id, "host")
+        self.assertEqual(msg.json, text)
+
+    def test_is_local(self):
+        msg = wamp.BroadcastMessage("a.topic", self.event_message, 3)
+        self.assertTrue(msg.is_local)
+        msg.publisher_node_id = "another node"
+        self.assertFalse(msg.is_local)
+
+    @patch.object(wamp, "PUBLISHER_HOST_ID", "host")
+    def test_is_local_same_host(self):
+        msg = wamp.BroadcastMessage("a.topic", self.event_message, 3)
+        msg.publisher_node_id = "another worker"
+        self.assertTrue(msg.is_local)
+        msg.publisher_host_id = "another host"
+        self.assertFalse(msg.is_local)
+
+    def test_from_text_legacy_format(self):
+        wamp.BROADCAST_FORMAT_VERSION = 1
+        text = wamp.BroadcastMessage("a.topic", self.event_message, 3).json
+        self.assertEqual(json.loads(text)["event_message"], self.event_message.json)
+        msg = wamp.BroadcastMessage.from_text(text)
+        self.assertEqual(msg.topic_name, "a.topic")
+        self.assertEqual(msg.event_message.value, self.event_message.value)
+
+    def test_from_text_unsupported_version(self):
+        with self.assertRaises(wamp.InvalidMessageError):
+            wamp.BroadcastMessage.from_text('3\n{}\n[36]')
+
+    def test_encoded_event_json_template_does_not_parse(self):
+        text = wamp.BroadcastMessage("a.topic", self.event_message, 3).json
+        event_message = wamp.BroadcastMessage.from_text(text).event_message
+        with patch.object(wamp.json_serializer, "loads") as loads:
+            rendered = event_message.json_template.render(9)
+        self.assertFalse(loads.called)
+        self.assertEqual(json.loads(rendered), [36, 9, 27, {}, [u"café"], {"b": "\n"}])
+
+    def test_encoded_event_with_topic(self):
+        text = wamp.BroadcastMessage("a.topic", self.event_message, 3).json
+        event_message = wamp.BroadcastMessage.from_text(text).event_message.with_topic("a.topic")
+        self.assertEqual(event_message.value, [Code.EVENT, None, 27, {"topic": "a.topic"}, [u"café"], {"b": "\n"}])
+
+    def test_encoded_event_content(self):
+        text = wamp.BroadcastMessage("a.topic", self.event_message, 3).json
+        event_message = wamp.BroadcastMessage.from_text(text).event_message
+        event_message.subscription_id = 9
+        self.assertEqual(event_message.publication_id, 27)
+        self.assertEqual(event_message.args, [u"café"])
+        self.assertEqual(event_message.kwargs, {"b": "\n"})
+        self.assertEqual(event_message.value, [Code.EVENT, 9, 27, {}, [u"café"], {"b": "\n"}])
+        self.assertEqual(event_message.json, wamp.EventMessage(subscription_id=9, publication_id=27, args=[u"café"], kwargs={"b": "\n"}).json)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import importlib
+import json
+import unittest
+
+from tornwamp import messages, serializer
+from tornwamp.messages import Code
+
+
+def is_installed(module_name):
+    try:
+        importlib.import_module(module_name)
+    except ImportError:
+        return False
+    return True
+
+
+# messages which all backends must encode exactly as the compact
+# (separators without whitespace, non-ASCII characters kept) stdlib encoding
+CONFORMANCE_MESSAGES = [
+    messages.HelloMessage(realm="realm1", details={"roles": {"subscriber": {}}}),
+    messages.WelcomeMessage(session_id=9007199254740992),
+    messages.ErrorMessage(request_code=Code.CALL, request_id=1, uri="wamp.error.no_such_procedure", args=["unknown"]),
+    messages.PublishMessage(request_id=2, topic="com.example/topic", args=[1, 2.5, -3], kwargs={"ok": True, "missing": None}),
+    messages.EventMessage(subscription_id=3, publication_id=4, args=[u"café", u"日本語", u"\U0001F600"]),
+    messages.EventMessage(subscription_id=5, publication_id=6, kwargs={"control": u"tab\tnew line\n\x01", "quote": u'"\\'}),
+    messages.ResultMessage(request_id=7, args=[[{"nested": [{"deep": [0.1, 100]}]}]]),
+]
+
+# values which all backends must decode to the same value as the stdlib,
+# though their encoding may differ (e.g. exponent notation)
+EQUIVALENCE_VALUES = [
+    [36, 1, 2, {}, [1e20, 1.5e-7, 0.0, -0.5]],
+    [50, 1, {}, [], {"big": 2 ** 53, "small": -2 ** 53}],
+]
+
+
+class SerializerConformanceMixin(object):
+    backend = None
+
+    def setUp(self):
+        self.serializer = serializer.JSONSerializer(self.backend)
+
+    def test_backend(self):
+        self.assertEqual(self.serializer.backend, self.backend)
+
+    def test_encoding_matches_compact_stdlib(self):
+        for message in CONFORMANCE_MESSAGES:
+            expected = json.dumps(message.wire_value, separators=(",", ":"), ensure_ascii=False)
+            if self.backend == "json":
+                expected = json.dumps(message.wire_value)
+            self.assertEqual(self.serializer.dumps(message.wire_value), expected)
+
+    def test_round_trip(self):
+        for message in CONFORMANCE_MESSAGES:
+            text = self.serializer.dumps(message.wire_value)
+            self.assertEqual(self.serializer.loads(text), message.wire_value)
+            self.assertEqual(json.loads(text), message.wire_value)
+
+    def test_decoding_matches_stdlib(self):
+        for value in EQUIVALENCE_VALUES:
+            text = self.serializer.dumps(value)
+            self.assertEqual(json.loads(text), value)
+            self.assertEqual(self.serializer.loads(json.dumps(value)), value)
+
+    def test_encodes_text(self):
+        self.assertIsInstance(self.serializer.dumps([1]), type(u""))
+
+    def test_invalid_json(self):
+        with self.assertRaises(ValueError):
+            self.serializer.loads("[1, ")
+
+
+class StdlibSerializerTestCase(SerializerConformanceMixin, unittest.TestCase):
+    backend = "json"
+
+
+@unittest.skipUnless(is_installed("orjson"), "orjson is not installed")
+class OrjsonSerializerTestCase(SerializerConformanceMixin, unittest.TestCase):
+    backend = "orjson"
+
+
+@unittest.skipUnless(is_installed("ujson"), "ujson is not installed")
+class UjsonSerializerTestCase(SerializerConformanceMixin, unittest.TestCase):
+    backend = "ujson"
+
+
+@unittest.skipUnless(is_installed("rapidjson"), "python-rapidjson is not installed")
+class RapidjsonSerializerTestCase(SerializerConformanceMixin, unittest.TestCase):
+    backend = "rapidjson"
+
+
+class SelectJSONBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.old_backend = serializer.json_serializer.backend
+
+    def tearDown(self):
+        serializer.select_json_backend(self.old_backend)
+
+    def test_default_backend(self):
+        self.assertEqual(serializer.JSONSerializer().backend, "json")
+
+    def test_auto(self):
+        backend = serializer.select_json_backend("auto")
+        installed = [name for name in serializer.JSON_BACKENDS if is_installed(name)]
+        self.assertEqual(backend, installed[0])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(serializer.SerializerUnavailableError):
+            serializer.select_json_backend("yaml")
+        self.assertEqual(serializer.json_serializer.backend, self.old_backend)
+
+    def test_messages_use_selected_backend(self):
+        serializer.select_json_backend("json")
+        message = messages.EventMessage(subscription_id=1, publication_id=2, args=["a"])
+        self.assertEqual(message.json, '[36, 1, 2, {}, ["a"]]')
+        if is_installed("orjson"):
+            serializer.select_json_backend("orjson")
+            self.assertEqual(message.json, '[36,1,2,{},["a"]]')
+            self.assertEqual(message.json_template.render(1), '[36,1,2,{},["a"]]')
+            self.assertIsInstance(messages.decode_message(message.json), messages.EventMessage)
+
+
+@unittest.skipUnless(is_installed("msgpack"), "msgpack is not installed")
+class MsgpackSerializerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.serializer = serializer.MsgpackSerializer()
+
+    def test_round_trip(self):
+        for message in CONFORMANCE_MESSAGES:
+            data = self.serializer.dumps(message.wire_value)
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(self.serializer.loads(data), message.wire_value)
+
+    def test_invalid_data_raises_value_error(self):
+        for data in [b"\xc1", b"\x93\x01", u"[1, 2]"]:
+            with self.assertRaises(ValueError):
+                self.serializer.loads(data)
+
+    def test_decode_message(self):
+        message = messages.SubscribeMessage(request_id=1, topic="com.example")
+        decoded = messages.decode_message(message.encode(self.serializer), self.serializer)
+        self.assertIsInstance(decoded, messages.SubscribeMessage)
+        self.assertEqual(decoded.topic, "com.example")
+
+    def test_event_template(self):
+        message = messages.EventMessage(subscription_id=None, publication_id=2, args=[u"café"], kwargs={"a": [1]})
+        template = message.template(self.serializer)
+        for subscription_id in [0, 127, 2 ** 40, "sub"]:
+            message.subscription_id = subscription_id
+            self.assertEqual(template.render(subscription_id), message.encode(self.serializer))
+
+
+class SerializerRegistryTestCase(unittest.TestCase):
+
+    def test_json_is_registered(self):
+        self.assertIs(serializer.serializers["wamp.2.json"], serializer.json_serializer)
+
+    def test_get_serializer_follows_client_preference(self):
+        if serializer.msgpack_serializer is not None:
+            self.assertIs(serializer.get_serializer(["wamp.2.msgpack", "wamp.2.json"]), serializer.msgpack_serializer)
+        self.assertIs(serializer.get_serializer(["wamp.2.cbor", "wamp.2.json"]), serializer.json_serializer)
+
+    def test_get_serializer_unsupported(self):
+        self.assertIsNone(serializer.get_serializer(["wamp.2.cbor"]))
+        self.assertIsNone(serializer.get_serializer([]))
+
+
+class BatchedSerializerTestCase(unittest.TestCase):
+
+    def test_json(self):
+        batched = serializer.serializers["wamp.2.json.batched"]
+        self.assertFalse(batched.binary)
+        self.assertTrue(batched.batched)
+        frame = batched.join(['[1, "a"]', '[2]'])
+        self.assertEqual(frame, u'[1, "a"]\x18[2]\x18')
+        self.assertEqual(batched.split(frame), ['[1, "a"]', '[2]'])
+        self.assertEqual(batched.loads(batched.split(frame)[0]), [1, "a"])
+
+    def test_json_invalid_frame(self):
+        batched = serializer.serializers["wamp.2.json.batched"]
+        with self.assertRaises(ValueError):
+            batched.split(u'[1]\x18[2]')
+
+    def test_json_binary_frame(self):
+        batched = serializer.serializers["wamp.2.json.batched"]
+        with self.assertRaises(ValueError):
+            batched.split(b'[1]\x18')
+
+    @unittest.skipUnless(is_installed("msgpack"), "msgpack is not installed")
+    def test_msgpack(self):
+        batched = serializer.serializers["wamp.2.msgpack.batched"]
+        self.assertTrue(batched.binary)
+        messages = [batched.dumps([1, "a" * 300]), batched.dumps([2])]
+        frame = batched.join(messages)
+        self.assertEqual(frame[:4], b"\x00\x00\x01\x31")
+        self.assertEqual(batched.split(frame), messages)
+
+    @unittest.skipUnless(is_installed("msgpack"), "msgpack is not installed")
+    def test_msgpack_invalid_frame(self):
+        batched = serializer.serializers["wamp.2.msgpack.batched"]
+        frame = batched.join([batched.dumps([1])])
+        for invalid_frame in [frame[:-1], frame + b"\x00"]:
+            with self.assertRaises(ValueError):
+                batched.split(invalid_frame)
+
+    @unittest.skipUnless(is_installed("msgpack"), "msgpack is not installed")
+    def test_msgpack_text_frame(self):
+        batched = serializer.serializers["wamp.2.msgpack.batched"]
+        with self.assertRaises(ValueError):
+            batched.split(u"\x00\x00\x00\x01x")
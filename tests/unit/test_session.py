@@ -3,6 +3,13 @@ import unittest
 from datetime import datetime
 
 from mock import patch, MagicMock
+from tornado.concurrent import Future
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.websocket import WebSocketClosedError
+
+from tornwamp import session
+from tornwamp.serializer import serializers
 from tornwamp.session import ClientConnection, ConnectionDict
 
 
@@ -112,6 +119,233 @@ class ClientConnectionTestCase(unittest.TestCase):
         self.assertEqual(topics, expected_topics)
 
 
+class MockWebsocket(object):
+
+    def __init__(self):
+        self.written = []
+        self.futures = []
+
+    def write_message(self, data, binary=False):
+        self.written.append((data, binary))
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def flush(self):
+        "Resolve the pending write, as the IOStream would once it is flushed"
+        future = self.futures.pop(0)
+        future.set_result(None)
+        return future
+
+
+class OutboundQueueTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(OutboundQueueTestCase, self).setUp()
+        self.old_limits = (session.OUTBOUND_QUEUE_MAX_MESSAGES, session.OUTBOUND_QUEUE_MAX_BYTES, session.OUTBOUND_QUEUE_POLICY)
+        session.OUTBOUND_QUEUE_MAX_MESSAGES = 2
+        session.OUTBOUND_QUEUE_MAX_BYTES = None
+        session.outbound_queue_metrics.clear()
+        self.websocket = MockWebsocket()
+        self.connection = ClientConnection(self.websocket)
+
+    def tearDown(self):
+        session.OUTBOUND_QUEUE_MAX_MESSAGES, session.OUTBOUND_QUEUE_MAX_BYTES, session.OUTBOUND_QUEUE_POLICY = self.old_limits
+        super(OutboundQueueTestCase, self).tearDown()
+
+    def written(self):
+        return [data for data, _ in self.websocket.written]
+
+    def write_done(self):
+        self.connection._on_write_done(self.websocket.flush())
+
+    def test_send_writes_when_idle(self):
+        self.connection.send("a")
+        self.connection.send(b"b", binary=True)
+        self.assertEqual(self.websocket.written, [("a", False)])
+        self.write_done()
+        self.assertEqual(self.websocket.written, [("a", False), (b"b", True)])
+
+    def test_queued_messages_are_written_at_once(self):
+        for data in "abc":
+            self.connection.send(data)
+        self.assertEqual(self.connection.outbound_queue_size, 2)
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "b", "c"])
+        self.assertEqual(self.connection.outbound_queue_size, 0)
+        self.assertEqual(len(self.websocket.futures), 2)
+        self.connection.send("d")
+        self.assertEqual(self.written(), ["a", "b", "c"])
+
+    def test_websocket_without_futures(self):
+        connection = ClientConnection(MagicMock())
+        connection.send("a")
+        connection.send("b")
+        self.assertEqual(connection._websocket.write_message.call_count, 2)
+
+    def test_drop_oldest(self):
+        session.OUTBOUND_QUEUE_POLICY = "drop_oldest"
+        for data in "abcd":
+            self.connection.send(data, key="x")
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "c", "d"])
+        self.assertEqual(session.outbound_queue_metrics, {"drop_oldest": 1})
+
+    def test_drop_oldest_by_bytes(self):
+        session.OUTBOUND_QUEUE_MAX_MESSAGES = None
+        session.OUTBOUND_QUEUE_MAX_BYTES = 5
+        session.OUTBOUND_QUEUE_POLICY = "drop_oldest"
+        for data in ["a", "bb", "ccc", "dddd"]:
+            self.connection.send(data, key="x")
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "dddd"])
+
+    def test_drop_oldest_keeps_answers(self):
+        session.OUTBOUND_QUEUE_POLICY = "drop_oldest"
+        self.connection.send("a")
+        self.connection.send("b")
+        self.connection.send("c", key="x")
+        self.connection.send("d", key="x")
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "b", "d"])
+
+    def test_drop_newest(self):
+        session.OUTBOUND_QUEUE_POLICY = "drop_newest"
+        for data in "abcd":
+            self.connection.send(data, key="x")
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "b", "c"])
+        self.assertEqual(session.outbound_queue_metrics, {"drop_newest": 1})
+
+    def test_answer_drops_oldest_event(self):
+        session.OUTBOUND_QUEUE_POLICY = "drop_newest"
+        self.connection.send("a")
+        self.connection.send("b", key="x")
+        self.connection.send("c")
+        self.connection.send("d")
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "c", "d"])
+        self.assertEqual(session.outbound_queue_metrics, {"drop_oldest": 1})
+
+    @patch("tornwamp.session.ioloop")
+    def test_answer_disconnects_when_only_answers_are_queued(self, mock_ioloop):
+        session.OUTBOUND_QUEUE_POLICY = "drop_oldest"
+        for data in "abcd":
+            self.connection.send(data)
+        mock_ioloop.IOLoop.current.return_value.add_callback.assert_called_once_with(self.connection.zombify)
+        self.assertEqual(self.connection.outbound_queue_size, 0)
+        self.assertEqual(session.outbound_queue_metrics, {"disconnect": 1})
+
+    def test_send_to_closed_websocket(self):
+        websocket = MagicMock()
+        websocket.write_message.side_effect = WebSocketClosedError()
+        connection = ClientConnection(websocket)
+        connection.send("a")
+        self.assertEqual(connection.outbound_queue_size, 0)
+
+    def test_coalesce(self):
+        session.OUTBOUND_QUEUE_POLICY = "coalesce"
+        self.connection.send("a", key="x")
+        self.connection.send("b", key="x")
+        self.connection.send("c", key="y")
+        self.connection.send("d", key="x")
+        self.connection.send("e", key="z")
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "c", "e"])
+        self.assertEqual(session.outbound_queue_metrics, {"coalesce": 1, "drop_oldest": 1})
+
+    @patch("tornwamp.session.ioloop")
+    def test_disconnect(self, mock_ioloop):
+        session.OUTBOUND_QUEUE_POLICY = "disconnect"
+        for data in "abcd":
+            self.connection.send(data)
+        mock_ioloop.IOLoop.current.return_value.add_callback.assert_called_once_with(self.connection.zombify)
+        self.connection.send("e")
+        self.write_done()
+        self.assertEqual(self.written(), ["a"])
+        self.assertEqual(session.outbound_queue_metrics, {"disconnect": 1})
+
+    def test_failed_write_drops_queue(self):
+        self.connection.send("a")
+        self.connection.send("b")
+        future = self.websocket.futures.pop(0)
+        future.set_exception(WebSocketClosedError())
+        self.connection._on_write_done(future)
+        self.assertEqual(self.connection.outbound_queue_size, 0)
+        self.assertEqual(self.written(), ["a"])
+
+    def test_flush(self):
+        for data in "abc":
+            self.connection.send(data)
+        self.connection.flush()
+        self.assertEqual(self.written(), ["a", "b", "c"])
+        self.write_done()
+        self.assertEqual(self.written(), ["a", "b", "c"])
+
+    @gen_test
+    def test_drain(self):
+        yield self.connection.drain()
+        for data in "abc":
+            self.connection.send(data)
+        draining = gen.convert_yielded(self.connection.drain(1))
+        yield gen.sleep(0)
+        self.assertFalse(draining.done())
+        self.websocket.flush()
+        yield draining
+        self.assertEqual(self.written(), ["a", "b", "c"])
+
+    @gen_test
+    def test_drain_closed_websocket(self):
+        for data in "ab":
+            self.connection.send(data)
+        draining = gen.convert_yielded(self.connection.drain())
+        self.websocket.futures.pop(0).set_exception(WebSocketClosedError())
+        yield draining
+        self.assertEqual(self.connection.outbound_queue_size, 0)
+
+
+@patch("tornwamp.session.ioloop")
+class BatchWritesTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(BatchWritesTestCase, self).setUp()
+        self.websocket = MockWebsocket()
+        self.connection = ClientConnection(self.websocket)
+        self.connection.batch_writes = True
+
+    def test_messages_are_written_once_per_iteration(self, mock_ioloop):
+        self.connection.send("a")
+        self.connection.send("b")
+        self.assertEqual(self.websocket.written, [])
+        mock_ioloop.IOLoop.current.return_value.add_callback.assert_called_once_with(self.connection._flush_batch)
+        self.connection._flush_batch()
+        self.assertEqual(self.websocket.written, [("a", False), ("b", False)])
+        self.connection.send("c")
+        self.assertEqual(mock_ioloop.IOLoop.current.return_value.add_callback.call_count, 2)
+
+    def test_batched_subprotocol_gets_single_frame(self, mock_ioloop):
+        self.connection.serializer = serializers["wamp.2.json.batched"]
+        self.connection.send("[1]")
+        self.connection.send("[2]")
+        self.connection._flush_batch()
+        self.assertEqual(self.websocket.written, [(u"[1]\x18[2]\x18", False)])
+
+    def test_flush_waits_for_pending_write(self, mock_ioloop):
+        self.connection.send("a")
+        self.connection._flush_batch()
+        self.connection.send("b")
+        self.connection._flush_batch()
+        self.assertEqual(self.websocket.written, [("a", False)])
+        self.connection._on_write_done(self.websocket.flush())
+        self.assertEqual(self.websocket.written, [("a", False), ("b", False)])
+
+    def test_batched_subprotocol_without_batch_writes(self, mock_ioloop):
+        self.connection.batch_writes = False
+        self.connection.serializer = serializers["wamp.2.json.batched"]
+        self.connection.send("[1]")
+        self.assertEqual(self.websocket.written, [(u"[1]\x18", False)])
+
+
 class ConnectionDicttestCase(unittest.TestCase):
 
     @patch("tornwamp.session.datetime")
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, patch
+from tornado.testing import AsyncTestCase
+
+from tornwamp import messages, supervisor, topic as tornwamp_topic
+
+
+class StartWorkerTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(StartWorkerTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = patch.object(messages, "PUBLISHER_NODE_ID", messages.PUBLISHER_NODE_ID)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        tornwamp_topic.topics.bus.close()
+        tornwamp_topic.topics.bus = None
+        super(StartWorkerTestCase, self).tearDown()
+
+    @patch("tornwamp.supervisor.netutil.bind_sockets", return_value=["socket"])
+    @patch("tornwamp.supervisor.httpserver.HTTPServer")
+    def test_start_worker(self, mock_server, mock_bind):
+        application = MagicMock()
+        node_id = messages.PUBLISHER_NODE_ID
+        server = supervisor.start_worker(application, 8888, None, 1, 4, self.directory)
+        self.assertIs(server, mock_server.return_value)
+        mock_server.assert_called_once_with(application)
+        mock_bind.assert_called_once_with(8888, address=None, reuse_port=True)
+        server.add_sockets.assert_called_once_with(["socket"])
+        self.assertNotEqual(messages.PUBLISHER_NODE_ID, node_id)
+        bus = tornwamp_topic.topics.bus
+        self.assertEqual((bus.worker_id, bus.workers), (1, 4))
+        self.assertEqual(bus.on_message, tornwamp_topic.topics.receive)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "worker-1.sock")))
+
+
+@patch.object(messages, "PUBLISHER_HOST_ID", None)
+class RunTestCase(AsyncTestCase):
+
+    @patch("tornwamp.supervisor.ioloop")
+    @patch("tornwamp.supervisor.start_worker")
+    @patch("tornwamp.supervisor.process.fork_processes", return_value=2)
+    def test_run_worker(self, mock_fork, mock_start_worker, mock_ioloop):
+        application = MagicMock()
+        supervisor.run(application, 8888, workers=3, bus_directory="/tmp/bus")
+        mock_fork.assert_called_once_with(3, max_restarts=supervisor.MAX_RESTARTS)
+        mock_start_worker.assert_called_once_with(application, 8888, None, 2, 3, "/tmp/bus")
+        self.assertTrue(mock_ioloop.IOLoop.current.return_value.start.called)
+        self.assertIsNotNone(messages.PUBLISHER_HOST_ID)
+
+    @patch("tornwamp.supervisor.process.cpu_count", return_value=8)
+    @patch("tornwamp.supervisor.process.fork_processes", side_effect=SystemExit(0))
+    def test_run_supervisor_removes_bus_directory(self, mock_fork, mock_cpu_count):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        with patch("tornwamp.supervisor.tempfile.mkdtemp", return_value=directory):
+            with self.assertRaises(SystemExit):
+                supervisor.run(MagicMock(), 8888)
+        mock_fork.assert_called_once_with(8, max_restarts=supervisor.MAX_RESTARTS)
+        self.assertFalse(os.path.exists(directory))
+
+    @patch("tornwamp.supervisor.process.fork_processes", side_effect=SystemExit(0))
+    def test_run_supervisor_keeps_given_bus_directory(self, mock_fork):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.assertRaises(SystemExit):
+            supervisor.run(MagicMock(), 8888, workers=2, bus_directory=directory)
+        self.assertTrue(os.path.exists(directory))
@@ -1,9 +1,15 @@
+import fnmatch
 import unittest
 
-from mock import patch
+from mock import MagicMock, call, patch
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.websocket import WebSocketClosedError
+from tornadis import ClientError, ConnectionError, TornadisException
 
-from tornwamp import topic as tornwamp_topic
+from tornwamp import dealer, identifier, topic as tornwamp_topic
 from tornwamp.messages import EventMessage, BroadcastMessage
+from tornwamp.serializer import msgpack_serializer
 from tornwamp.session import ClientConnection
 from tornwamp.topic import Topic, TopicsManager
 
@@ -15,10 +21,10 @@ class MockSubscriber(object):
 class TopicTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.old_customize = tornwamp_topic.customize
+        self.old_deliver_event_messages = tornwamp_topic.customize.deliver_event_messages
 
     def tearDown(self):
-        tornwamp_topic.customize = self.old_customize
+        tornwamp_topic.customize.deliver_event_messages = self.old_deliver_event_messages
 
     def test_constructor(self):
         topic = Topic("the.monarchy")
@@ -83,14 +89,297 @@ class TopicsManagerTestCase(unittest.TestCase):
         self.assertEqual(len(manager["romania"].subscribers), 1)
         self.assertTrue("romania" in connection.topics["subscriber"])
         manager.remove_subscriber("romania", 95)
-        self.assertEqual(len(manager["romania"].subscribers), 0)
+        self.assertNotIn("romania", manager)
         self.assertFalse("romania" in connection.topics["subscriber"])
 
+    def test_remove_subscriber_keeps_topic_with_publishers(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 95)
+        manager.add_publisher("romania", connection, 96)
+        manager.remove_subscriber("romania", 95)
+        self.assertEqual(len(manager["romania"].subscribers), 0)
+        self.assertEqual(len(manager["romania"].publishers), 1)
+
+    def test_remove_subscriber_never_collect(self):
+        manager = TopicsManager()
+        manager.empty_topic_ttl = None
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 95)
+        manager.remove_subscriber("romania", 95)
+        self.assertEqual(len(manager["romania"].subscribers), 0)
+
+    @patch("tornwamp.topic.ioloop.IOLoop.current")
+    def test_remove_subscriber_collect_after_ttl(self, mock_current):
+        manager = TopicsManager()
+        manager.empty_topic_ttl = 30
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 95)
+        topic = manager["romania"]
+        manager.remove_subscriber("romania", 95)
+        self.assertIs(manager["romania"], topic)
+        ((ttl, callback, scheduled_topic), _) = mock_current.return_value.call_later.call_args
+        self.assertEqual(ttl, 30)
+        callback(scheduled_topic)
+        self.assertNotIn("romania", manager)
+
+    @patch("tornwamp.topic.ioloop.IOLoop.current")
+    def test_topic_reused_within_ttl(self, mock_current):
+        manager = TopicsManager()
+        manager.empty_topic_ttl = 30
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 95)
+        manager.remove_subscriber("romania", 95)
+        manager.add_subscriber("romania", connection, 97)
+        ((_, callback, scheduled_topic), _) = mock_current.return_value.call_later.call_args
+        callback(scheduled_topic)
+        self.assertEqual(list(manager["romania"].subscribers), [97])
+
+    @patch("tornwamp.topic.ioloop.IOLoop.current")
+    def test_collect_scheduled_once_per_topic(self, mock_current):
+        manager = TopicsManager()
+        manager.empty_topic_ttl = 30
+        for publication_id in range(1, 1001):
+            manager.publish(BroadcastMessage("romania", EventMessage(publication_id=publication_id), None))
+        self.assertEqual(mock_current.return_value.call_later.call_count, 1)
+
+    @patch("tornwamp.topic.ioloop.IOLoop.current")
+    def test_collect_canceled_when_topic_is_used(self, mock_current):
+        manager = TopicsManager()
+        manager.empty_topic_ttl = 30
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 95)
+        manager.remove_subscriber("romania", 95)
+        handle = mock_current.return_value.call_later.return_value
+        manager.add_publisher("romania", connection, 96)
+        mock_current.return_value.remove_timeout.assert_called_once_with(handle)
+        manager.remove_publisher("romania", 96)
+        self.assertEqual(mock_current.return_value.call_later.call_count, 2)
+
+    def test_publish_to_empty_topic(self):
+        manager = TopicsManager()
+        msg = BroadcastMessage("romania", EventMessage(publication_id=1), None)
+        manager.publish(msg)
+        self.assertNotIn("romania", manager)
+
+    @patch("tornwamp.topic.Topic")
+    def test_create_topic_if_not_exists_only_builds_missing_topics(self, mock_topic):
+        manager = TopicsManager()
+        topic = manager.create_topic_if_not_exists("romania")
+        self.assertIs(manager.create_topic_if_not_exists("romania"), topic)
+        mock_topic.assert_called_once_with("romania", None, "exact")
+
+    def test_remove_subscriber_releases_subscription_id(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        subscription_id = manager.add_subscriber("romania", connection)
+        self.assertIn(subscription_id, identifier.router_ids.existing_ids)
+        manager.remove_subscriber("romania", subscription_id)
+        self.assertNotIn(subscription_id, identifier.router_ids.existing_ids)
+
     def test_remove_subscriber_inexistent_connection(self):
         manager = TopicsManager()
         answer = manager.remove_subscriber("inexistent", None)
         self.assertIsNone(answer)
 
+    def test_add_subscriber_twice(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        self.assertEqual(manager.add_subscriber("romania", connection, 95), 95)
+        self.assertEqual(manager.add_subscriber("romania", connection, 96), 95)
+        self.assertEqual(list(manager["romania"].subscribers), [95])
+        self.assertEqual(manager.add_subscriber("romania", connection, 97, match="prefix"), 97)
+        self.assertEqual(manager.unsubscribe(95, connection), "romania")
+        manager.remove_connection(connection)
+        self.assertEqual(dict(manager), {})
+
+    def test_add_shared_subscriber_twice(self):
+        manager = TopicsManager()
+        manager.shared_subscriptions = True
+        connection = ClientConnection(None, name="Dracula")
+        self.assertEqual(manager.add_subscriber("romania", connection, 95), 95)
+        self.assertEqual(manager.add_subscriber("romania", connection, 96), 95)
+        self.assertEqual(list(manager["romania"].subscribers), [connection.id])
+
+    def test_add_subscriber_indexes_subscription(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 432)
+        self.assertEqual(manager.subscriptions, {432: ("romania", connection)})
+
+    def test_remove_subscriber_unindexes_subscription(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 95)
+        manager.remove_subscriber("romania", 95)
+        self.assertEqual(manager.subscriptions, {})
+
+    def test_unsubscribe(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 95)
+        manager.add_subscriber("transylvania", connection, 96)
+        self.assertEqual(manager.unsubscribe(95, connection), "romania")
+        self.assertNotIn("romania", manager)
+        self.assertEqual(len(manager["transylvania"].subscribers), 1)
+        self.assertEqual(connection.topics["subscriber"], {"transylvania": 96})
+        self.assertEqual(manager.subscriptions, {96: ("transylvania", connection)})
+
+    def test_unsubscribe_inexistent_subscription(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        self.assertIsNone(manager.unsubscribe(95, connection))
+
+    def test_unsubscribe_subscription_of_other_connection(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        other_connection = ClientConnection(None, name="Van Helsing")
+        manager.add_subscriber("romania", connection, 95)
+        self.assertIsNone(manager.unsubscribe(95, other_connection))
+        self.assertEqual(len(manager["romania"].subscribers), 1)
+
+    def test_add_subscriber_shared_subscription(self):
+        manager = TopicsManager()
+        manager.shared_subscriptions = True
+        dracula = ClientConnection(None, name="Dracula")
+        mina = ClientConnection(None, name="Mina")
+        subscription_id = manager.add_subscriber("romania", dracula, 432)
+        self.assertEqual(subscription_id, 432)
+        self.assertEqual(manager.add_subscriber("romania", mina), 432)
+        self.assertEqual(manager["romania"].subscription_id, 432)
+        self.assertEqual(manager["romania"].subscribers, {dracula.id: dracula, mina.id: mina})
+        self.assertEqual(mina.topics["subscriber"], {"romania": 432})
+        self.assertEqual(manager.subscriptions, {432: ("romania", None)})
+
+    def test_add_subscriber_shared_subscription_topic_with_subscribers(self):
+        manager = TopicsManager()
+        dracula = ClientConnection(None, name="Dracula")
+        mina = ClientConnection(None, name="Mina")
+        manager.add_subscriber("romania", dracula, 432)
+        manager.shared_subscriptions = True
+        self.assertEqual(manager.add_subscriber("romania", mina, 433), 433)
+        self.assertIsNone(manager["romania"].subscription_id)
+
+    @patch("tornwamp.topic.release_router_id")
+    def test_remove_subscriber_shared_subscription(self, mock_release):
+        manager = TopicsManager()
+        manager.shared_subscriptions = True
+        dracula = ClientConnection(None, name="Dracula")
+        mina = ClientConnection(None, name="Mina")
+        manager.add_subscriber("romania", dracula, 432)
+        manager.add_subscriber("romania", mina)
+        manager.remove_subscriber("romania", 432, dracula)
+        self.assertEqual(manager["romania"].subscribers, {mina.id: mina})
+        self.assertEqual(dracula.topics["subscriber"], {})
+        self.assertFalse(mock_release.called)
+        manager.remove_connection(mina)
+        self.assertNotIn("romania", manager)
+        self.assertEqual(manager.subscriptions, {})
+        mock_release.assert_called_with(432)
+
+    def test_unsubscribe_shared_subscription(self):
+        manager = TopicsManager()
+        manager.shared_subscriptions = True
+        dracula = ClientConnection(None, name="Dracula")
+        mina = ClientConnection(None, name="Mina")
+        manager.add_subscriber("romania", dracula, 432)
+        self.assertIsNone(manager.unsubscribe(432, mina))
+        manager.add_subscriber("romania", mina)
+        self.assertEqual(manager.unsubscribe(432, mina), "romania")
+        self.assertEqual(manager["romania"].subscribers, {dracula.id: dracula})
+        self.assertEqual(manager.unsubscribe(432, dracula), "romania")
+        self.assertNotIn("romania", manager)
+
+    def test_add_subscriber_prefix(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 432, match="prefix")
+        topic = manager["prefix#romania"]
+        self.assertEqual(topic.name, "romania")
+        self.assertEqual(topic.match, "prefix")
+        self.assertEqual(topic.subscribers, {432: connection})
+        self.assertNotIn("romania", manager)
+        self.assertEqual(manager.matcher.match("romania.bucharest"), [topic])
+        self.assertEqual(connection.topics["subscriber"], {"prefix#romania": 432})
+
+    def test_remove_subscriber_prefix(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Dracula")
+        manager.add_subscriber("romania", connection, 432, match="prefix")
+        self.assertEqual(manager.unsubscribe(432, connection), "prefix#romania")
+        self.assertNotIn("prefix#romania", manager)
+        self.assertEqual(len(manager.matcher), 0)
+        self.assertEqual(connection.topics["subscriber"], {})
+
+    def test_publish_to_pattern_subscribers(self):
+        manager = TopicsManager()
+        exact = ClientConnection(None, name="Dracula")
+        prefix = ClientConnection(None, name="Mina")
+        wildcard = ClientConnection(None, name="Jonathan")
+        manager.add_subscriber("romania.bucharest", exact, 1)
+        manager.add_subscriber("romania", prefix, 2, match="prefix")
+        manager.add_subscriber("romania.", wildcard, 3, match="wildcard")
+        manager.add_subscriber("england.", wildcard, 4, match="wildcard")
+        msg = BroadcastMessage("romania.bucharest", EventMessage(publication_id=5, args=["garlic"]), None)
+        with patch.object(exact, "_websocket") as exact_ws, \
+                patch.object(prefix, "_websocket") as prefix_ws, \
+                patch.object(wildcard, "_websocket") as wildcard_ws:
+            manager.publish(msg)
+        exact_ws.write_message.assert_called_once_with(EventMessage(subscription_id=1, publication_id=5, args=["garlic"]).json)
+        details = {"topic": "romania.bucharest"}
+        prefix_ws.write_message.assert_called_once_with(EventMessage(subscription_id=2, publication_id=5, details=details, args=["garlic"]).json)
+        wildcard_ws.write_message.assert_called_once_with(EventMessage(subscription_id=3, publication_id=5, details=details, args=["garlic"]).json)
+
+    def test_publish_to_closed_subscriber(self):
+        manager = TopicsManager()
+        closed = ClientConnection(None, name="Lucy")
+        connection = ClientConnection(None, name="Mina")
+        manager.add_subscriber("romania", closed, 1)
+        manager.add_subscriber("romania", connection, 2)
+        msg = BroadcastMessage("romania", EventMessage(publication_id=5), None)
+        with patch.object(closed, "_websocket") as closed_ws, \
+                patch.object(connection, "_websocket") as ws:
+            closed_ws.write_message.side_effect = WebSocketClosedError()
+            manager.publish(msg)
+        ws.write_message.assert_called_once_with(EventMessage(subscription_id=2, publication_id=5).json)
+
+    def test_publish_to_pattern_subscribers_skips_publisher(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Mina")
+        manager.add_subscriber("romania", connection, 2, match="prefix")
+        msg = BroadcastMessage("romania.bucharest", EventMessage(publication_id=5), connection.id)
+        with patch.object(connection, "_websocket") as ws:
+            manager.publish(msg)
+        self.assertFalse(ws.write_message.called)
+
+    def test_publish_to_bus(self):
+        manager = TopicsManager()
+        manager.bus = MagicMock()
+        msg = BroadcastMessage("romania.bucharest", EventMessage(publication_id=5), None)
+        manager.publish(msg)
+        manager.bus.publish.assert_called_once_with(msg)
+
+    def test_receive(self):
+        manager = TopicsManager()
+        exact = ClientConnection(None, name="Dracula")
+        prefix = ClientConnection(None, name="Mina")
+        manager.add_subscriber("romania.bucharest", exact, 1)
+        manager.add_subscriber("romania", prefix, 2, match="prefix")
+        msg = BroadcastMessage("romania.bucharest", EventMessage(publication_id=5, args=["garlic"]), exact.id)
+        msg = BroadcastMessage.from_text(msg.json)
+        with patch.object(exact, "_websocket") as exact_ws, \
+                patch.object(prefix, "_websocket") as prefix_ws:
+            manager.receive(msg)
+        # the publisher connection belongs to another worker
+        exact_ws.write_message.assert_called_once_with(EventMessage(subscription_id=1, publication_id=5, args=["garlic"]).json)
+        details = {"topic": "romania.bucharest"}
+        prefix_ws.write_message.assert_called_once_with(EventMessage(subscription_id=2, publication_id=5, details=details, args=["garlic"]).json)
+
+    def test_receive_without_subscribers(self):
+        manager = TopicsManager()
+        manager.receive(BroadcastMessage("romania.bucharest", EventMessage(publication_id=5), None))
+        self.assertNotIn("romania.bucharest", manager)
+
     def test_add_publisher(self):
         manager = TopicsManager()
         connection = ClientConnection(None, name="Frankenstein")
@@ -106,7 +395,7 @@ class TopicsManagerTestCase(unittest.TestCase):
         self.assertEqual(len(manager["gernsheim"].publishers), 1)
         self.assertTrue("gernsheim" in connection.topics["publisher"])
         manager.remove_publisher("gernsheim", 123)
-        self.assertEqual(len(manager["gernsheim"].publishers), 0)
+        self.assertNotIn("gernsheim", manager)
         self.assertFalse("gernsheim" in connection.topics["publisher"])
 
     def test_remove_publisher_inexistent_connection(self):
@@ -124,11 +413,21 @@ class TopicsManagerTestCase(unittest.TestCase):
         self.assertEqual(len(manager["romania"].subscribers), 1)
         self.assertTrue("romania" in connection.topics["subscriber"])
         manager.remove_connection(connection)
-        self.assertEqual(len(manager["romania"].subscribers), 0)
-        self.assertEqual(len(manager["gernsheim"].publishers), 0)
+        self.assertNotIn("romania", manager)
+        self.assertNotIn("gernsheim", manager)
+        self.assertEqual(connection.topics, {"subscriber": {}, "publisher": {}})
+        self.assertEqual(manager.subscriptions, {})
+
+    def test_remove_connection_twice(self):
+        manager = TopicsManager()
+        connection = ClientConnection(None, name="Drakenstein")
+        manager.add_subscriber("romania", connection)
+        manager.remove_connection(connection)
+        manager.remove_connection(connection)
+        self.assertNotIn("romania", manager)
 
     @patch("tornwamp.session.create_global_id", side_effect=[1, 2])
-    @patch("tornwamp.topic.create_global_id", side_effect=[3, 4])
+    @patch("tornwamp.topic.create_router_id", side_effect=[3, 4])
     def test_dict(self, mock_id, mock_id_2):
         manager = TopicsManager()
         mr_hyde = ClientConnection(None, name="Mr Hyde")
@@ -217,6 +516,20 @@ class CustomizeTestCase(unittest.TestCase):
             tornwamp_topic.topics.publish(msg)
             ws.write_message.assert_called_once_with(EventMessage(subscription_id=18273, publication_id=1).json)
 
+    def test_deliver_event_messages_from_other_node(self):
+        msg = BroadcastMessage("education.first", EventMessage(publication_id=1, args=["x"]), 2)
+        msg.publisher_node_id = "another node"
+        with patch.object(self.subscriber_connection, "_websocket") as ws:
+            self.topic._on_event_message("tornwamp:topic:education.first", msg.json.encode("utf-8"))
+            ws.write_message.assert_called_once_with(EventMessage(subscription_id=18273, publication_id=1, args=["x"]).json)
+
+    def test_skip_messages_which_cannot_be_parsed(self):
+        with patch.object(self.subscriber_connection, "_websocket") as ws, \
+                patch.object(tornwamp_topic.logger, "warning") as warning:
+            self.topic._on_event_message("tornwamp:topic:education.first", b"[1, 2")
+        self.assertFalse(ws.write_message.called)
+        self.assertEqual(warning.call_args[0][1], "tornwamp:topic:education.first")
+
     def test_deliver_event_messages_empty_topic(self):
         connection = ClientConnection(None, user_id=7475)
         with patch.object(self.subscriber_connection, "_websocket") as ws:
@@ -227,3 +540,363 @@ class CustomizeTestCase(unittest.TestCase):
         with patch.object(self.subscriber_connection, "_websocket") as ws:
             tornwamp_topic.customize.deliver_event_messages(self.topic, EventMessage(subscription_id=1837, publication_id=1), self.subscriber_connection.id)
             self.assertFalse(ws.write_message.called)
+
+    @unittest.skipIf(msgpack_serializer is None, "msgpack is not installed")
+    def test_deliver_event_messages_encodes_once_per_serializer(self):
+        msgpack_connections = [ClientConnection(None, user_id=7476), ClientConnection(None, user_id=7477)]
+        for subscription_id, connection in enumerate(msgpack_connections, 20):
+            connection.serializer = msgpack_serializer
+            tornwamp_topic.topics.add_subscriber("education.first", connection, subscription_id)
+            self.addCleanup(tornwamp_topic.topics.remove_connection, connection)
+        event = EventMessage(subscription_id=1, publication_id=1, args=["x"])
+        with patch.object(self.subscriber_connection, "_websocket") as json_ws, \
+                patch.object(msgpack_connections[0], "_websocket") as msgpack_ws, \
+                patch.object(msgpack_connections[1], "_websocket"), \
+                patch.object(EventMessage, "template", autospec=True, side_effect=EventMessage.template) as template:
+            tornwamp_topic.customize.deliver_event_messages(self.topic, event)
+        self.assertEqual(template.call_count, 2)
+        json_ws.write_message.assert_called_once_with(EventMessage(subscription_id=18273, publication_id=1, args=["x"]).json)
+        expected = EventMessage(subscription_id=20, publication_id=1, args=["x"]).encode(msgpack_serializer)
+        msgpack_ws.write_message.assert_called_once_with(expected, binary=True)
+
+
+class SharedSubscriptionCustomizeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = TopicsManager()
+        self.manager.shared_subscriptions = True
+        self.connections = [ClientConnection(None, user_id=7481), ClientConnection(None, user_id=7482)]
+        for connection in self.connections:
+            self.manager.add_subscriber("education.third", connection, 18274)
+        self.topic = self.manager["education.third"]
+
+    def test_deliver_event_messages_shares_encoded_event(self):
+        event = EventMessage(subscription_id=1, publication_id=1, args=["x"])
+        with patch.object(self.connections[0], "_websocket") as ws_1, \
+                patch.object(self.connections[1], "_websocket") as ws_2, \
+                patch.object(EventMessage, "template", autospec=True, side_effect=EventMessage.template) as template:
+            tornwamp_topic.customize.deliver_event_messages(self.topic, event)
+        self.assertEqual(template.call_count, 1)
+        expected = EventMessage(subscription_id=18274, publication_id=1, args=["x"]).json
+        ws_1.write_message.assert_called_once_with(expected)
+        ws_2.write_message.assert_called_once_with(expected)
+        self.assertIs(ws_1.write_message.call_args[0][0], ws_2.write_message.call_args[0][0])
+
+    def test_skip_publisher(self):
+        with patch.object(self.connections[0], "_websocket") as ws_1, \
+                patch.object(self.connections[1], "_websocket") as ws_2:
+            tornwamp_topic.customize.deliver_event_messages(self.topic, EventMessage(publication_id=1), self.connections[0].id)
+        self.assertFalse(ws_1.write_message.called)
+        ws_2.write_message.assert_called_once_with(EventMessage(subscription_id=18274, publication_id=1).json)
+
+
+class PatternTopicTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bridge = MagicMock()
+        self.bridge.is_psubscribed.return_value = False
+        patcher = patch("tornwamp.topic.get_redis_bridge", return_value=self.bridge)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.topic = Topic("romania", {"host": "127.0.0.1", "port": 6379}, "prefix")
+
+    def test_add_subscriber_psubscribes(self):
+        self.topic.add_subscriber(1, ClientConnection(None))
+        self.bridge.psubscribe.assert_called_once_with("tornwamp:topic:romania*", self.topic._on_pattern_message, self.topic._drop_subscribers)
+        self.assertFalse(self.bridge.subscribe.called)
+
+    def test_remove_subscriber_punsubscribes(self):
+        self.topic.add_subscriber(1, ClientConnection(None))
+        self.topic.remove_subscriber(1)
+        self.bridge.punsubscribe.assert_called_once_with("tornwamp:topic:romania*")
+        self.assertFalse(self.bridge.unsubscribe.called)
+
+    def test_on_pattern_message(self):
+        connection = ClientConnection(None)
+        self.topic.add_subscriber(1, connection)
+        msg = BroadcastMessage("romania.bucharest", EventMessage(publication_id=5, args=["x"]), 2)
+        msg.publisher_node_id = "another node"
+        with patch.object(connection, "_websocket") as ws:
+            self.topic._on_pattern_message("tornwamp:topic:romania.bucharest", msg.json.encode("utf-8"))
+        expected = EventMessage(subscription_id=1, publication_id=5, details={"topic": "romania.bucharest"}, args=["x"]).json
+        ws.write_message.assert_called_once_with(expected)
+
+    @patch("tornwamp.messages.PUBLISHER_HOST_ID", "host")
+    def test_on_pattern_message_skips_messages_of_the_same_host(self):
+        connection = ClientConnection(None)
+        self.topic.add_subscriber(1, connection)
+        msg = BroadcastMessage("romania.bucharest", EventMessage(publication_id=5), 2)
+        msg.publisher_node_id = "another worker"
+        with patch.object(connection, "_websocket") as ws:
+            self.topic._on_pattern_message("tornwamp:topic:romania.bucharest", msg.json.encode("utf-8"))
+        self.assertFalse(ws.write_message.called)
+
+    def test_on_pattern_message_skips_topics_which_do_not_match(self):
+        topic = Topic("romania..castle", {"host": "127.0.0.1", "port": 6379}, "wildcard")
+        connection = ClientConnection(None)
+        topic.add_subscriber(1, connection)
+        msg = BroadcastMessage("romania.bran.old.castle", EventMessage(publication_id=5), 2)
+        msg.publisher_node_id = "another node"
+        with patch.object(connection, "_websocket") as ws:
+            topic._on_pattern_message("tornwamp:topic:romania.bran.old.castle", msg.json.encode("utf-8"))
+        self.assertFalse(ws.write_message.called)
+
+    def test_on_pattern_message_skips_messages_which_cannot_be_parsed(self):
+        connection = ClientConnection(None)
+        self.topic.add_subscriber(1, connection)
+        with patch.object(connection, "_websocket") as ws, \
+                patch.object(tornwamp_topic.logger, "warning") as warning:
+            self.topic._on_pattern_message("tornwamp:topic:romania.bucharest", b"2\nnot json\n[36]")
+        self.assertFalse(ws.write_message.called)
+        self.assertTrue(warning.called)
+
+
+class RedisBridgeTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(RedisBridgeTestCase, self).setUp()
+        self.tornadis_patcher = patch("tornwamp.topic.tornadis")
+        self.tornadis = self.tornadis_patcher.start()
+        self.tornadis.TornadisException = TornadisException
+        self.tornadis.ConnectionError = ConnectionError
+        self.tornadis.ClientError = ClientError
+        self.tornadis.PubSubClient.side_effect = self.build_pubsub_client
+        self.ioloop_patcher = patch("tornwamp.topic.ioloop")
+        self.ioloop = self.ioloop_patcher.start()
+        self.bridge = tornwamp_topic.RedisBridge({"host": "127.0.0.1", "port": 6379})
+
+    def tearDown(self):
+        self.ioloop_patcher.stop()
+        self.tornadis_patcher.stop()
+        super(RedisBridgeTestCase, self).tearDown()
+
+    def build_pubsub_client(self, *args, **kwargs):
+        connection = MagicMock()
+        connection.connect.return_value = self.resolved(True)
+        connection.pubsub_subscribe.side_effect = lambda channel: self.resolved(True)
+        connection.pubsub_psubscribe.side_effect = lambda pattern: self.resolved(True)
+        return connection
+
+    def resolved(self, result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    @gen_test
+    def test_subscribe_shares_connection(self):
+        futures = [self.bridge.subscribe("a", None, None), self.bridge.subscribe("b", None, None)]
+        connection = self.bridge._subscriber_connection
+        self.assertTrue(self.bridge.is_subscribed("a"))
+        results = yield futures
+        self.assertEqual(results, [True, True])
+        self.assertIs(self.bridge._subscriber_connection, connection)
+        self.assertEqual(self.tornadis.PubSubClient.call_count, 1)
+        connection.pubsub_subscribe.assert_any_call("a")
+        connection.pubsub_subscribe.assert_any_call("b")
+        # messages are popped once
+        self.assertEqual(connection.pubsub_pop_message.call_count, 1)
+
+    @gen_test
+    def test_subscribe_fails_to_connect(self):
+        lost = []
+        self.tornadis.PubSubClient.side_effect = None
+        self.tornadis.PubSubClient.return_value.connect.return_value = self.resolved(False)
+        futures = [self.bridge.subscribe("a", None, lambda: lost.append("a")), self.bridge.subscribe("b", None, lambda: lost.append("b"))]
+        results = yield futures
+        self.assertEqual(results, [False, False])
+        self.assertEqual(sorted(lost), ["a", "b"])
+        self.assertIsNone(self.bridge._subscriber_connection)
+        self.assertFalse(self.bridge.is_subscribed("a"))
+
+    @gen_test
+    def test_subscribe_fails(self):
+        lost = []
+        yield self.bridge.subscribe("a", None, lambda: lost.append("a"))
+        connection = self.bridge._subscriber_connection
+        connection.pubsub_subscribe.side_effect = lambda channel: self.resolved(False)
+        subscribed = yield self.bridge.subscribe("b", None, lambda: lost.append("b"))
+        self.assertFalse(subscribed)
+        self.assertEqual(lost, ["b"])
+        self.assertFalse(self.bridge.is_subscribed("b"))
+        self.assertTrue(self.bridge.is_subscribed("a"))
+        self.assertIs(self.bridge._subscriber_connection, connection)
+
+    @gen_test
+    def test_unsubscribe_before_subscribed(self):
+        lost = []
+        future = self.bridge.subscribe("a", None, lambda: lost.append("a"))
+        connection = self.bridge._subscriber_connection
+        self.bridge.unsubscribe("a")
+        self.assertTrue(connection.disconnect.called)
+        yield future
+        self.assertEqual(lost, [])
+        self.assertFalse(connection.pubsub_subscribe.called)
+        self.assertFalse(connection.pubsub_pop_message.called)
+
+    @gen_test
+    def test_unsubscribe(self):
+        yield [self.bridge.subscribe("a", None, None), self.bridge.subscribe("b", None, None)]
+        connection = self.bridge._subscriber_connection
+        self.bridge.unsubscribe("a")
+        connection.pubsub_unsubscribe.assert_called_once_with("a")
+        self.assertFalse(connection.disconnect.called)
+        self.bridge.unsubscribe("b")
+        self.assertTrue(connection.disconnect.called)
+        self.assertIsNone(self.bridge._subscriber_connection)
+
+    @gen_test
+    def test_psubscribe(self):
+        results = yield [self.bridge.subscribe("a", None, None), self.bridge.psubscribe("a*", None, None)]
+        self.assertEqual(results, [True, True])
+        connection = self.bridge._subscriber_connection
+        connection.pubsub_psubscribe.assert_called_once_with("a*")
+        self.assertTrue(self.bridge.is_psubscribed("a*"))
+        self.assertFalse(self.bridge.is_subscribed("a*"))
+
+    @gen_test
+    def test_punsubscribe(self):
+        yield [self.bridge.subscribe("a", None, None), self.bridge.psubscribe("a*", None, None)]
+        connection = self.bridge._subscriber_connection
+        self.bridge.punsubscribe("a*")
+        connection.pubsub_punsubscribe.assert_called_once_with("a*")
+        self.assertFalse(connection.pubsub_unsubscribe.called)
+        self.bridge.unsubscribe("a")
+        self.assertTrue(connection.disconnect.called)
+
+    def test_route_message_by_pattern(self):
+        received = []
+        self.bridge.subscribe("a.b", lambda *args: received.append(("a.b",) + args), None)
+        self.bridge.psubscribe("a*", lambda *args: received.append(("a*",) + args), None)
+        connection = self.bridge._subscriber_connection
+        future = MagicMock()
+        future.result.return_value = (b"pmessage", b"a*", b"a.b", b"payload")
+        self.bridge._on_redis_message(connection, future)
+        self.assertEqual(received, [("a*", "a.b", b"payload")])
+
+    def test_connection_lost_drops_patterns(self):
+        lost = []
+        self.bridge.psubscribe("a*", None, lambda: lost.append("a*"))
+        connection = self.bridge._subscriber_connection
+        future = MagicMock()
+        future.result.return_value = self.tornadis.ConnectionError()
+        self.bridge._on_redis_message(connection, future)
+        self.assertEqual(lost, ["a*"])
+        self.assertEqual(self.bridge.patterns, {})
+
+    def test_route_message_by_channel(self):
+        received = []
+        self.bridge.subscribe("a", lambda *args: received.append(("a",) + args), None)
+        self.bridge.subscribe("b", lambda *args: received.append(("b",) + args), None)
+        connection = self.bridge._subscriber_connection
+        future = MagicMock()
+        future.result.return_value = (b"message", b"b", b"payload")
+        self.bridge._on_redis_message(connection, future)
+        self.assertEqual(received, [("b", "b", b"payload")])
+
+    def test_connection_lost(self):
+        lost = []
+        self.bridge.subscribe("a", None, lambda: lost.append("a"))
+        self.bridge.subscribe("b", None, lambda: lost.append("b"))
+        connection = self.bridge._subscriber_connection
+        future = MagicMock()
+        future.result.return_value = self.tornadis.ConnectionError()
+        self.bridge._on_redis_message(connection, future)
+        self.assertEqual(sorted(lost), ["a", "b"])
+        self.assertEqual(self.bridge.channels, {})
+
+    def test_publish_is_pipelined(self):
+        futures = [self.bridge.publish("a", "1"), self.bridge.publish("b", "2")]
+        self.assertFalse(self.bridge._publisher_connection.call.called)
+        self.bridge._flush_publish_queue()
+        pipeline = self.tornadis.Pipeline.return_value
+        self.assertEqual(pipeline.stack_call.call_args_list, [call("PUBLISH", "a", "1"), call("PUBLISH", "b", "2")])
+        self.bridge._publisher_connection.call.assert_called_once_with(pipeline)
+
+        future = Future()
+        future.set_result([3, 0])
+        queue = self.ioloop.IOLoop.current.return_value.add_future.call_args[0][1].args[0]
+        self.bridge._on_published(queue, future)
+        self.assertEqual([f.result() for f in futures], [3, 0])
+        self.assertEqual(self.bridge._pending_publications, 0)
+
+    def test_publish_flushes_full_batch(self):
+        with patch("tornwamp.topic.PUBLISH_BATCH_SIZE", 2):
+            self.bridge.publish("a", "1")
+            self.assertFalse(self.bridge._publisher_connection.call.called)
+            self.bridge.publish("a", "2")
+            self.assertTrue(self.bridge._publisher_connection.call.called)
+
+    def test_publish_redis_fails(self):
+        future = self.bridge.publish("a", "payload")
+        self.bridge._flush_publish_queue()
+        failure = Future()
+        failure.set_result(ConnectionError())
+        self.bridge._on_published([("a", "payload", future)], failure)
+        with self.assertRaises(tornwamp_topic.RedisUnavailableError):
+            future.result()
+        # other publications are not affected
+        self.bridge.publish("a", "payload")
+
+    def test_publish_command_fails(self):
+        futures = [self.bridge.publish("a", "1"), self.bridge.publish("b", "2")]
+        replies = Future()
+        replies.set_result([ClientError(), 2])
+        self.bridge._on_published([("a", "1", futures[0]), ("b", "2", futures[1])], replies)
+        self.assertIsInstance(futures[0].exception(), tornwamp_topic.RedisUnavailableError)
+        self.assertEqual(futures[1].result(), 2)
+
+    @patch("tornwamp.topic.PUBLISH_ERROR_POLICY", "log")
+    def test_publish_redis_fails_log(self):
+        future = self.bridge.publish("a", "payload")
+        failure = Future()
+        failure.set_result(ConnectionError())
+        self.bridge._on_published([("a", "payload", future)], failure)
+        self.assertIsNone(future.result())
+        self.bridge.publish("a", "payload")
+
+    @patch("tornwamp.topic.PUBLISH_QUEUE_MAX_SIZE", 1)
+    def test_publish_queue_full(self):
+        self.bridge.publish("a", "payload")
+        with self.assertRaises(tornwamp_topic.RedisUnavailableError):
+            self.bridge.publish("a", "payload")
+
+    @patch("tornwamp.topic.PUBLISH_ERROR_POLICY", "log")
+    @patch("tornwamp.topic.PUBLISH_QUEUE_MAX_SIZE", 1)
+    def test_publish_queue_full_log(self):
+        self.bridge.publish("a", "payload")
+        future = self.bridge.publish("a", "payload")
+        self.assertIsNone(future.result())
+        self.assertEqual(len(self.bridge._publish_queue), 1)
+
+
+class TopicChannelsTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(TopicChannelsTestCase, self).setUp()
+        self.bridge = MagicMock(channels={}, patterns={})
+        self.bridge.is_subscribed.side_effect = lambda channel: channel in self.bridge.channels
+        self.bridge.is_psubscribed.side_effect = lambda pattern: pattern in self.bridge.patterns
+        self.bridge.subscribe.side_effect = lambda channel, on_message, on_lost: self.bridge.channels.setdefault(channel, (on_message, on_lost))
+        self.bridge.psubscribe.side_effect = lambda pattern, on_message, on_lost: self.bridge.patterns.setdefault(pattern, (on_message, on_lost))
+        for module in (tornwamp_topic, dealer):
+            patcher = patch.object(module, "get_redis_bridge", return_value=self.bridge)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dealer = dealer.RedisDealer(dealer.RegistrationsManager(), {"host": "127.0.0.1", "port": 6379})
+        self.dealer.subscribe()
+
+    def test_prefix_subscriptions_do_not_match_node_channels(self):
+        for prefix in ("", "t"):
+            topic = Topic(prefix, {"host": "127.0.0.1", "port": 6379}, "prefix")
+            topic.add_subscriber(1, ClientConnection(None))
+            self.assertIn(topic.channel, self.bridge.patterns)
+            self.assertFalse(fnmatch.fnmatchcase(self.dealer.channel, topic.channel))
+            self.assertTrue(fnmatch.fnmatchcase("tornwamp:topic:tornwamp", topic.channel))
+        self.assertEqual(self.bridge.channels[self.dealer.channel][0], self.dealer._on_message)
+
+    def test_subscription_to_node_channel_name(self):
+        topic = Topic(self.dealer.channel, {"host": "127.0.0.1", "port": 6379})
+        topic.add_subscriber(1, ClientConnection(None))
+        self.assertEqual(topic.channel, "tornwamp:topic:" + self.dealer.channel)
+        self.assertEqual(self.bridge.channels[self.dealer.channel][0], self.dealer._on_message)
+        self.assertEqual(self.bridge.channels[topic.channel][0], topic._on_event_message)
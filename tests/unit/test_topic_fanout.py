@@ -0,0 +1,156 @@
+import unittest
+
+from mock import patch
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from tornwamp.messages import EventMessage
+from tornwamp.topic import Topic, fanout
+
+
+class MockSubscriber(object):
+
+    def __init__(self, id_):
+        self.id = id_
+        self.sent = []
+
+    def send(self, data, binary=False, key=None):
+        self.sent.append(data)
+
+
+class FanOutSchedulerTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(FanOutSchedulerTestCase, self).setUp()
+        self.scheduler = fanout.FanOutScheduler()
+        patcher = patch.multiple(fanout, SLICE_SIZE=2, TIME_BUDGET=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.histograms_patcher = patch.dict(fanout.latency_histograms, {"delivery": fanout.Counter(), "tick": fanout.Counter()})
+        self.histograms_patcher.start()
+        self.addCleanup(self.histograms_patcher.stop)
+
+    def build_topic(self, name, size):
+        topic = Topic(name)
+        for subscription_id in range(1, size + 1):
+            topic.subscribers[subscription_id] = MockSubscriber(subscription_id + 100)
+        return topic
+
+    def received(self, topic):
+        return [len(subscriber.sent) for subscriber in topic.subscribers.values()]
+
+    def test_deliver_small_topic_at_once(self):
+        topic = self.build_topic("small", 2)
+        self.scheduler.deliver(topic, EventMessage(publication_id=1))
+        self.assertEqual(self.received(topic), [1, 1])
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(sum(fanout.latency_histograms["delivery"].values()), 1)
+
+    def test_deliver_small_topic_skips_publisher(self):
+        topic = self.build_topic("small", 2)
+        self.scheduler.deliver(topic, EventMessage(publication_id=1), 101)
+        self.assertEqual(self.received(topic), [0, 1])
+
+    @gen_test
+    def test_deliver_large_topic_in_slices(self):
+        topic = self.build_topic("large", 5)
+        self.scheduler.deliver(topic, EventMessage(publication_id=1))
+        self.assertEqual(self.received(topic), [0, 0, 0, 0, 0])
+        self.assertEqual(len(self.scheduler), 1)
+        yield gen.moment
+        self.assertEqual(self.received(topic), [1, 1, 0, 0, 0])
+        yield gen.moment
+        self.assertEqual(self.received(topic), [1, 1, 1, 1, 0])
+        yield gen.moment
+        self.assertEqual(self.received(topic), [1, 1, 1, 1, 1])
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(sum(fanout.latency_histograms["tick"].values()), 3)
+        self.assertEqual(sum(fanout.latency_histograms["delivery"].values()), 1)
+        expected = EventMessage(subscription_id=5, publication_id=1).json
+        self.assertEqual(topic.subscribers[5].sent, [expected])
+
+    @gen_test
+    def test_deliver_slices_within_time_budget(self):
+        topic = self.build_topic("large", 5)
+        with patch.object(fanout, "TIME_BUDGET", 60):
+            self.scheduler.deliver(topic, EventMessage(publication_id=1))
+            yield gen.moment
+        self.assertEqual(self.received(topic), [1, 1, 1, 1, 1])
+        self.assertEqual(sum(fanout.latency_histograms["tick"].values()), 1)
+
+    @gen_test
+    def test_topics_take_turns(self):
+        first = self.build_topic("first", 4)
+        second = self.build_topic("second", 4)
+        self.scheduler.deliver(first, EventMessage(publication_id=1))
+        self.scheduler.deliver(first, EventMessage(publication_id=2))
+        self.scheduler.deliver(second, EventMessage(publication_id=3))
+        yield gen.moment
+        self.assertEqual(self.received(first), [1, 1, 0, 0])
+        self.assertEqual(self.received(second), [0, 0, 0, 0])
+        yield gen.moment
+        self.assertEqual(self.received(second), [1, 1, 0, 0])
+        yield gen.moment
+        self.assertEqual(self.received(first), [1, 1, 1, 1])
+        yield gen.moment
+        self.assertEqual(self.received(second), [1, 1, 1, 1])
+        yield gen.moment
+        self.assertEqual(self.received(first), [2, 2, 1, 1])
+
+    @gen_test
+    def test_events_of_topic_keep_their_order(self):
+        topic = self.build_topic("large", 3)
+        self.scheduler.deliver(topic, EventMessage(publication_id=1))
+        del topic.subscribers[3]
+        # the topic is small now, but the previous event is being delivered
+        self.scheduler.deliver(topic, EventMessage(publication_id=2))
+        self.assertEqual(self.received(topic), [0, 0])
+        for _ in range(3):
+            yield gen.moment
+        expected = [EventMessage(subscription_id=1, publication_id=publication_id).json for publication_id in (1, 2)]
+        self.assertEqual(topic.subscribers[1].sent, expected)
+        self.assertEqual(len(self.scheduler), 0)
+
+    @gen_test
+    def test_skip_unsubscribed_subscribers(self):
+        topic = self.build_topic("large", 3)
+        self.scheduler.deliver(topic, EventMessage(publication_id=1))
+        unsubscribed = topic.subscribers.pop(3)
+        topic.subscribers[4] = MockSubscriber(104)
+        for _ in range(2):
+            yield gen.moment
+        self.assertEqual(unsubscribed.sent, [])
+        self.assertEqual(self.received(topic), [1, 1, 0])
+
+    @gen_test
+    def test_failing_subscriber_does_not_stop_delivery(self):
+        topic = self.build_topic("large", 5)
+        topic.subscribers[1].send = None
+        with patch.object(fanout.logger, "exception") as log_exception:
+            self.scheduler.deliver(topic, EventMessage(publication_id=1))
+            self.scheduler.deliver(topic, EventMessage(publication_id=2))
+            for _ in range(6):
+                yield gen.moment
+        self.assertEqual(self.received(topic)[1:], [2, 2, 2, 2])
+        self.assertEqual(log_exception.call_count, 2)
+        self.assertEqual(len(self.scheduler), 0)
+
+    @gen_test
+    def test_shared_subscription(self):
+        topic = self.build_topic("large", 3)
+        topic.subscription_id = 7
+        self.scheduler.deliver(topic, EventMessage(publication_id=1))
+        for _ in range(2):
+            yield gen.moment
+        expected = EventMessage(subscription_id=7, publication_id=1).json
+        self.assertEqual([subscriber.sent for subscriber in topic.subscribers.values()], [[expected]] * 3)
+
+
+class ObserveTestCase(unittest.TestCase):
+
+    @patch.dict(fanout.latency_histograms, {"tick": fanout.Counter()})
+    def test_observe(self):
+        fanout.observe("tick", 0.002)
+        fanout.observe("tick", 0.005)
+        fanout.observe("tick", 30)
+        self.assertEqual(fanout.latency_histograms["tick"], {0.005: 2, float("inf"): 1})
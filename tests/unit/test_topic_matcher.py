@@ -0,0 +1,92 @@
+import unittest
+
+from tornwamp.topic.matcher import TopicMatcher, matches, redis_pattern, topic_key
+
+
+class TopicMatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = TopicMatcher()
+
+    def test_match_prefix(self):
+        self.matcher.add("prefix", "market.eur", "eur")
+        self.matcher.add("prefix", "market", "market")
+        self.matcher.add("prefix", "market.usd", "usd")
+        self.assertEqual(sorted(self.matcher.match("market.eur.gbp")), ["eur", "market"])
+        self.assertEqual(self.matcher.match("market.eurex"), ["market", "eur"])
+        self.assertEqual(self.matcher.match("market"), ["market"])
+        self.assertEqual(self.matcher.match("stock.eur"), [])
+
+    def test_match_empty_prefix(self):
+        self.matcher.add("prefix", "", "all")
+        self.assertEqual(self.matcher.match("market.eur"), ["all"])
+
+    def test_match_wildcard(self):
+        self.matcher.add("wildcard", "market..usd", "any-usd")
+        self.matcher.add("wildcard", "market.eur.", "eur-any")
+        self.matcher.add("wildcard", "..", "any")
+        self.assertEqual(sorted(self.matcher.match("market.eur.usd")), ["any", "any-usd", "eur-any"])
+        self.assertEqual(self.matcher.match("market.gbp.usd"), ["any-usd", "any"])
+        self.assertEqual(self.matcher.match("market.eur"), [])
+        self.assertEqual(self.matcher.match("market.eur.usd.spot"), [])
+
+    def test_match_prefix_and_wildcard(self):
+        self.matcher.add("prefix", "market.eur", "prefix")
+        self.matcher.add("wildcard", "market.eur.", "wildcard")
+        self.assertEqual(self.matcher.match("market.eur.usd"), ["prefix", "wildcard"])
+
+    def test_add_replaces_value(self):
+        self.matcher.add("prefix", "market", "old")
+        self.matcher.add("prefix", "market", "new")
+        self.assertEqual(self.matcher.match("market"), ["new"])
+        self.assertEqual(len(self.matcher), 1)
+
+    def test_add_unsupported_policy(self):
+        with self.assertRaises(ValueError):
+            self.matcher.add("exact", "market", "market")
+
+    def test_remove(self):
+        self.matcher.add("prefix", "market", "market")
+        self.matcher.add("prefix", "market.eur", "eur")
+        self.matcher.add("wildcard", "market..usd", "usd")
+        self.matcher.remove("prefix", "market.eur")
+        self.matcher.remove("wildcard", "market..usd")
+        self.assertEqual(self.matcher.match("market.eur.usd"), ["market"])
+        self.assertEqual(len(self.matcher), 1)
+        self.assertEqual(self.matcher._wildcards, {})
+        self.matcher.remove("prefix", "market")
+        self.assertEqual(self.matcher._prefixes, {})
+        self.assertEqual(len(self.matcher), 0)
+
+    def test_remove_keeps_nodes_of_other_patterns(self):
+        self.matcher.add("prefix", "market", "market")
+        self.matcher.add("prefix", "market.eur", "eur")
+        self.matcher.remove("prefix", "market")
+        self.assertEqual(self.matcher.match("market.eur"), ["eur"])
+
+    def test_remove_inexistent_pattern(self):
+        self.matcher.add("prefix", "market.eur", "eur")
+        self.matcher.remove("prefix", "market")
+        self.matcher.remove("prefix", "stock")
+        self.assertEqual(self.matcher.match("market.eur"), ["eur"])
+        self.assertEqual(len(self.matcher), 1)
+
+
+class MatcherFunctionsTestCase(unittest.TestCase):
+
+    def test_topic_key(self):
+        self.assertEqual(topic_key("market.eur"), "market.eur")
+        self.assertEqual(topic_key("market.eur", "prefix"), "prefix#market.eur")
+
+    def test_matches(self):
+        self.assertTrue(matches("prefix", "market.eur", "market.eurex"))
+        self.assertFalse(matches("prefix", "market.eur", "market.usd"))
+        self.assertTrue(matches("wildcard", "market..usd", "market.eur.usd"))
+        self.assertFalse(matches("wildcard", "market..usd", "market.eur.gbp.usd"))
+        self.assertTrue(matches("exact", "market", "market"))
+
+    def test_redis_pattern(self):
+        self.assertEqual(redis_pattern("prefix", "market.eur"), "market.eur*")
+        self.assertEqual(redis_pattern("prefix", "market[1]*"), "market\\[1\\]\\**")
+        self.assertEqual(redis_pattern("wildcard", "market..usd"), "market.?*.usd")
+        self.assertEqual(redis_pattern("wildcard", "market.eur."), "market.eur.?*")
@@ -1,6 +1,7 @@
 import greenlet
+from mock import patch
 from tornado.concurrent import Future
-from tornado.testing import AsyncTestCase
+from tornado.testing import AsyncTestCase, gen_test
 
 from tornwamp import utils
 
@@ -37,3 +38,32 @@ class UtilsTestCase(AsyncTestCase):
 
         future.set_exception(BadFuture("you have been exterminated"))
         self.wait()
+
+    def test_main_greenlet(self):
+        future = Future()
+        with self.assertRaises(RuntimeError):
+            utils.run_async(future)
+
+    def test_call_in_greenlet(self):
+        self.assertEqual(utils.call_in_greenlet(lambda: "banana"), "banana")
+
+    def test_call_in_greenlet_fails(self):
+        def fail():
+            raise ValueError("rotten banana")
+
+        with self.assertRaises(ValueError):
+            utils.call_in_greenlet(fail)
+
+    @gen_test
+    def test_call_in_greenlet_waiting(self):
+        future = Future()
+        result = utils.call_in_greenlet(lambda: utils.run_async(future) + "s")
+        self.assertIsInstance(result, Future)
+        future.set_result("banana")
+        self.assertEqual((yield result), "bananas")
+
+    def test_call_in_greenlet_without_greenlet(self):
+        with patch.object(utils, "greenlet", None):
+            self.assertEqual(utils.call_in_greenlet(lambda: "banana"), "banana")
+            with self.assertRaises(RuntimeError):
+                utils.run_async(Future())
@@ -0,0 +1,133 @@
+"""
+Local bus, through which the worker processes of a host (see
+tornwamp.supervisor) deliver publications to each other, without going
+through redis.
+
+Each worker listens on a Unix domain socket of the bus directory
+(worker-<id>.sock), and connects to the sockets of the other workers the
+first time it publishes, or again after they are restarted. Publications are
+BroadcastMessages, encoded as they are published to redis, sent in frames
+preceded by their length (4 bytes, big-endian).
+
+Publications to a worker which is down, or which doesn't read them fast
+enough (more than MAX_BUFFER_SIZE bytes are waiting to be written to it), are
+dropped.
+"""
+import logging
+import os
+import socket
+import struct
+
+from tornado import gen, ioloop, netutil
+from tornado.iostream import IOStream, StreamBufferFullError, StreamClosedError
+
+from tornwamp.messages import BroadcastMessage
+
+# maximum number of bytes waiting to be written to each worker
+MAX_BUFFER_SIZE = 64 * 1024 * 1024
+
+FRAME_HEADER = struct.Struct(">I")
+
+logger = logging.getLogger(__name__)
+
+
+def socket_path(directory, worker_id):
+    return os.path.join(directory, "worker-{0}.sock".format(worker_id))
+
+
+class LocalBus(object):
+    """
+    Connections of the worker worker_id to the other workers (from 0 to
+    workers - 1) of the bus in directory. on_message(msg) is called with the
+    BroadcastMessages published by them.
+    """
+    def __init__(self, directory, worker_id, workers, on_message):
+        self.directory = directory
+        self.worker_id = worker_id
+        self.workers = workers
+        self.on_message = on_message
+        # worker id -> IOStream connected to its socket
+        self._streams = {}
+        # IOStreams of the connections of the other workers
+        self._incoming = set()
+        self._socket = None
+        self._stop_accepting = None
+
+    @property
+    def path(self):
+        return socket_path(self.directory, self.worker_id)
+
+    def start(self):
+        """
+        Listen for the connections of the other workers.
+        """
+        self._socket = netutil.bind_unix_socket(self.path)
+        self._stop_accepting = netutil.add_accept_handler(self._socket, self._on_connection)
+
+    def close(self):
+        """
+        Stop listening and disconnect from the other workers.
+        """
+        if self._socket is not None:
+            self._stop_accepting()
+            self._socket.close()
+            self._socket = None
+        while self._streams:
+            _, stream = self._streams.popitem()
+            stream.close()
+        while self._incoming:
+            self._incoming.pop().close()
+
+    def publish(self, msg):
+        """
+        Send msg (BroadcastMessage) to the other workers, without blocking.
+        """
+        payload = msg.json.encode("utf-8")
+        frame = FRAME_HEADER.pack(len(payload)) + payload
+        for worker_id in range(self.workers):
+            if worker_id == self.worker_id:
+                continue
+            stream = self._streams.get(worker_id)
+            if stream is None:
+                stream = self._connect(worker_id)
+            try:
+                stream.write(frame)
+            except StreamBufferFullError:
+                logger.warning("dropping publication to %s: worker %d is not reading the bus", msg.topic_name, worker_id)
+            except StreamClosedError:
+                self._forget(worker_id, stream)
+
+    def _connect(self, worker_id):
+        stream = self._streams[worker_id] = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), max_write_buffer_size=MAX_BUFFER_SIZE)
+        stream.set_close_callback(lambda: self._forget(worker_id, stream))
+        future = stream.connect(socket_path(self.directory, worker_id))
+        # the worker may be down (e.g. being restarted), which is only
+        # noticed by the close callback
+        future.add_done_callback(lambda future: future.exception())
+        return stream
+
+    def _forget(self, worker_id, stream):
+        if self._streams.get(worker_id) is stream:
+            del self._streams[worker_id]
+
+    def _on_connection(self, connection, address):
+        stream = IOStream(connection)
+        self._incoming.add(stream)
+        ioloop.IOLoop.current().add_future(gen.convert_yielded(self._read(stream)), lambda future: future.result())
+
+    async def _read(self, stream):
+        """
+        Receive the messages published by another worker, until it
+        disconnects.
+        """
+        try:
+            while True:
+                header = await stream.read_bytes(FRAME_HEADER.size)
+                size, = FRAME_HEADER.unpack(header)
+                payload = await stream.read_bytes(size)
+                try:
+                    self.on_message(BroadcastMessage.from_text(payload.decode("utf-8")))
+                except Exception:
+                    logger.exception("could not deliver a publication received through the bus")
+        except StreamClosedError:
+            self._incoming.discard(stream)
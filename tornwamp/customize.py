@@ -6,44 +6,66 @@ TornWAMP user-configurable structures.
 - The broadcast_messages function can be overwritten to change the
   behavior of how broadcast messages generated by processors (pubsub or
   rpc) are delivered. By default all broadcast messages are delivered to
-  the topic defined in the broadcast message.
+  the topic defined in the broadcast message. Publications which fail to
+  reach redis (see tornwamp.topic.PUBLISH_ERROR_POLICY) are logged.
 """
-from tornado import gen
+import logging
+from functools import partial
+
+from tornado import gen, ioloop
 
 from tornwamp import topic as tornwamp_topic
 from tornwamp.processors import GoodbyeProcessor, HelloProcessor, pubsub, rpc
 from tornwamp.messages import Code
 
+logger = logging.getLogger(__name__)
 
 processors = {
     Code.HELLO: HelloProcessor,
     Code.GOODBYE: GoodbyeProcessor,
     Code.SUBSCRIBE: pubsub.SubscribeProcessor,
+    Code.UNSUBSCRIBE: pubsub.UnsubscribeProcessor,
     Code.CALL: rpc.CallProcessor,
-    Code.PUBLISH: pubsub.PublishProcessor
+    Code.CANCEL: rpc.CancelProcessor,
+    Code.PUBLISH: pubsub.PublishProcessor,
+    Code.REGISTER: rpc.RegisterProcessor,
+    Code.UNREGISTER: rpc.UnregisterProcessor,
+    Code.YIELD: rpc.YieldProcessor,
+    Code.ERROR: rpc.ErrorProcessor
 }
 #    2: 'welcome',
 #    3: 'abort',
 #    4: 'challenge',
 #    5: 'authenticate',
 #    7: 'heartbeat',
-#    8: 'error',
 #    17: 'published',
 #    33: 'subscribed',
-#    34: 'unsubscribe',
 #    35: 'unsubscribed',
 #    36: 'event',
-#    49: 'cancel',
 #    50: 'result',
-#    64: 'register',
 #    65: 'registered',
-#    66: 'unregister',
 #    67: 'unregistered',
 #    68: 'invocation',
-#    69: 'interrupt',
-#    70: 'yield'
+#    69: 'interrupt'
 
 
 def broadcast_messages(processor):
     for msg in processor.broadcast_messages:
-        tornwamp_topic.topics.publish(msg)
+        try:
+            future = tornwamp_topic.topics.publish(msg)
+        except tornwamp_topic.RedisUnavailableError as error:
+            _log_publish_failure(processor, msg, error)
+            continue
+        if future is not None:
+            ioloop.IOLoop.current().add_future(future, partial(_log_publish_error, processor, msg))
+
+
+def _log_publish_error(processor, msg, future):
+    error = future.exception()
+    if error is not None:
+        _log_publish_failure(processor, msg, error)
+
+
+def _log_publish_failure(processor, msg, error):
+    connection_id = processor.connection.id if processor.connection is not None else None
+    logger.error("publication of connection %s to %s failed: %s", connection_id, msg.topic_name, error)
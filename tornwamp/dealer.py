@@ -0,0 +1,657 @@
+"""
+Routed RPC: procedures registered by callee connections (REGISTER), to which
+the dealer routes CALLs as INVOCATION messages. Callees answer them with
+YIELD (or ERROR) messages, which are sent back to the callers.
+
+Several callees may share the registration of a procedure, if all of them
+ask for the same invocation policy (see INVOCATION_POLICIES).
+
+Invocations waiting for an answer are kept by callee and request id, and by
+caller, so they are dropped along with either connection.
+
+Nodes sharing a redis server route CALLs to each other's callees, if
+registrations.redis is set (see RedisDealer).
+"""
+from collections import OrderedDict
+import random
+
+from functools import partial
+
+from tornado import ioloop
+from tornado.concurrent import Future
+from tornado.websocket import WebSocketClosedError
+from tornadis import TornadisException
+
+from tornwamp import messages
+from tornwamp.identifier import SessionIdAllocator, create_router_id, release_router_id
+from tornwamp.messages import Code, ErrorMessage, InterruptMessage, InvocationMessage, ResultMessage, decode_message
+from tornwamp.serializer import json_serializer
+from tornwamp.topic import get_redis_bridge
+
+# Policies callees may ask for in the "invoke" option of REGISTER, so that
+# several of them share the registration of a procedure:
+# - "single": the procedure has a single callee (default)
+# - "roundrobin": each callee is invoked in turn
+# - "random": a callee is picked at random
+# - "first" / "last": the callee which registered first / last is invoked
+# - "least_outstanding": the callee with the fewest invocations it didn't
+#   answer yet is invoked
+INVOCATION_POLICIES = ("single", "roundrobin", "random", "first", "last", "least_outstanding")
+
+# Redis hash which tells the node of each procedure registered by callees,
+# and prefix of the redis channel of each node (see RedisDealer)
+REGISTRATIONS_KEY = "tornwamp:registrations"
+NODE_CHANNEL_PREFIX = "tornwamp:node:"
+# Seconds to wait before subscribing again, when the connection with redis
+# was lost
+RESUBSCRIBE_INTERVAL = 1
+
+# Remove a procedure from REGISTRATIONS_KEY only if it belongs to the node
+WITHDRAW_SCRIPT = """
+if redis.call("HGET", KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call("HDEL", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class Registration(object):
+    """
+    Procedure registered by one or more callee connections.
+
+    A shared registration (whose policy is not "single") has several callees,
+    one of which is selected for each invocation according to its policy
+    (see INVOCATION_POLICIES). Selecting, adding and removing a callee take
+    constant time.
+    """
+    def __init__(self, id_, procedure, policy="single", options=None):
+        self.id = id_
+        self.procedure = procedure
+        self.policy = policy
+        self.options = options or {}
+        # callees by connection id, in the order they registered (rotated for
+        # the "roundrobin" policy)
+        self.callees = OrderedDict()
+        # for the "random" policy: list of callees and their index in it
+        self._callee_list = []
+        self._callee_index = {}
+        # for the "least_outstanding" policy: callees by number of
+        # invocations they didn't answer yet
+        self._outstanding = {}
+        self._outstanding_buckets = {}
+        self._least_outstanding = 0
+
+    @property
+    def callee(self):
+        """
+        The first callee which registered the procedure.
+        """
+        return next(iter(self.callees.values()), None)
+
+    def add_callee(self, callee):
+        self.callees[callee.id] = callee
+        self._callee_index[callee.id] = len(self._callee_list)
+        self._callee_list.append(callee)
+        self._outstanding[callee.id] = 0
+        self._outstanding_buckets.setdefault(0, OrderedDict())[callee.id] = callee
+        self._least_outstanding = 0
+
+    def remove_callee(self, callee):
+        del self.callees[callee.id]
+
+        index = self._callee_index.pop(callee.id)
+        last = self._callee_list.pop()
+        if last is not callee:
+            self._callee_list[index] = last
+            self._callee_index[last.id] = index
+
+        count = self._outstanding.pop(callee.id)
+        self._remove_from_bucket(callee, count)
+        if count == self._least_outstanding and self.callees:
+            while self._least_outstanding not in self._outstanding_buckets:
+                self._least_outstanding += 1
+
+    def select_callee(self):
+        """
+        Return the callee of the next invocation, according to the policy.
+        """
+        if self.policy == "roundrobin":
+            callee_id, callee = next(iter(self.callees.items()))
+            self.callees.move_to_end(callee_id)
+            return callee
+        if self.policy == "random":
+            return random.choice(self._callee_list)
+        if self.policy == "last":
+            return next(reversed(self.callees.values()))
+        if self.policy == "least_outstanding":
+            return next(iter(self._outstanding_buckets[self._least_outstanding].values()))
+        return self.callee
+
+    def invocation_started(self, callee):
+        count = self._outstanding[callee.id]
+        self._move_to_bucket(callee, count, count + 1)
+        if count == self._least_outstanding and count not in self._outstanding_buckets:
+            self._least_outstanding = count + 1
+
+    def invocation_ended(self, callee):
+        count = self._outstanding.get(callee.id)
+        if count:
+            self._move_to_bucket(callee, count, count - 1)
+            self._least_outstanding = min(self._least_outstanding, count - 1)
+
+    def _move_to_bucket(self, callee, count, new_count):
+        self._remove_from_bucket(callee, count)
+        self._outstanding[callee.id] = new_count
+        self._outstanding_buckets.setdefault(new_count, OrderedDict())[callee.id] = callee
+
+    def _remove_from_bucket(self, callee, count):
+        bucket = self._outstanding_buckets[count]
+        del bucket[callee.id]
+        if not bucket:
+            del self._outstanding_buckets[count]
+
+    @property
+    def dict(self):
+        """
+        Return a python dictionary which could be jsonified.
+        """
+        return {
+            "id": self.id,
+            "procedure": self.procedure,
+            "invoke": self.policy,
+            "callees": list(self.callees)
+        }
+
+
+class Invocation(object):
+    """
+    CALL routed to a callee, which didn't answer it yet.
+
+    future is resolved with the answer (RESULT or ERROR) to be sent to the
+    caller and an empty list of broadcast messages, as procedures of
+    tornwamp.processors.rpc.customize are.
+    """
+    def __init__(self, request_id, registration, callee, call_message, caller):
+        self.request_id = request_id
+        self.registration = registration
+        self.callee = callee
+        self.call_message = call_message
+        self.caller = caller
+        self.future = Future()
+
+    def build_error(self, uri, description=None, details=None, args=None, kwargs=None):
+        """
+        Return the ERROR answering the caller's CALL.
+        """
+        return build_call_error(self.call_message, uri, description, details, args, kwargs)
+
+
+class RemoteCaller(object):
+    """
+    Stands for the caller of a CALL received from another node, see
+    RedisDealer. Messages sent to it (progressive results) are forwarded to
+    that node.
+    """
+    def __init__(self, id_, node_id, request_id, remote):
+        self.id = id_
+        self.node_id = node_id
+        self.request_id = request_id
+        self._remote = remote
+
+    def send_message(self, msg):
+        self._remote.send_answer(self, msg, final=False)
+
+
+def build_call_error(call_message, uri, description=None, details=None, args=None, kwargs=None):
+    """
+    Return an ERROR answering call_message.
+    """
+    error = ErrorMessage(
+        request_code=Code.CALL,
+        request_id=call_message.request_id,
+        details=details,
+        uri=uri,
+        args=args,
+        kwargs=kwargs
+    )
+    if description is not None:
+        error.error(description)
+    return error
+
+
+class RegistrationsManager(dict):
+    """
+    Manages the registrations of callee connections, by procedure, and the
+    invocations they have to answer.
+
+    In order to route CALLs to callees connected to other nodes, the
+    attribute redis should be set to a dict with the host and port of the
+    redis server shared by the nodes (see RedisDealer).
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.redis = None
+        self._remote = None
+        self.by_id = {}
+        # callee connection id -> {INVOCATION request id: Invocation}
+        self.invocations = {}
+        # caller connection id -> {CALL request id: Invocation}
+        self._calls = {}
+        # callee connection id -> ids of its registrations
+        self._callee_registrations = {}
+        # callee connection id -> SessionIdAllocator of INVOCATION requests
+        self._invocation_ids = {}
+
+    def register(self, procedure, callee, options=None):
+        """
+        Register procedure to callee, returning the Registration, or None if
+        procedure is already registered (unless its registration is shared
+        with the invocation policy of options["invoke"] and callee isn't one
+        of its callees yet).
+        """
+        options = options or {}
+        policy = options.get("invoke", "single")
+        registration = self.get(procedure)
+        if registration is None:
+            registration = Registration(create_router_id(), procedure, policy, options)
+            self[procedure] = registration
+            self.by_id[registration.id] = registration
+            if self.remote is not None:
+                self.remote.announce(procedure)
+        elif policy == "single" or policy != registration.policy or callee.id in registration.callees:
+            return None
+        registration.add_callee(callee)
+        self._callee_registrations.setdefault(callee.id, set()).add(registration.id)
+        return registration
+
+    def unregister(self, registration_id, callee):
+        """
+        Remove callee from the registration of registration_id, returning
+        it, or None if callee has no such registration. Registrations are
+        removed along with their last callee. Invocations callee didn't
+        answer yet may still be answered.
+        """
+        registration = self.by_id.get(registration_id)
+        if registration is None or callee.id not in registration.callees:
+            return None
+        registration.remove_callee(callee)
+        if not registration.callees:
+            del self.by_id[registration_id]
+            del self[registration.procedure]
+            release_router_id(registration_id)
+            if self.remote is not None:
+                self.remote.withdraw(registration.procedure)
+        callee_registrations = self._callee_registrations[callee.id]
+        callee_registrations.discard(registration_id)
+        if not callee_registrations:
+            del self._callee_registrations[callee.id]
+        return registration
+
+    def invoke(self, call_message, caller):
+        """
+        Send an INVOCATION of call_message's procedure to the callee which
+        registered it. Return the Future of the Invocation (see Invocation).
+        """
+        registration = self[call_message.procedure]
+        callee = registration.select_callee()
+        request_ids = self._invocation_ids.setdefault(callee.id, SessionIdAllocator())
+        invocation = Invocation(request_ids.create(), registration, callee, call_message, caller)
+        self.invocations.setdefault(callee.id, {})[invocation.request_id] = invocation
+        self._calls.setdefault(caller.id, {})[call_message.request_id] = invocation
+        registration.invocation_started(callee)
+        invocation.future.add_done_callback(partial(self._on_invocation_done, invocation))
+
+        details = {}
+        if call_message.options.get("disclose_me"):
+            details["caller"] = caller.id
+        if call_message.options.get("receive_progress"):
+            details["receive_progress"] = True
+        message = InvocationMessage(
+            request_id=invocation.request_id,
+            registration_id=registration.id,
+            details=details,
+            args=call_message.args,
+            kwargs=call_message.kwargs
+        )
+        try:
+            callee.send_message(message)
+        except WebSocketClosedError:
+            error = invocation.build_error("wamp.error.canceled", "The callee of {0} is gone".format(registration.procedure))
+            self._finish(invocation, error)
+        return invocation.future
+
+    def yield_result(self, yield_message, callee):
+        """
+        Answer the caller of the invocation callee yielded. Return False if
+        there is no such invocation (e.g. the CALL timed out).
+
+        Progressive results (YIELDs whose "progress" option is set) are sent
+        to the caller straight away, if it asked for them, and the invocation
+        goes on.
+        """
+        invocation = self.invocations.get(callee.id, {}).get(yield_message.request_id)
+        if invocation is None:
+            return False
+        progress = bool(yield_message.options.get("progress"))
+        answer = ResultMessage(
+            request_id=invocation.call_message.request_id,
+            details={"progress": True} if progress else None,
+            args=yield_message.args,
+            kwargs=yield_message.kwargs
+        )
+        if not progress:
+            self._finish(invocation, answer)
+        elif invocation.call_message.options.get("receive_progress"):
+            try:
+                invocation.caller.send_message(answer)
+            except WebSocketClosedError:
+                pass
+        return True
+
+    def cancel(self, caller_id, request_id, mode="killnowait"):
+        """
+        Cancel the CALL request_id of the caller, according to mode (see the
+        "mode" option of CANCEL):
+        - "skip": the callee isn't told, and the caller is answered with an
+          ERROR at once
+        - "kill": the callee is sent an INTERRUPT, and its answer is sent to
+          the caller
+        - "killnowait": the callee is sent an INTERRUPT, and the caller is
+          answered with an ERROR at once
+        Return False if there is no such call.
+        """
+        invocation = self._calls.get(caller_id, {}).get(request_id)
+        if invocation is None:
+            return False
+        if mode != "skip":
+            self._interrupt(invocation, mode)
+        if mode != "kill":
+            self._finish(invocation, invocation.build_error("wamp.error.canceled", "The call was canceled"))
+        return True
+
+    def invocation_error(self, error_message, callee):
+        """
+        Forward the ERROR callee answered to an invocation to its caller.
+        Return False if there is no such invocation.
+        """
+        invocation = self.invocations.get(callee.id, {}).get(error_message.request_id)
+        if invocation is None:
+            return False
+        answer = invocation.build_error(
+            error_message.uri,
+            details=error_message.details,
+            args=error_message.args,
+            kwargs=error_message.kwargs
+        )
+        self._finish(invocation, answer)
+        return True
+
+    def remove_connection(self, connection):
+        """
+        Connection is to be removed: drop its registrations, answer the
+        invocations it didn't answer with an ERROR and forget its calls.
+        """
+        for registration_id in list(self._callee_registrations.get(connection.id, ())):
+            self.unregister(registration_id, connection)
+
+        for invocation in list(self.invocations.get(connection.id, {}).values()):
+            error = invocation.build_error("wamp.error.canceled", "The callee of {0} is gone".format(invocation.registration.procedure))
+            self._finish(invocation, error)
+        self._invocation_ids.pop(connection.id, None)
+
+        for invocation in list(self._calls.get(connection.id, {}).values()):
+            self._interrupt(invocation, "killnowait")
+            self._finish(invocation, None)
+
+    def _finish(self, invocation, answer):
+        self._forget(invocation)
+        if not invocation.future.done():
+            invocation.future.set_result((answer, []))
+
+    def _forget(self, invocation):
+        callee_id = invocation.callee.id
+        callee_invocations = self.invocations.get(callee_id, {})
+        if callee_invocations.get(invocation.request_id) is invocation:
+            del callee_invocations[invocation.request_id]
+            if not callee_invocations:
+                del self.invocations[callee_id]
+            invocation.registration.invocation_ended(invocation.callee)
+        calls = self._calls.get(invocation.caller.id, {})
+        if calls.get(invocation.call_message.request_id) is invocation:
+            del calls[invocation.call_message.request_id]
+            if not calls:
+                del self._calls[invocation.caller.id]
+
+    def _on_invocation_done(self, invocation, future):
+        if future.cancelled() and invocation.request_id in self.invocations.get(invocation.callee.id, {}):
+            # e.g. the CALL timed out
+            self._interrupt(invocation, "killnowait")
+        self._forget(invocation)
+
+    def _interrupt(self, invocation, mode):
+        """
+        Tell the callee of invocation to stop it (INTERRUPT).
+        """
+        try:
+            invocation.callee.send_message(InterruptMessage(request_id=invocation.request_id, options={"mode": mode}))
+        except WebSocketClosedError:
+            pass
+
+    @property
+    def remote(self):
+        """
+        RedisDealer routing CALLs to and from other nodes, or None if redis
+        isn't configured.
+        """
+        if self.redis is None:
+            return None
+        if self._remote is None or self._remote.redis_params != self.redis:
+            self._remote = RedisDealer(self, self.redis)
+        return self._remote
+
+    @property
+    def dict(self):
+        """
+        Return a python dictionary which could be jsonified.
+        """
+        return {procedure: registration.dict for procedure, registration in self.items()}
+
+
+registrations = RegistrationsManager()
+
+
+class RedisDealer(object):
+    """
+    Routes CALLs between nodes which share a redis server:
+    - the node of each registered procedure is kept in the redis hash
+      REGISTRATIONS_KEY, so a node receiving a CALL of a procedure which
+      isn't registered locally finds the node to forward it to.
+    - each node subscribes to its own channel (NODE_CHANNEL_PREFIX followed by
+      its id), in which it receives the CALLs forwarded to it and the answers
+      to the CALLs it forwarded. These are correlated by a request id, and
+      batched: the messages to each node are published together, once per
+      IOLoop iteration.
+
+    Forwarded CALLs are bound by the caller node's timeout (see
+    tornwamp.processors.rpc.CALL_TIMEOUT), including when the node of the
+    procedure is gone without removing it from REGISTRATIONS_KEY.
+    """
+    def __init__(self, registrations, redis_params):
+        self.registrations = registrations
+        self.redis_params = redis_params
+        self.node_id = messages.PUBLISHER_NODE_ID.hex
+        self.channel = NODE_CHANNEL_PREFIX + self.node_id
+        self._bridge = get_redis_bridge(redis_params)
+        # Future resolved once subscribed to channel
+        self._subscribed = None
+        self._request_ids = SessionIdAllocator()
+        # request id -> (Future, CALL, caller) of CALLs forwarded to other
+        # nodes, and (caller id, CALL request id) -> (node id, request id)
+        self._pending_calls = {}
+        self._forwarded_calls = {}
+        # node id -> messages to be published to its channel
+        self._outbox = {}
+        self._flush_scheduled = False
+
+    def announce(self, procedure):
+        """
+        Tell other nodes that procedure is registered by callees of this
+        node.
+        """
+        self.subscribe()
+        return self._bridge.call("HSET", REGISTRATIONS_KEY, procedure, self.node_id)
+
+    def withdraw(self, procedure):
+        """
+        Tell other nodes that procedure is no longer registered by callees of
+        this node, unless another node registered it meanwhile.
+        """
+        return self._bridge.call("EVAL", WITHDRAW_SCRIPT, 1, REGISTRATIONS_KEY, procedure, self.node_id)
+
+    def subscribe(self):
+        """
+        Subscribe to this node's channel, if needed. Return a Future resolved
+        with True once subscribed, or with False if it failed.
+        """
+        if self._subscribed is None:
+            self._subscribed = self._bridge.subscribe(self.channel, self._on_message, self._on_lost)
+        return self._subscribed
+
+    async def call(self, call_message, caller):
+        """
+        Forward call_message to the node whose callees registered its
+        procedure and return its answer and an empty list of broadcast
+        messages (as procedures of tornwamp.processors.rpc.customize do).
+        """
+        node_id = await self._bridge.call("HGET", REGISTRATIONS_KEY, call_message.procedure)
+        if isinstance(node_id, TornadisException):
+            return build_call_error(call_message, "wamp.error.network_failure", "Could not reach redis: {0}".format(node_id)), []
+        if node_id is None or node_id.decode("utf-8") == self.node_id:
+            error_msg = "The procedure {0} doesn't exist".format(call_message.procedure)
+            return build_call_error(call_message, "wamp.rpc.unsupported.procedure", error_msg), []
+        if not await self.subscribe():
+            return build_call_error(call_message, "wamp.error.network_failure", "Could not subscribe to redis"), []
+
+        node_id = node_id.decode("utf-8")
+        request_id = self._request_ids.create()
+        future = Future()
+        call_key = (caller.id, call_message.request_id)
+        self._pending_calls[request_id] = (future, call_message, caller)
+        self._forwarded_calls[call_key] = (node_id, request_id)
+        future.add_done_callback(partial(self._on_call_done, request_id, call_key))
+        self._send(node_id, {
+            "type": "call",
+            "request_id": request_id,
+            "reply_to": self.node_id,
+            "caller": caller.id,
+            "call": call_message.json
+        })
+        return await future
+
+    def cancel(self, caller_id, request_id, mode="killnowait"):
+        """
+        Cancel a CALL forwarded to another node (see
+        RegistrationsManager.cancel). Return False if there is no such call.
+        """
+        forwarded = self._forwarded_calls.get((caller_id, request_id))
+        if forwarded is None:
+            return False
+        node_id, forwarded_id = forwarded
+        self._send(node_id, {"type": "cancel", "caller": caller_id, "request_id": request_id, "mode": mode})
+        if mode != "kill":
+            future, call_message, _ = self._pending_calls[forwarded_id]
+            future.set_result((build_call_error(call_message, "wamp.error.canceled", "The call was canceled"), []))
+        return True
+
+    def send_answer(self, caller, answer, final=True):
+        """
+        Send answer to the remote caller. Unless final, the CALL is still in
+        progress (answer is a progressive result).
+        """
+        self._send(caller.node_id, {"type": "answer", "request_id": caller.request_id, "answer": answer.json, "final": final})
+
+    def _on_call_done(self, request_id, call_key, future):
+        # e.g. the CALL timed out or was canceled, see tornwamp.processors.rpc
+        self._pending_calls.pop(request_id, None)
+        node_id, _ = self._forwarded_calls.pop(call_key, (None, None))
+        if future.cancelled() and node_id is not None:
+            caller_id, call_request_id = call_key
+            self._send(node_id, {"type": "cancel", "caller": caller_id, "request_id": call_request_id, "mode": "killnowait"})
+
+    def _send(self, node_id, message):
+        self._outbox.setdefault(node_id, []).append(message)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            ioloop.IOLoop.current().add_callback(self._flush)
+
+    def _flush(self):
+        """
+        Publish the messages queued for each node in a single payload.
+        """
+        self._flush_scheduled = False
+        outbox, self._outbox = self._outbox, {}
+        for node_id, node_messages in outbox.items():
+            future = self._bridge.publish(NODE_CHANNEL_PREFIX + node_id, json_serializer.dumps(node_messages))
+            # calls which couldn't be forwarded time out (see
+            # tornwamp.processors.rpc.CALL_TIMEOUT), the error isn't needed
+            future.add_done_callback(lambda future: future.exception())
+
+    def _on_message(self, channel, raw_msg):
+        for message in json_serializer.loads(raw_msg.decode("utf-8")):
+            if message["type"] == "call":
+                self._on_call(message)
+            elif message["type"] == "answer":
+                self._on_answer(message)
+            elif message["type"] == "cancel":
+                self.registrations.cancel(message["caller"], message["request_id"], message["mode"])
+
+    def _on_call(self, message):
+        """
+        Invoke a callee of this node on behalf of a caller of another node,
+        and send it the answer once the callee answers.
+        """
+        call_message = decode_message(message["call"])
+        caller = RemoteCaller(message["caller"], message["reply_to"], message["request_id"], self)
+        if call_message.procedure in self.registrations:
+            future = self.registrations.invoke(call_message, caller)
+        else:
+            # the procedure was unregistered meanwhile
+            future = Future()
+            error_msg = "The procedure {0} doesn't exist".format(call_message.procedure)
+            future.set_result((build_call_error(call_message, "wamp.rpc.unsupported.procedure", error_msg), []))
+        ioloop.IOLoop.current().add_future(future, partial(self._send_answer, caller))
+
+    def _send_answer(self, caller, future):
+        answer, _ = future.result()
+        if answer is not None:
+            self.send_answer(caller, answer)
+
+    def _on_answer(self, message):
+        pending = self._pending_calls.get(message["request_id"])
+        if pending is None:
+            # e.g. the CALL timed out
+            return
+        future, _, caller = pending
+        answer = decode_message(message["answer"])
+        if not message.get("final", True):
+            try:
+                caller.send_message(answer)
+            except WebSocketClosedError:
+                pass
+        elif not future.done():
+            future.set_result((answer, []))
+
+    def _on_lost(self):
+        """
+        The connection with redis was lost: answer the CALLs forwarded to
+        other nodes with an ERROR, and subscribe again.
+        """
+        self._subscribed = None
+        pending_calls, self._pending_calls = self._pending_calls, {}
+        self._forwarded_calls = {}
+        for future, call_message, _ in pending_calls.values():
+            if not future.done():
+                error = build_call_error(call_message, "wamp.error.network_failure", "Connection with redis was lost")
+                future.set_result((error, []))
+        if self.registrations:
+            ioloop.IOLoop.current().call_later(RESUBSCRIBE_INTERVAL, self.subscribe)
@@ -4,11 +4,11 @@ Implement Tornado WAMP Handler.
 from tornado import gen
 from tornado.websocket import WebSocketHandler
 
-import greenlet_tornado
-
-from tornwamp import customize, session, topic
-from tornwamp.messages import AbortMessage, Message
-from tornwamp.processors import UnhandledProcessor
+from tornwamp import customize, dealer, session, topic
+from tornwamp.identifier import release_global_id
+from tornwamp.messages import AbortMessage, InvalidMessageError, decode_message
+from tornwamp.processors import UnhandledProcessor, rpc
+from tornwamp.serializer import get_serializer, json_serializer
 
 
 SUBPROTOCOL = 'wamp.2.json'
@@ -20,22 +20,57 @@ def abort(handler, error_msg, details, reason='tornwamp.error.unauthorized'):
     """
     abort_message = AbortMessage(reason=reason)
     abort_message.error(error_msg, details)
-    handler.write_message(abort_message.json)
+    handler.send_message(abort_message)
     handler.close(1, error_msg)
 
 
 class WAMPHandler(WebSocketHandler):
     """
     WAMP WebSocket Handler.
+
+    Set batch_writes to True (e.g. in a subclass) to write the messages sent
+    to each connection once per IOLoop iteration, in a single frame for
+    clients which negotiated a batched subprotocol (e.g.
+    wamp.2.json.batched).
     """
+    batch_writes = False
 
     def __init__(self, *args, **kargs):
         self.connection = None
+        self._deregistered = False
+        self.serializer = json_serializer
         super(WAMPHandler, self).__init__(*args, **kargs)
 
     def select_subprotocol(self, subprotocols):
-        "Select WAMP 2 subprocotol"
-        return SUBPROTOCOL
+        """
+        Select the first WAMP 2 subprotocol offered by the client which has a
+        registered serializer (see tornwamp.serializer.serializers). If there
+        is none, no subprotocol is selected and messages are encoded as in
+        wamp.2.json.
+        """
+        serializer = get_serializer(subprotocols)
+        if serializer is None:
+            self.serializer = json_serializer
+            return None
+        self.serializer = serializer
+        return serializer.subprotocol
+
+    def send_message(self, msg):
+        """
+        Encode msg using the negotiated serializer and write it to the
+        WebSocket, in a binary frame if the serializer is binary.
+
+        Once the connection is open, messages go through its outbound queue
+        (see ClientConnection.send), so they keep their order relative to
+        events.
+        """
+        if self.connection is not None:
+            self.connection.send_message(msg)
+        else:
+            data = msg.encode(self.serializer)
+            if self.serializer.batched:
+                data = self.serializer.join([data])
+            self.write_message(data, binary=self.serializer.binary)
 
     def authorize(self):
         """
@@ -57,10 +92,16 @@ class WAMPHandler(WebSocketHandler):
 
     def deregister_connection(self):
         """
-        Remove connection from connection's manager.
+        Remove connection from connection's manager, dropping its
+        subscriptions, registrations and calls. This is only done once,
+        whichever side closes the WebSocket.
         """
-        if self.connection:
+        if self.connection and not self._deregistered:
+            self._deregistered = True
             topic.topics.remove_connection(self.connection)
+            rpc.cancel_calls(self.connection)
+            dealer.registrations.remove_connection(self.connection)
+            release_global_id(self.connection.id)
         return session.connections.pop(self.connection.id, None) if self.connection else None
 
     def open(self):
@@ -72,34 +113,62 @@ class WAMPHandler(WebSocketHandler):
         authorized, details, error_msg = self.authorize()
         if authorized:
             self.connection = session.ClientConnection(self, **details)
+            self.connection.serializer = self.serializer
+            self.connection.batch_writes = self.batch_writes
             self.register_connection()
         else:
             abort(self, error_msg, details)
 
-    @greenlet_tornado.asynchronous
-    def on_message(self, txt):
+    async def on_message(self, txt):
         """
         Handle incoming messages on the WebSocket. Each message will be parsed
         and handled by a Processor, which can be (re)defined by the user
         changing the value of 'processors' dict, available at
         tornwamp.customize module.
+
+        Frames of batched subprotocols may carry several messages, which are
+        handled in order.
         """
-        msg = Message.from_text(txt)
-        Processor = customize.processors.get(msg.code, UnhandledProcessor)
-        processor = Processor(msg, self.connection)
+        if self.serializer.batched:
+            try:
+                texts = self.serializer.split(txt)
+            except ValueError as error:
+                abort(self, str(error), {}, reason='wamp.error.protocol_violation')
+                return
+        else:
+            texts = [txt]
 
-        if self.connection and not self.connection.zombie:  # TODO: cover branch else
-            if processor.answer_message is not None:
-                self.write_message(processor.answer_message.json)
+        for text in texts:
+            try:
+                msg = decode_message(text, self.serializer)
+            except InvalidMessageError as error:
+                abort(self, str(error), {}, reason='wamp.error.protocol_violation')
+                return
+            Processor = customize.processors.get(msg.code, UnhandledProcessor)
+            processor = Processor(msg, self.connection)
+            await processor.wait()
 
-        customize.broadcast_messages(processor)
+            if self.connection and not self.connection.zombie:  # TODO: cover branch else
+                if processor.answer_message is not None:
+                    self.send_message(processor.answer_message)
 
-        if processor.must_close:
-            self.close(processor.close_code, processor.close_reason)
+            customize.broadcast_messages(processor)
+
+            if processor.must_close:
+                self.close(processor.close_code, processor.close_reason)
+                return
 
     def close(self, code=None, reason=None):
         """
         Invoked when a WebSocket is closed.
         """
         self.deregister_connection()
+        if self.connection is not None:
+            self.connection.flush()
         super(WAMPHandler, self).close(code, reason)
+
+    def on_close(self):
+        """
+        Invoked when the WebSocket is closed by the client.
+        """
+        self.deregister_connection()
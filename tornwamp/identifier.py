@@ -34,22 +34,127 @@ import random
 MIN_ID = 0
 MAX_ID = 2 ** 53
 
-existing_ids = []
+
+class GlobalIdAllocator(object):
+    """
+    Allocate IDs in the global scope (sessions and publications).
+
+    IDs are drawn randomly from [MIN_ID, MAX_ID] and kept in a set while in
+    use, so checking for collisions is O(1). Released IDs may be drawn again.
+    """
+
+    def __init__(self):
+        self.existing_ids = set()
+
+    def create(self):
+        """
+        Return a new global scope ID, which is not in use.
+
+        According to WAMP specification:
+        "IDs in the global scope MUST be drawn randomly from a uniform distribution
+        over the complete range [0, 2^53]"
+        """
+        new_id = random.randint(MIN_ID, MAX_ID)
+        while new_id in self.existing_ids:
+            new_id = random.randint(MIN_ID, MAX_ID)
+        self.existing_ids.add(new_id)
+        return new_id
+
+    def release(self, id_):
+        """
+        Make id_ available again, once the entity it identified has ended.
+        """
+        self.existing_ids.discard(id_)
+
+
+class RouterIdAllocator(object):
+    """
+    Allocate IDs in the router scope (subscriptions and registrations).
+
+    WAMP lets routers choose these freely, so they are handed out
+    sequentially, skipping the ones which are still in use after wrapping
+    around MAX_ID.
+    """
+
+    def __init__(self):
+        self.existing_ids = set()
+        self._last_id = MIN_ID
+
+    def create(self):
+        """
+        Return a new router scope ID, which is not in use.
+        """
+        new_id = self._next(self._last_id)
+        while new_id in self.existing_ids:
+            new_id = self._next(new_id)
+        self._last_id = new_id
+        self.existing_ids.add(new_id)
+        return new_id
+
+    def release(self, id_):
+        """
+        Make id_ available again, once the entity it identified has ended.
+        """
+        self.existing_ids.discard(id_)
+
+    @staticmethod
+    def _next(id_):
+        return id_ + 1 if id_ < MAX_ID else MIN_ID + 1
+
+
+class SessionIdAllocator(object):
+    """
+    Allocate IDs in the session scope (requests), for one direction of one
+    session.
+
+    According to WAMP specification, these "SHOULD be incremented by 1
+    beginning with 1". No bookkeeping is needed, as a session will not have
+    2^53 requests in flight.
+    """
+
+    def __init__(self):
+        self._last_id = MIN_ID
+
+    def create(self):
+        """
+        Return the next session scope ID.
+        """
+        self._last_id = self._last_id + 1 if self._last_id < MAX_ID else MIN_ID + 1
+        return self._last_id
+
+
+global_ids = GlobalIdAllocator()
+router_ids = RouterIdAllocator()
+
+# kept for backwards compatibility, it is the set of global IDs in use
+existing_ids = global_ids.existing_ids
 
 
 def create_global_id():
     """
-    Return a global scope ID, which is not in existing_ids list provided.
-    This function also appends new ID to original existing_ids list.
+    Return a global scope ID, which is not in use by any other session or
+    publication. It should be released with release_global_id.
+    """
+    return global_ids.create()
+
 
-    According to WAMP specification:
-    "IDs in the global scope MUST be drawn randomly from a uniform distribution
-    over the complete range [0, 2^53]"
+def release_global_id(id_):
+    """
+    Release a global scope ID created by create_global_id.
+    """
+    global_ids.release(id_)
+
+
+def create_router_id():
+    """
+    Return a router scope ID, which is not in use by any other subscription
+    or registration. It should be released with release_router_id.
+    """
+    return router_ids.create()
+
+
+def release_router_id(id_):
+    """
+    Release a router scope ID created by create_router_id.
     """
-    new_id = None
-    while new_id not in existing_ids:
-        candidate_id = random.randint(MIN_ID, MAX_ID)
-        if candidate_id not in existing_ids:
-            new_id = candidate_id
-            existing_ids.append(new_id)
-    return new_id
+    router_ids.release(id_)
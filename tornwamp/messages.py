@@ -4,14 +4,24 @@ WAMP messages definitions and serializers.
 Compatible with WAMP Document Revision: RC3, 2014/08/25, available at:
 https://github.com/tavendo/WAMP/blob/master/spec/basic.md
 """
-import json
 import uuid
-from copy import deepcopy
 
 from enum import IntEnum
 from tornwamp.identifier import create_global_id
+from tornwamp.serializer import json_serializer
 
 PUBLISHER_NODE_ID = uuid.uuid4()
+# Id shared by the worker processes of a host, which deliver publications to
+# each other through a local bus (see tornwamp.supervisor), None otherwise
+PUBLISHER_HOST_ID = None
+
+# Format of the broadcast messages sent to other nodes (see BroadcastMessage).
+# Set it to 1 while nodes running versions which only read that format are
+# being upgraded. Both formats are always accepted.
+BROADCAST_FORMAT_VERSION = 2
+
+# Stands for the subscription id while an EVENT template is being encoded
+SUBSCRIPTION_ID_PLACEHOLDER = u"tornwamp.subscription_id.placeholder"
 
 
 class Code(IntEnum):
@@ -34,15 +44,15 @@ class Code(IntEnum):
     UNSUBSCRIBED = 35
     EVENT = 36
     CALL = 48
-    # CANCEL = 49
+    CANCEL = 49
     RESULT = 50
-    # REGISTER = 64
-    # REGISTERED = 65
-    # UNREGISTER = 66
-    # UNREGISTERED = 67
-    # INVOCATION = 68
-    # INTERRUPT = 69
-    # YIELD = 70
+    REGISTER = 64
+    REGISTERED = 65
+    UNREGISTER = 66
+    UNREGISTERED = 67
+    INVOCATION = 68
+    INTERRUPT = 69
+    YIELD = 70
 
 
 class BroadcastMessage(object):
@@ -50,6 +60,18 @@ class BroadcastMessage(object):
     This is a message that a procedure may want delivered.
 
     This class is composed of an EventMessage and a topic name
+
+    Messages published by worker processes of a supervisor also carry its
+    publisher_host_id, so that the other workers of the host, which got them
+    through the local bus, ignore them when they come through redis.
+
+    It is sent to other nodes in one of these formats:
+    - 1: a JSON object with the publisher ids, the topic name and the event
+      JSON encoded as a string ("event_message");
+    - 2: the version, a JSON object with the publisher ids and the topic name
+      and the event JSON encoding (see EncodedEventMessage), separated by
+      new lines. The event is neither escaped nor parsed by nodes which
+      forward it to wamp.2.json subscribers.
     """
     def __init__(self, topic_name, event_message, publisher_connection_id):
         assert isinstance(event_message, EventMessage), "only event messages are supported"
@@ -57,34 +79,74 @@ class BroadcastMessage(object):
         self.event_message = event_message
         self.publisher_connection_id = publisher_connection_id
         self.publisher_node_id = PUBLISHER_NODE_ID.hex
+        self.publisher_host_id = PUBLISHER_HOST_ID
+
+    @property
+    def is_local(self):
+        """
+        Return True if the message was published by this process or, when it
+        is a worker of a supervisor, by another worker of the same host.
+        """
+        if self.publisher_node_id == PUBLISHER_NODE_ID.hex:
+            return True
+        return self.publisher_host_id is not None and self.publisher_host_id == PUBLISHER_HOST_ID
 
     @property
     def json(self):
-        return json.dumps({
+        """
+        Encode the message in the format of BROADCAST_FORMAT_VERSION.
+        """
+        header = {
             "publisher_node_id": self.publisher_node_id,
             "publisher_connection_id": self.publisher_connection_id,
             "topic_name": self.topic_name,
-            "event_message": self.event_message.json,
-        })
+        }
+        if self.publisher_host_id is not None:
+            header["publisher_host_id"] = self.publisher_host_id
+        if BROADCAST_FORMAT_VERSION == 1:
+            header["event_message"] = self.event_message.json
+            return json_serializer.dumps(header)
+        event_text = self.event_message._encode_with_placeholder(json_serializer)
+        return u"2\n{0}\n{1}".format(json_serializer.dumps(header), event_text)
 
     @classmethod
     def from_text(cls, text):
-        raw = json.loads(text)
-        event_msg = EventMessage.from_text(raw["event_message"])
+        """
+        Decode a message in any of the supported formats.
+        """
+        if text.startswith("{"):
+            raw = json_serializer.loads(text)
+            event_msg = EventMessage.from_text(raw["event_message"])
+        else:
+            version, header, event_text = text.split("\n", 2)
+            if version != "2":
+                raise InvalidMessageError("Unsupported broadcast message format: {0}".format(version))
+            raw = json_serializer.loads(header)
+            event_msg = EncodedEventMessage(event_text)
         msg = cls(
             topic_name=raw["topic_name"],
             event_message=event_msg,
             publisher_connection_id=raw["publisher_connection_id"]
         )
         msg.publisher_node_id = raw["publisher_node_id"]
+        msg.publisher_host_id = raw.get("publisher_host_id")
         return msg
 
 
+class InvalidMessageError(Exception):
+    pass
+
+
 class Message(object):
     """
     Represent any WAMP message.
     """
     details = {}
+    # minimum and maximum length of the message (code included)
+    arity = (1, None)
+    # types of the elements which follow the code (int for IDs, str for URIs),
+    # checked by decode_message
+    types = ()
 
     def __init__(self, code, *data, **kdata):
         self.code = code
@@ -102,17 +164,27 @@ class Message(object):
             return self.value[1]
         return -1
 
+    @property
+    def wire_value(self):
+        """
+        Return a shallow copy of value in which Code members (only used as
+        top level items) are replaced by plain ints, so the payload (details,
+        args, kwargs) is never copied.
+        """
+        return [item.value if isinstance(item, Code) else item for item in self.value]
+
     @property
     def json(self):
         """
         Create a JSON representation of this message.
         """
-        message_value = deepcopy(self.value)
-        # TODO: test
-        for index, item in enumerate(message_value):
-            if isinstance(item, Code):
-                message_value[index] = item.value
-        return json.dumps(message_value)
+        return json_serializer.dumps(self.wire_value)
+
+    def encode(self, serializer=json_serializer):
+        """
+        Encode this message using serializer (see tornwamp.serializer).
+        """
+        return serializer.dumps(self.wire_value)
 
     def error(self, text, info=None):
         """
@@ -129,7 +201,7 @@ class Message(object):
         """
         Decode text to JSON and return a Message object accordingly.
         """
-        raw = json.loads(text)
+        raw = json_serializer.loads(text)
         raw[0] = Code(raw[0])  # make it an object of type Code
         return cls(*raw)
 
@@ -153,6 +225,8 @@ class HelloMessage(Message):
 
     https://github.com/tavendo/WAMP/blob/master/spec/basic.md#hello
     """
+    arity = (3, 3)
+    types = (str, dict)
 
     def __init__(self, code=Code.HELLO, realm="", details=None):
         self.code = code
@@ -168,6 +242,8 @@ class AbortMessage(Message):
 
     https://github.com/tavendo/WAMP/blob/master/spec/basic.md#abort
     """
+    arity = (3, 3)
+    types = (dict, str)
 
     def __init__(self, code=Code.ABORT, details=None, reason=None):
         assert reason is not None, "AbortMessage must have a reason"
@@ -185,13 +261,16 @@ DEFAULT_WELCOME_DETAILS = {
             "features": {
                 "publisher_identification": True,
                 "publisher_exclusion": True,
-                "subscriber_blackwhite_listing": True
+                "subscriber_blackwhite_listing": True,
+                "pattern_based_subscription": True
             }
         },
         "dealer": {
             "features": {
                 "progressive_call_results": True,
-                "caller_identification": True
+                "caller_identification": True,
+                "shared_registration": True,
+                "call_canceling": True
             }
         }
     },
@@ -208,6 +287,8 @@ class WelcomeMessage(Message):
 
     https://github.com/tavendo/WAMP/blob/master/spec/basic.md#welcome
     """
+    arity = (3, 3)
+    types = (int, dict)
 
     def __init__(self, code=Code.WELCOME, session_id=None, details=None):
         self.code = code
@@ -221,6 +302,8 @@ class GoodbyeMessage(Message):
     Both the Server and the Client may abort the opening of a WAMP session
     [ABORT, Details|dict, Reason|uri]
     """
+    arity = (3, 3)
+    types = (dict, str)
 
     def __init__(self, code=Code.GOODBYE, details=None, reason=None):
         self.code = code
@@ -237,6 +320,8 @@ class ResultMessage(Message):
     [RESULT, CALL.Request|id, Details|dict, YIELD.Arguments|list]
     [RESULT, CALL.Request|id, Details|dict, YIELD.Arguments|list, YIELD.ArgumentsKw|dict]
     """
+    arity = (3, 5)
+    types = (int, dict, list, dict)
 
     def __init__(self, code=Code.RESULT, request_id=None, details=None, args=None, kwargs=None):
         assert request_id is not None, "ResultMessage must have request_id"
@@ -261,6 +346,8 @@ class CallMessage(Message):
     [CALL, Request|id, Options|dict, Procedure|uri, Arguments|list]
     [CALL, Request|id, Options|dict, Procedure|uri, Arguments|list, ArgumentsKw|dict]
     """
+    arity = (4, 6)
+    types = (int, dict, str, list, dict)
 
     def __init__(self, code=Code.CALL, request_id=None, options=None, procedure=None, args=None, kwargs=None):
         assert request_id is not None, "CallMessage must have request_id"
@@ -291,6 +378,8 @@ class ErrorMessage(Message):
     [ERROR, REQUEST.Type|int, REQUEST.Request|id, Details|dict, Error|uri,
         Arguments|list, ArgumentsKw|dict]
     """
+    arity = (5, 7)
+    types = (int, int, dict, str, list, dict)
 
     def __init__(self, code=Code.ERROR, request_code=None, request_id=None, details=None, uri=None, args=None, kwargs=None):
         assert request_code is not None, "ErrorMessage must have request_code"
@@ -319,6 +408,8 @@ class SubscribeMessage(Message):
     a SUBSCRIBE message:
     [SUBSCRIBE, Request|id, Options|dict, Topic|uri]
     """
+    arity = (4, 4)
+    types = (int, dict, str)
 
     def __init__(self, code=Code.SUBSCRIBE, request_id=None, options=None, topic=None):
         assert request_id is not None, "SubscribeMessage must have request_id"
@@ -336,6 +427,9 @@ class SubscribedMessage(Message):
     sending a SUBSCRIBED message to the Subscriber:
     [SUBSCRIBED, SUBSCRIBE.Request|id, Subscription|id]
     """
+    arity = (3, 3)
+    types = (int, int)
+
     def __init__(self, code=Code.SUBSCRIBED, request_id=None, subscription_id=None):
         assert request_id is not None, "SubscribedMessage must have request_id"
         assert subscription_id is not None, "SubscribedMessage must have subscription_id"
@@ -353,6 +447,9 @@ class PublishMessage(Message):
     [PUBLISH, Request|id, Options|dict, Topic|uri, Arguments|list]
     [PUBLISH, Request|id, Options|dict, Topic|uri, Arguments|list, ArgumentsKw|dict]
     """
+    arity = (4, 6)
+    types = (int, dict, str, list, dict)
+
     def __init__(self, code=Code.PUBLISH, request_id=None, options=None, topic=None, args=None, kwargs=None):
         assert request_id is not None, "PublishMessage must have request_id"
         assert topic is not None, "PublishMessage must have topic"
@@ -372,6 +469,9 @@ class PublishedMessage(Message):
 
     [PUBLISHED, PUBLISH.Request|id, Publication|id]
     """
+    arity = (3, 3)
+    types = (int, int)
+
     def __init__(self, code=Code.PUBLISHED, request_id=None, publication_id=None):
         assert request_id is not None, "PublishedMessage must have request_id"
         assert publication_id is not None, "PublishedMessage must have publication_id"
@@ -393,6 +493,9 @@ class EventMessage(Message):
     subscription_id will be omitted (it can only be resolved in the
     subscriber.)
     """
+    arity = (4, 6)
+    types = (int, int, dict, list, dict)
+
     def __init__(self, code=Code.EVENT, subscription_id=None, publication_id=None, details=None, args=None, kwargs=None):
         assert publication_id is not None, "EventMessage must have publication_id"
         self.code = code
@@ -413,12 +516,126 @@ class EventMessage(Message):
         self._subscription_id = id_
         self.value[1] = id_
 
+    def with_topic(self, topic_name):
+        """
+        Return a copy of this message whose details tell the topic in which
+        it was published, as sent to pattern-based subscribers.
+        """
+        details = dict(self.details, topic=topic_name)
+        return EventMessage(publication_id=self.publication_id, details=details, args=self.args, kwargs=self.kwargs)
+
+    @property
+    def json_template(self):
+        """
+        Return the EventTemplate of this message for the wamp.2.json
+        subprotocol.
+        """
+        return self.template(json_serializer)
+
+    def template(self, serializer):
+        """
+        Return an EventTemplate, which encodes the parts of this message that
+        are shared by all subscribers (publication id, details, args and
+        kwargs) only once, using serializer.
+        """
+        data = self._encode_with_placeholder(serializer)
+        prefix, _, suffix = data.partition(serializer.dumps(SUBSCRIPTION_ID_PLACEHOLDER))
+        return EventTemplate(prefix, suffix, serializer)
+
+    def _encode_with_placeholder(self, serializer):
+        """
+        Encode this message using serializer, with SUBSCRIPTION_ID_PLACEHOLDER
+        in place of its subscription id.
+        """
+        value = self.wire_value
+        value[1] = SUBSCRIPTION_ID_PLACEHOLDER
+        return serializer.dumps(value)
+
+
+class EncodedEventMessage(EventMessage):
+    """
+    EventMessage received from another node, kept as it was encoded by
+    _encode_with_placeholder using json_serializer.
+
+    Its JSON templates are built straight from that text, which is only
+    parsed when the message content is accessed (e.g. to be encoded by
+    another serializer).
+    """
+    def __init__(self, text):
+        self.code = Code.EVENT
+        self._subscription_id = None
+        self._text = text
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            value = json_serializer.loads(self._text)
+            value[0] = Code(value[0])
+            value[1] = self._subscription_id
+            self._value = value
+        return self._value
+
+    @EventMessage.subscription_id.setter
+    def subscription_id(self, id_):
+        self._subscription_id = id_
+        if self._value is not None:
+            self._value[1] = id_
+
+    @property
+    def publication_id(self):
+        return self.value[2]
+
+    @property
+    def details(self):
+        return self.value[3]
+
+    @property
+    def args(self):
+        return self.value[4] if len(self.value) > 4 else []
+
+    @property
+    def kwargs(self):
+        return self.value[5] if len(self.value) > 5 else {}
+
+    def _encode_with_placeholder(self, serializer):
+        if serializer is json_serializer:
+            return self._text
+        return super(EncodedEventMessage, self)._encode_with_placeholder(serializer)
+
+
+class EventTemplate(object):
+    """
+    Pre-encoded EVENT message, to which only the subscription id is missing.
+
+    Used when delivering the same event to several subscribers, so the
+    payload is not serialized once per subscription.
+    """
+    def __init__(self, prefix, suffix, serializer=json_serializer):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.serializer = serializer
+
+    def render(self, subscription_id):
+        """
+        Return the event for subscription_id, encoded by the template's
+        serializer.
+        """
+        if type(subscription_id) is int and not self.serializer.binary:
+            encoded_id = str(subscription_id)
+        else:
+            encoded_id = self.serializer.dumps(subscription_id)
+        return self.prefix + encoded_id + self.suffix
+
 
 class UnsubscribeMessage(Message):
     """
     Unsubscribe request sent by a Subscriber to a Broker to unsubscribe a subscription.
     [UNSUBSCRIBE, Request|id, SUBSCRIBED.Subscription|id]
     """
+    arity = (3, 3)
+    types = (int, int)
+
     def __init__(self, code=Code.UNSUBSCRIBE, request_id=None, subscription_id=None):
         assert request_id is not None, "UnsubscribeMessage must have request_id"
         assert subscription_id is not None, "UnsubscribeMessage must have subscription_id"
@@ -433,6 +650,9 @@ class UnsubscribedMessage(Message):
     Acknowledge sent by a Broker to a Subscriber to acknowledge unsubscription.
     [UNSUBSCRIBED, UNSUBSCRIBE.Request|id]
     """
+    arity = (2, 2)
+    types = (int,)
+
     def __init__(self, code=Code.UNSUBSCRIBED, request_id=None):
         assert request_id is not None, "UnsubscribedMessage must have request_id"
         self.code = code
@@ -440,6 +660,158 @@ class UnsubscribedMessage(Message):
         self.value = [self.code, self.request_id]
 
 
+class RegisterMessage(Message):
+    """
+    Sent by a Callee to a Dealer to register a procedure endpoint.
+
+    [REGISTER, Request|id, Options|dict, Procedure|uri]
+    """
+    arity = (4, 4)
+    types = (int, dict, str)
+
+    def __init__(self, code=Code.REGISTER, request_id=None, options=None, procedure=None):
+        assert request_id is not None, "RegisterMessage must have request_id"
+        assert procedure is not None, "RegisterMessage must have procedure"
+        self.code = code
+        self.request_id = request_id
+        self.options = options or {}
+        self.procedure = procedure
+        self.value = [self.code, self.request_id, self.options, self.procedure]
+
+
+class RegisteredMessage(Message):
+    """
+    Acknowledge sent by a Dealer to a Callee for successful registration.
+
+    [REGISTERED, REGISTER.Request|id, Registration|id]
+    """
+    arity = (3, 3)
+    types = (int, int)
+
+    def __init__(self, code=Code.REGISTERED, request_id=None, registration_id=None):
+        assert request_id is not None, "RegisteredMessage must have request_id"
+        assert registration_id is not None, "RegisteredMessage must have registration_id"
+        self.code = code
+        self.request_id = request_id
+        self.registration_id = registration_id
+        self.value = [self.code, self.request_id, self.registration_id]
+
+
+class UnregisterMessage(Message):
+    """
+    Sent by a Callee to a Dealer to unregister a previously registered
+    procedure endpoint.
+
+    [UNREGISTER, Request|id, REGISTERED.Registration|id]
+    """
+    arity = (3, 3)
+    types = (int, int)
+
+    def __init__(self, code=Code.UNREGISTER, request_id=None, registration_id=None):
+        assert request_id is not None, "UnregisterMessage must have request_id"
+        assert registration_id is not None, "UnregisterMessage must have registration_id"
+        self.code = code
+        self.request_id = request_id
+        self.registration_id = registration_id
+        self.value = [self.code, self.request_id, self.registration_id]
+
+
+class UnregisteredMessage(Message):
+    """
+    Acknowledge sent by a Dealer to a Callee for successful unregistration.
+
+    [UNREGISTERED, UNREGISTER.Request|id]
+    """
+    arity = (2, 2)
+    types = (int,)
+
+    def __init__(self, code=Code.UNREGISTERED, request_id=None):
+        assert request_id is not None, "UnregisteredMessage must have request_id"
+        self.code = code
+        self.request_id = request_id
+        self.value = [self.code, self.request_id]
+
+
+class InvocationMessage(Message):
+    """
+    Actual invocation of an endpoint sent by Dealer to a Callee.
+
+    [INVOCATION, Request|id, REGISTERED.Registration|id, Details|dict]
+    [INVOCATION, Request|id, REGISTERED.Registration|id, Details|dict, CALL.Arguments|list]
+    [INVOCATION, Request|id, REGISTERED.Registration|id, Details|dict, CALL.Arguments|list, CALL.ArgumentsKw|dict]
+    """
+    arity = (4, 6)
+    types = (int, int, dict, list, dict)
+
+    def __init__(self, code=Code.INVOCATION, request_id=None, registration_id=None, details=None, args=None, kwargs=None):
+        assert request_id is not None, "InvocationMessage must have request_id"
+        assert registration_id is not None, "InvocationMessage must have registration_id"
+        self.code = code
+        self.request_id = request_id
+        self.registration_id = registration_id
+        self.details = details or {}
+        self.args = args or []
+        self.kwargs = kwargs or {}
+        self.value = [self.code, self.request_id, self.registration_id, self.details]
+        self._update_args_and_kargs()
+
+
+class CancelMessage(Message):
+    """
+    Sent by a Caller to a Dealer to cancel a call it issued.
+
+    [CANCEL, CALL.Request|id, Options|dict]
+    """
+    arity = (3, 3)
+    types = (int, dict)
+
+    def __init__(self, code=Code.CANCEL, request_id=None, options=None):
+        assert request_id is not None, "CancelMessage must have request_id"
+        self.code = code
+        self.request_id = request_id
+        self.options = options or {}
+        self.value = [self.code, self.request_id, self.options]
+
+
+class InterruptMessage(Message):
+    """
+    Sent by a Dealer to a Callee to cancel an invocation.
+
+    [INTERRUPT, INVOCATION.Request|id, Options|dict]
+    """
+    arity = (3, 3)
+    types = (int, dict)
+
+    def __init__(self, code=Code.INTERRUPT, request_id=None, options=None):
+        assert request_id is not None, "InterruptMessage must have request_id"
+        self.code = code
+        self.request_id = request_id
+        self.options = options or {}
+        self.value = [self.code, self.request_id, self.options]
+
+
+class YieldMessage(Message):
+    """
+    Result of an invocation as returned by a Callee to the Dealer.
+
+    [YIELD, INVOCATION.Request|id, Options|dict]
+    [YIELD, INVOCATION.Request|id, Options|dict, Arguments|list]
+    [YIELD, INVOCATION.Request|id, Options|dict, Arguments|list, ArgumentsKw|dict]
+    """
+    arity = (3, 5)
+    types = (int, dict, list, dict)
+
+    def __init__(self, code=Code.YIELD, request_id=None, options=None, args=None, kwargs=None):
+        assert request_id is not None, "YieldMessage must have request_id"
+        self.code = code
+        self.request_id = request_id
+        self.options = options or {}
+        self.args = args or []
+        self.kwargs = kwargs or {}
+        self.value = [self.code, self.request_id, self.options]
+        self._update_args_and_kargs()
+
+
 CODE_TO_CLASS = {
     Code.HELLO: HelloMessage,
     Code.WELCOME: WelcomeMessage,
@@ -457,18 +829,60 @@ CODE_TO_CLASS = {
     Code.UNSUBSCRIBED: UnsubscribedMessage,
     Code.EVENT: EventMessage,
     Code.CALL: CallMessage,
-    # CANCEL = 49
-    Code.RESULT: ResultMessage
-    # REGISTER = 64
-    # REGISTERED = 65
-    # UNREGISTER = 66
-    # UNREGISTERED = 67
-    # INVOCATION = 68
-    # INTERRUPT = 69
-    # YIELD = 70
+    Code.CANCEL: CancelMessage,
+    Code.RESULT: ResultMessage,
+    Code.REGISTER: RegisterMessage,
+    Code.REGISTERED: RegisteredMessage,
+    Code.UNREGISTER: UnregisterMessage,
+    Code.UNREGISTERED: UnregisteredMessage,
+    Code.INVOCATION: InvocationMessage,
+    Code.INTERRUPT: InterruptMessage,
+    Code.YIELD: YieldMessage
 }
 
-ERROR_PRONE_CODES = [Code.CALL, Code.SUBSCRIBE, Code.UNSUBSCRIBE, Code.PUBLISH]
+ERROR_PRONE_CODES = [Code.CALL, Code.SUBSCRIBE, Code.UNSUBSCRIBE, Code.PUBLISH, Code.REGISTER, Code.UNREGISTER]
+
+
+def decode_message(text, serializer=json_serializer):
+    """
+    Decode text (encoded by serializer) and return an instance of the Message
+    subclass its code stands for (or of Message, if the code is not
+    supported), parsing it only once.
+
+    Raise InvalidMessageError if text is not a WAMP message, if it doesn't
+    have as many elements as its code requires or if they don't have the
+    types it requires (see Message.types).
+    """
+    try:
+        raw = serializer.loads(text)
+    except ValueError as error:
+        raise InvalidMessageError("Message is not valid {0}: {1}".format(serializer.subprotocol, error))
+    if not isinstance(raw, list) or not raw or not _is_int(raw[0]):
+        raise InvalidMessageError("Message must be a list starting with its code: {0}".format(text))
+
+    try:
+        code = Code(raw[0])
+    except ValueError:
+        return Message(*raw)
+    MsgClass = CODE_TO_CLASS.get(code, Message)
+    min_length, max_length = MsgClass.arity
+    if len(raw) < min_length or (max_length is not None and len(raw) > max_length):
+        raise InvalidMessageError("{0} message must have from {1} to {2} elements: {3}".format(code.name, min_length, max_length, text))
+    for position, (element, element_type) in enumerate(zip(raw[1:], MsgClass.types), 1):
+        if not (_is_int(element) if element_type is int else isinstance(element, element_type)):
+            raise InvalidMessageError("{0} message element {1} must be of type {2}: {3}".format(code.name, position, element_type.__name__, text))
+    raw[0] = code
+    try:
+        return MsgClass(*raw)
+    except (AssertionError, TypeError) as error:
+        raise InvalidMessageError("Invalid {0} message ({1}): {2}".format(code.name, error, text))
+
+
+def _is_int(value):
+    """
+    Return True if value is an int (but not a bool, as in [true, ...]).
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
 
 
 def build_error_message(in_message, uri, description):
@@ -480,10 +894,8 @@ def build_error_message(in_message, uri, description):
 
     (*) If incoming message is not prone to ERROR message reponse, return None.
     """
-    msg = Message.from_text(in_message)
+    msg = decode_message(in_message)
     if msg.code in ERROR_PRONE_CODES:
-        MsgClass = CODE_TO_CLASS[msg.code]
-        msg = MsgClass.from_text(in_message)
         answer = ErrorMessage(
             request_code=msg.code,
             request_id=msg.request_id,
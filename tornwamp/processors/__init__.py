@@ -4,11 +4,19 @@ feedback to the server on what should be done (e.g. send answer message order
 close connection).
 """
 import abc
+import inspect
 import six
 
 from tornado import gen
 
-from tornwamp.messages import Message, ErrorMessage, GoodbyeMessage, HelloMessage, WelcomeMessage
+from tornwamp.messages import ErrorMessage, WelcomeMessage
+from tornwamp.utils import call_in_greenlet
+
+# Synchronous processors run in a child greenlet, if greenlet is installed, so
+# they (and the hooks they call) may wait for futures with the deprecated
+# tornwamp.utils.run_async. Set it to False if none does, which spares
+# creating a greenlet per message.
+RUN_IN_GREENLET = True
 
 
 class Processor(six.with_metaclass(abc.ABCMeta)):
@@ -22,8 +30,9 @@ class Processor(six.with_metaclass(abc.ABCMeta)):
 
     def __init__(self, message, connection):
         """
-        msg: json
-        session_id: string or number
+        message: Message instance, of the class defined for its code in
+            tornwamp.messages.CODE_TO_CLASS (see decode_message)
+        connection: ClientConnection which received the message
         """
         self.session_id = getattr(connection, "id", None)
         self.connection = connection
@@ -42,7 +51,21 @@ class Processor(six.with_metaclass(abc.ABCMeta)):
         self.close_code = None
         self.close_reason = None
 
-        self.process()
+        # process may be a coroutine, see wait. Synchronous ones run in a
+        # greenlet, in which they may call the deprecated utils.run_async
+        if RUN_IN_GREENLET and not inspect.iscoroutinefunction(self.process):
+            self._processing = call_in_greenlet(self.process)
+        else:
+            self._processing = self.process()
+
+    async def wait(self):
+        """
+        Wait for process to finish, if it is a coroutine. The attributes it
+        sets (e.g. answer_message) are only available after that.
+        """
+        if inspect.isawaitable(self._processing):
+            processing, self._processing = self._processing, None
+            await processing
 
     @abc.abstractmethod
     def process(self):
@@ -55,6 +78,11 @@ class Processor(six.with_metaclass(abc.ABCMeta)):
         - must_close
         - close_code (1000 or in the range 3000 to 4999)
         - close_message
+
+        It may be a coroutine (async def), e.g. to await redis or other
+        services, in which case the WebSocket handles the next message only
+        after it is done. This is also the case of synchronous ones which
+        wait for futures with the deprecated tornwamp.utils.run_async.
         """
 
 
@@ -63,7 +91,7 @@ class UnhandledProcessor(Processor):
     Raises an error when the provided message can't be parsed
     """
     def process(self):
-        message = Message(*self.message.value)
+        message = self.message
         description = "Unsupported message {0}".format(self.message.value)
         out_message = ErrorMessage(
             request_code=message.code,
@@ -84,7 +112,7 @@ class HelloProcessor(Processor):
         """
         # hello_message = HelloMessage(*self.message.value)
         # TODO: assert realm is in allowed list
-        welcome_message = WelcomeMessage()
+        welcome_message = WelcomeMessage(session_id=self.session_id)
         self.answer_message = welcome_message
 
 
@@ -93,7 +121,7 @@ class GoodbyeProcessor(Processor):
     Responsible for dealing GOODBYE messages.
     """
     def process(self):
-        self.answer_message = GoodbyeMessage(*self.message.value)
+        self.answer_message = self.message
         self.must_close = True
         # Excerpt from RFC6455 (The WebSocket Protocol)
         # "Endpoints MAY: use the following pre-defined status codes when sending
@@ -1,12 +1,15 @@
 """ WAMP-PubSub processors.
 """
+import inspect
+
 from tornado import gen
 
 from tornwamp.identifier import create_global_id
-from tornwamp.messages import ErrorMessage, EventMessage, PublishMessage, PublishedMessage, SubscribeMessage, SubscribedMessage, BroadcastMessage
+from tornwamp.messages import ErrorMessage, PublishedMessage, SubscribedMessage, UnsubscribedMessage
 from tornwamp.processors import Processor
 from tornwamp.processors.pubsub import customize
 from tornwamp import topic as tornwamp_topic
+from tornwamp.topic.matcher import EXACT, MATCH_POLICIES
 
 
 class SubscribeProcessor(Processor):
@@ -17,12 +20,23 @@ class SubscribeProcessor(Processor):
         """
         Return SUBSCRIBE message based on the input HELLO message.
         """
-        received_message = SubscribeMessage(*self.message.value)
-        allow, msg = customize.authorize_subscription(received_message.topic, self.connection)
+        received_message = self.message
+        match = received_message.options.get("match", EXACT)
+        if match not in MATCH_POLICIES:
+            answer = ErrorMessage(
+                request_id=received_message.request_id,
+                request_code=received_message.code,
+                uri="wamp.error.invalid_argument"
+            )
+            answer.error("Unsupported match policy: {0}".format(match))
+            self.answer_message = answer
+            return
+        allow, msg = _authorize_subscription(received_message.topic, self.connection, match)
         if allow:
             subscription_id = tornwamp_topic.topics.add_subscriber(
                 received_message.topic,
                 self.connection,
+                match=match
             )
             answer = SubscribedMessage(
                 request_id=received_message.request_id,
@@ -39,6 +53,52 @@ class SubscribeProcessor(Processor):
         self.answer_message = answer
 
 
+def _authorize_subscription(topic_name, connection, match):
+    """
+    Call customize.authorize_subscription, passing match to it unless the
+    subscription is exact. Pattern-based subscriptions are denied if it
+    doesn't take match (it was written for exact topic names only).
+    """
+    if match == EXACT:
+        return customize.authorize_subscription(topic_name, connection)
+    if not _accepts_match(customize.authorize_subscription):
+        return False, "Subscriptions with match {0} are not authorized".format(match)
+    return customize.authorize_subscription(topic_name, connection, match=match)
+
+
+def _accepts_match(function):
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(parameter.name == "match" or parameter.kind == parameter.VAR_KEYWORD for parameter in parameters)
+
+
+class UnsubscribeProcessor(Processor):
+    """
+    Responsible for dealing UNSUBSCRIBE messages.
+    """
+    def process(self):
+        """
+        Return UNSUBSCRIBED message, or ERROR if the connection has no
+        subscription with the given id.
+        """
+        received_message = self.message
+        subscription_id = received_message.subscription_id
+        topic_name = tornwamp_topic.topics.unsubscribe(subscription_id, self.connection)
+        if topic_name is not None:
+            answer = UnsubscribedMessage(request_id=received_message.request_id)
+            self.broadcast_messages = customize.get_unsubscribe_broadcast_messages(received_message, topic_name, self.connection.id)
+        else:
+            answer = ErrorMessage(
+                request_id=received_message.request_id,
+                request_code=received_message.code,
+                uri="wamp.error.no_such_subscription"
+            )
+            answer.error("There is no subscription {0}".format(subscription_id))
+        self.answer_message = answer
+
+
 class PublishProcessor(Processor):
     """
     Responsible for dealing PUBLISH messages.
@@ -46,8 +106,12 @@ class PublishProcessor(Processor):
     def process(self):
         """
         Return PUBLISHED message based on the PUBLISH message received.
+
+        When the publisher asked for an acknowledgement, the broadcast
+        messages are published here and PUBLISHED is only answered once
+        redis received them (ERROR otherwise).
         """
-        received_message = PublishMessage(*self.message.value)
+        received_message = self.message
         allow, msg = customize.authorize_publication(received_message.topic, self.connection)
         answer = None
         if allow:
@@ -59,6 +123,7 @@ class PublishProcessor(Processor):
                         request_id=received_message.request_id,
                         publication_id=publication_id
                     )
+                    return self._publish(answer)
                 else:
                     answer = response
         else:
@@ -69,3 +134,38 @@ class PublishProcessor(Processor):
             )
             answer.error(msg)
         self.answer_message = answer
+
+    def _publish(self, answer):
+        """
+        Publish the broadcast messages and answer with answer if redis
+        received them, returning a coroutine if that is still to be known.
+        """
+        broadcast_messages, self.broadcast_messages = self.broadcast_messages, []
+        futures = []
+        try:
+            for broadcast_msg in broadcast_messages:
+                future = tornwamp_topic.topics.publish(broadcast_msg)
+                if future is not None:
+                    futures.append(future)
+        except tornwamp_topic.RedisUnavailableError as error:
+            self.answer_message = self._publish_error(error)
+            return
+        if futures:
+            return self._acknowledge(futures, answer)
+        self.answer_message = answer
+
+    async def _acknowledge(self, futures, answer):
+        try:
+            await gen.multi(futures, quiet_exceptions=tornwamp_topic.RedisUnavailableError)
+        except tornwamp_topic.RedisUnavailableError as error:
+            answer = self._publish_error(error)
+        self.answer_message = answer
+
+    def _publish_error(self, error):
+        answer = ErrorMessage(
+            request_id=self.message.request_id,
+            request_code=self.message.code,
+            uri="tornwamp.publish.failed"
+        )
+        answer.error(str(error))
+        return answer
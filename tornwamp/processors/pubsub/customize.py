@@ -1,16 +1,19 @@
 """
 This module should be overwride subscription procedures:
 - authorize_subscription: if we will allow a connection to subscribe to
-  a topic or not
+  a topic (or to the topics which match a pattern) or not
 - authorize_publication: if we will allow a connection to publish to
   a topic or not
 - get_subscribe_broadcast_messages: if we want to send broadcast
   messages when a client subscribes to a topic
+- get_unsubscribe_broadcast_messages: if we want to send broadcast
+  messages when a client unsubscribes from a topic
 - get_publish_message: if we want to customize the broadcast message
   when a client publishes to a topic. The response to the client can
   also be customized with that function.
 """
 from tornwamp import messages
+from tornwamp.topic.matcher import EXACT
 
 
 def authorize_publication(topic_name, connection):
@@ -23,10 +26,15 @@ def authorize_publication(topic_name, connection):
     return True, ""
 
 
-def authorize_subscription(topic_name, connection):
+def authorize_subscription(topic_name, connection, match=EXACT):
     """
-    Says if a user can subscribe to a topic or not.
+    Says if a user can subscribe to a topic or not. If match is "prefix" or
+    "wildcard", topic_name is a pattern, and the subscription gets the events
+    of all the topics which match it.
     Return: True or False and the error message ("" if no error occured).
+
+    Overrides which don't take match are only called for exact topics:
+    pattern-based subscriptions are denied.
     """
     assert topic_name, "authorize_subscription requires topic_name"
     assert connection, "authorize_subscription requires connection"
@@ -46,6 +54,19 @@ def get_subscribe_broadcast_messages(received_message, subscription_id, connecti
     return []
 
 
+def get_unsubscribe_broadcast_messages(received_message, topic_name, connection_id):
+    """
+    Return a list of BroadcastMessages to be delivered to other connections,
+    possibly connected through redis pub/sub
+
+    This message is called whenever an user unsubscribes from a topic.
+    """
+    assert received_message is not None, "get_unsubscribe_broadcast_messages requires a received_message"
+    assert topic_name is not None, "get_unsubscribe_broadcast_messages requires a topic_name"
+    assert connection_id is not None, "get_unsubscribe_broadcast_messages requires a connection_id"
+    return []
+
+
 def get_publish_messages(received_message, publication_id, connection_id):
     """
     Return a tuple with two messages:
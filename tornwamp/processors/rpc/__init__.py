@@ -5,12 +5,36 @@ Compatible with WAMP Document Revision: RC3, 2014/08/25, available at:
 https://github.com/tavendo/WAMP/blob/master/spec/basic.md
 """
 
+import asyncio
+import inspect
+import logging
+
 from tornado import gen
+from tornado.websocket import WebSocketClosedError
 
-from tornwamp import topic as tornwamp_topic
-from tornwamp.messages import CallMessage, ResultMessage, ErrorMessage, EventMessage
+from tornwamp import dealer
+from tornwamp.messages import Code, ErrorMessage, RegisteredMessage, ResultMessage, UnregisteredMessage
 from tornwamp.processors import Processor
-from tornwamp.processors.rpc import customize
+from tornwamp.processors.rpc import customize, executors
+
+# Maximum time (in seconds) asynchronous procedures may take to answer, and
+# asynchronous generator procedures to produce each result. CALLs may set a
+# shorter one in their "timeout" option (in milliseconds). None means that
+# there is no limit.
+CALL_TIMEOUT = 60
+
+# Generator procedures are paused while more messages than this are waiting
+# to be written to the caller
+PROGRESS_BUFFER_SIZE = 10
+
+# Modes of the CANCEL message (see RegistrationsManager.cancel)
+CANCEL_MODES = ("skip", "kill", "killnowait")
+
+# CallProcessors of the calls which weren't answered yet, by connection id
+# and CALL request id
+calls_in_flight = {}
+
+logger = logging.getLogger(__name__)
 
 
 class CallProcessor(Processor):
@@ -19,28 +43,281 @@ class CallProcessor(Processor):
     """
     def process(self):
         """
-        Call method defined in tornwamp.customize.procedures (dict).
+        Call method defined in tornwamp.customize.procedures (dict), or
+        route the CALL to the callee which registered the procedure (see
+        tornwamp.dealer), answering once the callee does. If redis is
+        configured, CALLs of other procedures are forwarded to the node whose
+        callees registered them, if any.
 
         Each method should return:
         - RESPONSE
         - ERROR
 
         Which will be the processor's answer message.'
+
+        Methods may also be generators (or asynchronous generators) of
+        RESULTs: all but the last one are progressive results, sent as they
+        are produced if the caller asked for them (receive_progress option).
+        The generator is paused while more than PROGRESS_BUFFER_SIZE messages
+        are waiting to be written to the caller, and closed if the call is
+        canceled. Their timeout applies to each result, so that they may go
+        on for as long as they keep producing results.
+
+        Methods may also be coroutines (or return awaitables resolved with
+        the same values). The answer is then sent once they are done (see
+        pending_call), and the connection's next messages are processed
+        meanwhile, so a connection may have several calls in flight. This is
+        also the case of methods registered with an executor, which run in a
+        thread or process pool (see customize.register_procedure).
         """
-        msg = CallMessage(*self.message.value)
+        self.pending_call = None
+        # dealer which routed the CALL, if any, and Future of its result
+        self._route = None
+        self._result = None
+        # whether the timeout applies to each result rather than the answer
+        self._progressive = False
+        msg = self.message
         method_name = msg.procedure
-        if (method_name in customize.procedures):
+        if method_name in dealer.registrations:
+            self._route = dealer.registrations
+            result = dealer.registrations.invoke(msg, self.connection)
+        elif (method_name in customize.procedures):
             method = customize.procedures[method_name]
-            answer, self.broadcast_messages = method(*msg.args, call_message=msg, connection=self.connection, **msg.kwargs)
+            executor = customize.procedure_options.get(method_name, {}).get("executor")
+            if executor is None:
+                result = method(*msg.args, call_message=msg, connection=self.connection, **msg.kwargs)
+            else:
+                # the connection isn't thread-safe, nor picklable
+                result = executors.submit(executor, method, *msg.args, call_message=msg, connection=None, **msg.kwargs)
+            if inspect.isgenerator(result) or inspect.isasyncgen(result):
+                self._progressive = True
+                result = self._send_progressive_results(result)
+            elif not inspect.isawaitable(result):
+                self.answer_message, self.broadcast_messages = result
+                return
+        elif dealer.registrations.remote is not None:
+            self._route = dealer.registrations.remote
+            result = dealer.registrations.remote.call(msg, self.connection)
         else:
             error_uri = "wamp.rpc.unsupported.procedure"
             error_msg = "The procedure {} doesn't exist".format(method_name)
-            response_msg = ErrorMessage(
-                request_code=msg.code,
-                request_id=msg.request_id,
-                details={"call": msg.json},
-                uri=error_uri
-            )
-            response_msg.error(error_msg)
-            answer = response_msg
+            self.answer_message = self._build_error(error_uri, error_msg)
+            return
+        self._result = gen.convert_yielded(result)
+        calls_in_flight.setdefault(self.session_id, {})[msg.request_id] = self
+        self.pending_call = gen.convert_yielded(self._complete_call(self._result))
+
+    def cancel(self, mode="killnowait"):
+        """
+        Cancel the call, if it is still in flight, according to mode (see
+        tornwamp.dealer.RegistrationsManager.cancel). Procedures of
+        customize.procedures are always stopped (as in "killnowait"). Return
+        False if the call isn't in flight.
+        """
+        if self._route is not None:
+            return self._route.cancel(self.session_id, self.message.request_id, mode)
+        if self._result is None or self._result.done():
+            return False
+        self._result.cancel()
+        return True
+
+    @property
+    def timeout(self):
+        """
+        Time (in seconds) the procedure may take to answer, if it is
+        asynchronous.
+        """
+        timeout = self.message.options.get("timeout")
+        if not timeout:
+            return CALL_TIMEOUT
+        timeout = timeout / 1000.0
+        return timeout if CALL_TIMEOUT is None else min(timeout, CALL_TIMEOUT)
+
+    async def _complete_call(self, result):
+        """
+        Wait for the result of an asynchronous procedure, then send its answer
+        (or an ERROR, if it fails or times out) and broadcast its messages.
+        """
+        # avoid circular import (tornwamp.customize imports processors)
+        from tornwamp import customize as tornwamp_customize
+
+        timeout = self.timeout
+        try:
+            # unlike gen.with_timeout, wait_for cancels result on timeout,
+            # and is interrupted if result is canceled
+            answer, self.broadcast_messages = await asyncio.wait_for(result, None if self._progressive else timeout)
+        except asyncio.TimeoutError:
+            error_msg = "The procedure {} didn't answer within {} seconds".format(self.message.procedure, timeout)
+            answer = self._build_error("wamp.error.timeout", error_msg)
+        except asyncio.CancelledError:
+            answer = self._build_error("wamp.error.canceled", "The call was canceled")
+        except Exception as error:
+            logger.exception("procedure %s failed", self.message.procedure)
+            answer = self._build_error("wamp.error.runtime_error", str(error))
+        finally:
+            self._forget()
         self.answer_message = answer
+
+        if answer is not None and self.connection is not None and not self.connection.zombie:
+            try:
+                self.connection.send_message(answer)
+            except WebSocketClosedError:
+                logger.debug("connection closed before procedure %s answered", self.message.procedure)
+        tornwamp_customize.broadcast_messages(self)
+
+    async def _send_progressive_results(self, results):
+        """
+        Send the RESULTs produced by results (generator), but the last one,
+        as progressive results. Return the last one (or an empty RESULT) and
+        an empty list of broadcast messages, or raise asyncio.TimeoutError if
+        results takes longer than the timeout to produce one.
+        """
+        receive_progress = self.message.options.get("receive_progress")
+        answer = None
+        try:
+            while True:
+                if inspect.isasyncgen(results):
+                    try:
+                        result = await asyncio.wait_for(results.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                else:
+                    # let other messages be handled between results
+                    await gen.sleep(0)
+                    try:
+                        result = next(results)
+                    except StopIteration:
+                        break
+                if answer is not None and receive_progress:
+                    answer.details["progress"] = True
+                    self.connection.send_message(answer)
+                    await self.connection.drain(PROGRESS_BUFFER_SIZE)
+                answer = result
+        finally:
+            if inspect.isasyncgen(results):
+                await results.aclose()
+            else:
+                results.close()
+        return answer or ResultMessage(request_id=self.message.request_id), []
+
+    def _forget(self):
+        calls = calls_in_flight.get(self.session_id, {})
+        if calls.get(self.message.request_id) is self:
+            del calls[self.message.request_id]
+            if not calls:
+                del calls_in_flight[self.session_id]
+
+    def _build_error(self, uri, description):
+        msg = self.message
+        error = ErrorMessage(
+            request_code=msg.code,
+            request_id=msg.request_id,
+            details={"call": msg.json},
+            uri=uri
+        )
+        error.error(description)
+        return error
+
+
+class CancelProcessor(Processor):
+    """
+    Responsible for dealing with CANCEL messages, sent by callers to cancel
+    their calls in flight. The CALL is answered with an ERROR (unless it is
+    already answered).
+    """
+    def process(self):
+        msg = self.message
+        mode = msg.options.get("mode", "killnowait")
+        if mode not in CANCEL_MODES:
+            self.answer_message = build_error(msg, "wamp.error.invalid_argument", "Unsupported cancel mode: {0}".format(mode))
+            return
+        processor = calls_in_flight.get(self.session_id, {}).get(msg.request_id)
+        if processor is not None:
+            processor.cancel(mode)
+
+
+def cancel_calls(connection):
+    """
+    Cancel the calls in flight of connection, e.g. once it is closed.
+    """
+    for processor in list(calls_in_flight.pop(connection.id, {}).values()):
+        processor.cancel()
+
+
+class RegisterProcessor(Processor):
+    """
+    Responsible for dealing with REGISTER messages, sent by callees.
+    """
+    def process(self):
+        """
+        Register the procedure to the connection and answer REGISTERED, or
+        ERROR if it is not authorized or is already registered (by callees
+        which don't share it with the invocation policy in the "invoke"
+        option).
+        """
+        msg = self.message
+        allow, error_msg = customize.authorize_registration(msg.procedure, self.connection)
+        if not allow:
+            self.answer_message = build_error(msg, "tornwamp.register.unauthorized", error_msg)
+            return
+        policy = msg.options.get("invoke", "single")
+        if policy not in dealer.INVOCATION_POLICIES:
+            error_msg = "Unsupported invocation policy: {0}".format(policy)
+            self.answer_message = build_error(msg, "wamp.error.invalid_argument", error_msg)
+            return
+        registration = None
+        if msg.procedure not in customize.procedures:
+            registration = dealer.registrations.register(msg.procedure, self.connection, msg.options)
+        if registration is None:
+            error_msg = "The procedure {0} is already registered".format(msg.procedure)
+            answer = build_error(msg, "wamp.error.procedure_already_exists", error_msg)
+        else:
+            answer = RegisteredMessage(request_id=msg.request_id, registration_id=registration.id)
+        self.answer_message = answer
+
+
+class UnregisterProcessor(Processor):
+    """
+    Responsible for dealing with UNREGISTER messages, sent by callees.
+    """
+    def process(self):
+        msg = self.message
+        if dealer.registrations.unregister(msg.registration_id, self.connection) is None:
+            error_msg = "There is no registration {0}".format(msg.registration_id)
+            answer = build_error(msg, "wamp.error.no_such_registration", error_msg)
+        else:
+            answer = UnregisteredMessage(request_id=msg.request_id)
+        self.answer_message = answer
+
+
+class YieldProcessor(Processor):
+    """
+    Responsible for dealing with YIELD messages, sent by callees to answer
+    INVOCATIONs. The RESULT is sent to the caller, not to the callee.
+    """
+    def process(self):
+        dealer.registrations.yield_result(self.message, self.connection)
+
+
+class ErrorProcessor(Processor):
+    """
+    Responsible for dealing with ERROR messages sent by callees to answer
+    INVOCATIONs, which are forwarded to the callers. Other ERROR messages are
+    ignored.
+    """
+    def process(self):
+        if self.message.request_code == Code.INVOCATION:
+            dealer.registrations.invocation_error(self.message, self.connection)
+
+
+def build_error(msg, uri, description):
+    """
+    Return ErrorMessage answering msg (a request sent by the client).
+    """
+    error = ErrorMessage(
+        request_code=msg.code,
+        request_id=msg.request_id,
+        uri=uri
+    )
+    error.error(description)
+    return error
@@ -8,9 +8,27 @@ list of BroadcastMessages. The former is returned to the caller of the
 procedure, the later describes the notification message to be
 broadcasted to the other active connections (further restrictions to the
 broadcasted message can be added in the delivery methods).
+
+Procedures may also be registered by clients (callees), which are sent
+the CALLs as INVOCATION messages (see tornwamp.dealer). Those of the
+procedures dict can't be registered, and authorize_registration can be
+overwritten to restrict which callees may register which procedures.
+
+Procedures which need I/O may be coroutines (async def), returning the same
+values: their answer is sent once they are done, or an ERROR if they take
+longer than tornwamp.processors.rpc.CALL_TIMEOUT (or the CALL's "timeout"
+option, in milliseconds). Procedures may also be generators (or asynchronous
+generators) of ResultMessages, whose results but the last one are sent as
+progressive results to callers which ask for them (receive_progress). Calls
+in flight may be canceled by their callers (CANCEL).
+
+CPU-heavy procedures can be registered with an executor ("thread" or
+"process", see register_procedure), so that they run in a pool instead of
+blocking the IOLoop. Their options are kept in procedure_options.
 """
 
 from tornwamp.messages import ResultMessage
+from tornwamp.processors.rpc import executors
 
 
 def ping(call_message, connection):
@@ -29,3 +47,32 @@ def ping(call_message, connection):
 procedures = {
     "ping": ping
 }
+
+procedure_options = {}
+
+
+def authorize_registration(procedure, connection):
+    """
+    Says if a connection (callee) may register a procedure (REGISTER).
+
+    Return a tuple of:
+    - boolean (if the registration is authorized)
+    - string (explaining why it is not authorized)
+    """
+    return True, ""
+
+
+def register_procedure(name, procedure, executor=None):
+    """
+    Make procedure available to CALLs of name.
+
+    If executor is "thread" or "process", procedure is run in the pool of
+    tornwamp.processors.rpc.executors. It must not use the IOLoop, and it is
+    called with connection=None, as connections may only be used from the
+    IOLoop's thread. Procedures run in processes must also be picklable, as
+    well as their arguments and answer.
+    """
+    if executor is not None and executor not in executors.EXECUTORS:
+        raise ValueError("Unknown executor: {0}".format(executor))
+    procedures[name] = procedure
+    procedure_options[name] = {"executor": executor}
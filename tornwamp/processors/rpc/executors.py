@@ -0,0 +1,83 @@
+"""
+Pools which run CPU-heavy procedures outside of the IOLoop thread.
+
+Procedures registered with an executor (see
+tornwamp.processors.rpc.customize.register_procedure) are submitted to its
+pool, and their answer is sent once they are done, as for coroutines. Pools
+are created when they are first used, with the sizes set in POOL_SIZES.
+
+The number of calls submitted to each pool and not done yet is kept in
+pending_calls, and queue_depth tells how many of them are waiting for a
+worker.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+
+from tornado import ioloop
+
+# Number of workers of each pool (None means the number of CPUs)
+POOL_SIZES = {
+    "thread": 4,
+    "process": None,
+}
+
+EXECUTORS = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor,
+}
+
+pools = {}
+
+# Calls submitted to each pool which are not done yet
+pending_calls = Counter()
+
+
+def get_pool(executor):
+    """
+    Return the pool of executor ("thread" or "process"), creating it if
+    needed. Raise ValueError if executor is not supported.
+    """
+    if executor not in EXECUTORS:
+        raise ValueError("Unknown executor: {0}".format(executor))
+    if executor not in pools:
+        pools[executor] = EXECUTORS[executor](max_workers=POOL_SIZES.get(executor))
+    return pools[executor]
+
+
+def pool_size(executor):
+    return get_pool(executor)._max_workers
+
+
+def queue_depth(executor):
+    """
+    Return the number of calls submitted to executor's pool which are
+    waiting for a worker.
+    """
+    if executor not in pools:
+        return 0
+    return max(0, pending_calls[executor] - pool_size(executor))
+
+
+def submit(executor, procedure, *args, **kwargs):
+    """
+    Run procedure(*args, **kwargs) in executor's pool, returning a Future
+    resolved with its result.
+    """
+    pool = get_pool(executor)
+    future = ioloop.IOLoop.current().run_in_executor(pool, functools.partial(procedure, *args, **kwargs))
+    pending_calls[executor] += 1
+
+    def on_done(_):
+        pending_calls[executor] -= 1
+    future.add_done_callback(on_done)
+    return future
+
+
+def shutdown(wait=True):
+    """
+    Shut down the pools, which are created again if they are used later.
+    """
+    while pools:
+        _, pool = pools.popitem()
+        pool.shutdown(wait=wait)
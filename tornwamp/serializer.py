@@ -0,0 +1,234 @@
+"""
+Serializers used to encode and decode WAMP messages.
+
+The wamp.2.json subprotocol is handled by json_serializer, which uses the
+standard library json module unless another JSON library is selected at
+startup, e.g.:
+
+    from tornwamp import serializer
+    serializer.select_json_backend("auto")
+
+Supported libraries are listed in JSON_BACKENDS, by order of preference
+(used when "auto" is selected). All of them, except for "json", encode
+messages in compact form (without whitespace after separators).
+
+The wamp.2.msgpack subprotocol is available when msgpack is installed. The
+serializers a client can negotiate are kept in the serializers dict, keyed by
+subprotocol and by order of preference. Each of them is also available in
+batched mode (e.g. wamp.2.json.batched).
+"""
+from collections import OrderedDict
+import json
+import struct
+
+# JSON libraries which can be selected, by order of preference
+JSON_BACKENDS = ["orjson", "ujson", "rapidjson", "json"]
+
+
+class SerializerUnavailableError(Exception):
+    pass
+
+
+def _load_orjson():
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value).decode("utf-8")
+    return dumps, orjson.loads
+
+
+def _load_ujson():
+    import ujson
+
+    def dumps(value):
+        return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False)
+    return dumps, ujson.loads
+
+
+def _load_rapidjson():
+    import rapidjson
+
+    def dumps(value):
+        return rapidjson.dumps(value, ensure_ascii=False)
+    return dumps, rapidjson.loads
+
+
+def _load_json():
+    return json.dumps, json.loads
+
+
+_LOADERS = {
+    "orjson": _load_orjson,
+    "ujson": _load_ujson,
+    "rapidjson": _load_rapidjson,
+    "json": _load_json,
+}
+
+
+class JSONSerializer(object):
+    """
+    Serializer of the wamp.2.json subprotocol, which can be backed by any of
+    the JSON_BACKENDS.
+
+    There is a single instance (json_serializer), whose backend can be
+    replaced with select_backend: modules which hold a reference to it will
+    use the new backend as well.
+    """
+    subprotocol = "wamp.2.json"
+    binary = False
+    batched = False
+
+    def __init__(self, backend="json"):
+        self.backend = None
+        self.dumps = None
+        self.loads = None
+        self.select_backend(backend)
+
+    def select_backend(self, backend):
+        """
+        Use backend (one of JSON_BACKENDS, or "auto" for the first one which
+        is installed) to encode and decode messages. Return the name of the
+        backend in use.
+
+        Raise SerializerUnavailableError if backend is not installed.
+        """
+        candidates = JSON_BACKENDS if backend == "auto" else [backend]
+        for candidate in candidates:
+            if candidate not in _LOADERS:
+                raise SerializerUnavailableError("Unknown JSON backend: {0}".format(candidate))
+            try:
+                self.dumps, self.loads = _LOADERS[candidate]()
+            except ImportError:
+                continue
+            self.backend = candidate
+            return candidate
+        raise SerializerUnavailableError("JSON backend is not installed: {0}".format(backend))
+
+
+json_serializer = JSONSerializer()
+
+
+def select_json_backend(backend="auto"):
+    """
+    Select the JSON library used by json_serializer, see
+    JSONSerializer.select_backend.
+    """
+    return json_serializer.select_backend(backend)
+
+
+class MsgpackSerializer(object):
+    """
+    Serializer of the wamp.2.msgpack subprotocol, whose messages are sent in
+    binary WebSocket frames.
+
+    Raise ImportError if msgpack is not installed.
+    """
+    subprotocol = "wamp.2.msgpack"
+    binary = True
+    batched = False
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, value):
+        return self._msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        """
+        Decode data, raising ValueError if it is not valid MessagePack (as
+        json.loads does for invalid JSON), e.g. if it was sent in a text
+        frame.
+        """
+        try:
+            return self._msgpack.unpackb(data, raw=False)
+        except (TypeError, self._msgpack.UnpackException) as error:
+            raise ValueError(str(error))
+
+
+class BatchedSerializer(object):
+    """
+    Serializer of the batched variant of serializer's subprotocol (e.g.
+    wamp.2.json.batched), whose WebSocket frames may carry several messages:
+    followed by \\x18 each, in text frames, or preceded by their length (4
+    bytes, big-endian), in binary frames.
+    """
+    batched = True
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.subprotocol = serializer.subprotocol + ".batched"
+        self.binary = serializer.binary
+
+    def dumps(self, value):
+        return self.serializer.dumps(value)
+
+    def loads(self, data):
+        return self.serializer.loads(data)
+
+    def join(self, messages):
+        """
+        Return a frame carrying the encoded messages.
+        """
+        if self.binary:
+            return b"".join(struct.pack(">I", len(message)) + message for message in messages)
+        return u"".join(message + u"\x18" for message in messages)
+
+    def split(self, frame):
+        """
+        Return the encoded messages carried by frame, raising ValueError if it
+        is not a valid batch (e.g. if it was sent in a binary frame instead
+        of a text one, or the other way around).
+        """
+        if not isinstance(frame, bytes if self.binary else str):
+            raise ValueError("Batched {0} messages must be sent in {1} frames".format(self.serializer.subprotocol, "binary" if self.binary else "text"))
+        if not self.binary:
+            messages = frame.split(u"\x18")
+            if messages[-1]:
+                raise ValueError("Batched message must end with \\x18")
+            return messages[:-1]
+        messages = []
+        offset = 0
+        while offset < len(frame):
+            if offset + 4 > len(frame):
+                raise ValueError("Batched message has an incomplete length prefix")
+            length, = struct.unpack_from(">I", frame, offset)
+            offset += 4
+            if offset + length > len(frame):
+                raise ValueError("Batched message is shorter than its length prefix")
+            messages.append(frame[offset:offset + length])
+            offset += length
+        return messages
+
+
+serializers = OrderedDict()
+
+
+def register_serializer(serializer):
+    """
+    Allow clients to negotiate serializer's subprotocol.
+    """
+    serializers[serializer.subprotocol] = serializer
+
+
+def get_serializer(subprotocols):
+    """
+    Return the first registered serializer among the subprotocols offered by
+    a client, or None if none of them is supported.
+    """
+    for subprotocol in subprotocols:
+        serializer = serializers.get(subprotocol)
+        if serializer is not None:
+            return serializer
+    return None
+
+
+register_serializer(json_serializer)
+register_serializer(BatchedSerializer(json_serializer))
+try:
+    msgpack_serializer = MsgpackSerializer()
+except ImportError:
+    msgpack_serializer = None
+else:
+    register_serializer(msgpack_serializer)
+    register_serializer(BatchedSerializer(msgpack_serializer))
@@ -4,10 +4,36 @@ Abstract websocket connections (dual channel between clients and server).
 import socket
 import errno
 
+from collections import Counter, deque
 from datetime import datetime
 
+from tornado import ioloop
+from tornado.concurrent import is_future
+from tornado.websocket import WebSocketClosedError
+
 from tornwamp import topic
 from tornwamp.identifier import create_global_id
+from tornwamp.serializer import json_serializer
+
+# Messages sent to a connection while its websocket is still flushing previous
+# ones are queued (see ClientConnection.send). Limits of each queue (None
+# means unlimited), in number of messages and in length of their encoding:
+OUTBOUND_QUEUE_MAX_MESSAGES = 1000
+OUTBOUND_QUEUE_MAX_BYTES = 4 * 1024 * 1024
+# what happens when a message sent with a key (an event) would exceed these
+# limits:
+# - "drop_oldest": the oldest queued events are dropped to make room for it
+# - "drop_newest": the message is dropped
+# - "coalesce": the message replaces the queued one sent with the same key,
+#   if any, otherwise the oldest queued events are dropped
+# - "disconnect": the queue is dropped and the connection is zombified
+# Messages without key (answers to the client's requests) are never dropped:
+# the oldest queued events are, unless the policy is "disconnect" or there are
+# none left, in which case the connection is disconnected.
+OUTBOUND_QUEUE_POLICY = "drop_oldest"
+
+# how many times each policy was applied, by policy name
+outbound_queue_metrics = Counter()
 
 
 class ConnectionDict(dict):
@@ -61,6 +87,14 @@ class ClientConnection(object):
 
         # communication-related
         self._websocket = websocket
+        self._serializer = json_serializer
+        self._outbound_queue = deque()
+        self._outbound_keys = {}
+        self._outbound_bytes = 0
+        self._outbound_closed = False
+        self._write_future = None
+        self._batch_writes = False
+        self._flush_scheduled = False
         self.topics = {
             "subscriber": {},
             "publisher": {}
@@ -91,6 +125,214 @@ class ClientConnection(object):
             name = u"{0}:{1}|{2}".format(ip, port, self.id)
         return name
 
+    @property
+    def serializer(self):
+        """
+        Serializer of the subprotocol negotiated by the connection's
+        websocket, used to encode the messages it receives.
+        """
+        return self._serializer
+
+    @serializer.setter
+    def serializer(self, serializer):
+        self._serializer = serializer
+
+    def send(self, data, binary=False, key=None):
+        """
+        Write data (encoded message) to the websocket, in a binary frame if
+        binary is True.
+
+        While a previous write is being flushed, data is queued instead, and
+        written once it is done, so slow clients don't accumulate an unbounded
+        amount of data in the websocket buffers. The queue is bounded by
+        OUTBOUND_QUEUE_MAX_MESSAGES and OUTBOUND_QUEUE_MAX_BYTES, which are
+        enforced according to OUTBOUND_QUEUE_POLICY. Only messages sent with a
+        key (events) are dropped. Messages which supersede each other (e.g.
+        events of the same topic) share the same key, so they are coalesced by
+        the "coalesce" policy.
+
+        If batch_writes is True, data is always queued, and the queue is
+        flushed once per IOLoop iteration.
+        """
+        if self._outbound_closed:
+            return
+        if self._write_future is None and not self._batch_writes:
+            try:
+                self._watch_write(self._write(data, binary))
+            except WebSocketClosedError:
+                self._clear_outbound_queue()
+            return
+        if self._batch_writes and not self._flush_scheduled:
+            self._flush_scheduled = True
+            ioloop.IOLoop.current().add_callback(self._flush_batch)
+
+        size = len(data)
+        if self._outbound_queue_overflows(size):
+            if key is None:
+                if OUTBOUND_QUEUE_POLICY == "disconnect" or not self._drop_oldest_events(size):
+                    outbound_queue_metrics["disconnect"] += 1
+                    self._close_outbound_queue()
+                    return
+                outbound_queue_metrics["drop_oldest"] += 1
+            elif OUTBOUND_QUEUE_POLICY == "drop_newest":
+                outbound_queue_metrics["drop_newest"] += 1
+                return
+            elif OUTBOUND_QUEUE_POLICY == "disconnect":
+                outbound_queue_metrics["disconnect"] += 1
+                self._close_outbound_queue()
+                return
+            elif OUTBOUND_QUEUE_POLICY == "coalesce" and key in self._outbound_keys:
+                outbound_queue_metrics["coalesce"] += 1
+                entry = self._outbound_keys[key]
+                self._outbound_bytes += size - entry[3]
+                entry[:] = [data, binary, key, size]
+                return
+            elif self._drop_oldest_events(size):
+                outbound_queue_metrics["drop_oldest"] += 1
+            else:
+                # only answers are queued
+                outbound_queue_metrics["drop_newest"] += 1
+                return
+
+        entry = [data, binary, key, size]
+        self._outbound_queue.append(entry)
+        self._outbound_bytes += size
+        if key is not None:
+            self._outbound_keys[key] = entry
+
+    def send_message(self, msg):
+        """
+        Encode msg (Message instance) using the connection's serializer and
+        send it.
+        """
+        self.send(msg.encode(self._serializer), binary=self._serializer.binary)
+
+    @property
+    def outbound_queue_size(self):
+        """
+        Number of messages waiting for previous writes to be flushed.
+        """
+        return len(self._outbound_queue)
+
+    async def drain(self, max_messages=0):
+        """
+        Wait until at most max_messages are queued (e.g. before producing more
+        of them), or the websocket is closed.
+        """
+        while self._write_future is not None and len(self._outbound_queue) > max_messages:
+            try:
+                await self._write_future
+            except Exception:
+                return
+
+    def _outbound_queue_overflows(self, size):
+        if OUTBOUND_QUEUE_MAX_MESSAGES is not None and len(self._outbound_queue) + 1 > OUTBOUND_QUEUE_MAX_MESSAGES:
+            return True
+        return OUTBOUND_QUEUE_MAX_BYTES is not None and self._outbound_bytes + size > OUTBOUND_QUEUE_MAX_BYTES
+
+    def _pop_outbound_entry(self):
+        entry = self._outbound_queue.popleft()
+        self._forget_outbound_entry(entry)
+        return entry
+
+    def _forget_outbound_entry(self, entry):
+        self._outbound_bytes -= entry[3]
+        if self._outbound_keys.get(entry[2]) is entry:
+            del self._outbound_keys[entry[2]]
+
+    def _drop_oldest_events(self, size):
+        """
+        Drop the oldest queued messages which have a key (events) until a
+        message of size fits in the queue. Return False if it still doesn't.
+        """
+        index = 0
+        while self._outbound_queue_overflows(size):
+            while index < len(self._outbound_queue) and self._outbound_queue[index][2] is None:
+                index += 1
+            if index == len(self._outbound_queue):
+                return False
+            entry = self._outbound_queue[index]
+            del self._outbound_queue[index]
+            self._forget_outbound_entry(entry)
+        return True
+
+    @property
+    def batch_writes(self):
+        """
+        Whether messages sent in the same IOLoop iteration are written
+        together (in a single frame, if the negotiated subprotocol is
+        batched).
+        """
+        return self._batch_writes
+
+    @batch_writes.setter
+    def batch_writes(self, batch_writes):
+        self._batch_writes = batch_writes
+
+    def _write(self, data, binary):
+        if self._serializer.batched:
+            data = self._serializer.join([data])
+        if binary:
+            return self._websocket.write_message(data, binary=True)
+        return self._websocket.write_message(data)
+
+    def _watch_write(self, future):
+        """
+        Queue messages until future (returned by the websocket's
+        write_message) is done.
+        """
+        if is_future(future) and not future.done():
+            self._write_future = future
+            future.add_done_callback(self._on_write_done)
+
+    def _on_write_done(self, future):
+        self._write_future = None
+        if future.exception() is not None:
+            # the websocket was closed
+            self._clear_outbound_queue()
+            return
+        self.flush()
+
+    def flush(self):
+        """
+        Write all queued messages to the websocket at once, e.g. before
+        closing it.
+        """
+        last_future = None
+        try:
+            if self._serializer.batched and self._outbound_queue:
+                frame = self._serializer.join([entry[0] for entry in self._outbound_queue])
+                self._clear_outbound_queue()
+                last_future = self._websocket.write_message(frame, binary=self._serializer.binary)
+            while self._outbound_queue:
+                data, binary, _, _ = self._pop_outbound_entry()
+                last_future = self._write(data, binary)
+        except WebSocketClosedError:
+            self._clear_outbound_queue()
+            return
+        if self._write_future is None:
+            self._watch_write(last_future)
+
+    def _flush_batch(self):
+        self._flush_scheduled = False
+        if self._write_future is None:
+            self.flush()
+
+    def _clear_outbound_queue(self):
+        self._outbound_queue.clear()
+        self._outbound_keys.clear()
+        self._outbound_bytes = 0
+
+    def _close_outbound_queue(self):
+        """
+        Drop queued messages, ignore the ones sent from now on and zombify the
+        connection in the next IOLoop iteration (this may be called while
+        topic subscribers are being iterated).
+        """
+        self._clear_outbound_queue()
+        self._outbound_closed = True
+        ioloop.IOLoop.current().add_callback(self.zombify)
+
     def get_subscription_id(self, topic_name):
         """
         Return connection's subscription_id for a specific topic.
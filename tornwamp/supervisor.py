@@ -0,0 +1,75 @@
+"""
+Run a tornwamp application in several worker processes of a host, e.g.:
+
+    import tornado
+    from tornwamp import handler, supervisor
+
+    application = tornado.web.Application([
+        (r"/ws", handler.WAMPHandler),
+    ])
+
+    if __name__ == "__main__":
+        supervisor.run(application, 8888, workers=4)
+
+The supervisor forks the workers (one per CPU by default) and restarts those
+which die, see tornado.process.fork_processes. Each worker binds its own
+socket to the port, with SO_REUSEPORT, so the kernel balances the incoming
+connections between them.
+
+Workers deliver publications to each other through a local bus (see
+tornwamp.bus), so redis (tornwamp.topic.topics.redis) is only needed to reach
+other hosts: publications of the workers of the same host are ignored when
+they come through redis. Procedures registered by callees of another worker
+are still called through redis, see tornwamp.dealer.
+"""
+import shutil
+import tempfile
+import uuid
+
+from tornado import httpserver, ioloop, netutil, process
+
+from tornwamp import messages, topic as tornwamp_topic
+from tornwamp.bus import LocalBus
+
+# maximum number of times workers are restarted after dying
+MAX_RESTARTS = 100
+
+
+def run(application, port, address=None, workers=None, bus_directory=None):
+    """
+    Fork workers (one per CPU if None) which serve application on port, and
+    supervise them. The supervisor exits once all workers exit normally.
+
+    The sockets of the local bus are created in bus_directory, or in a
+    temporary directory (removed when the supervisor exits) if it is None.
+    """
+    workers = workers or process.cpu_count()
+    temporary = bus_directory is None
+    if temporary:
+        bus_directory = tempfile.mkdtemp(prefix="tornwamp-bus-")
+    messages.PUBLISHER_HOST_ID = uuid.uuid4().hex
+    try:
+        worker_id = process.fork_processes(workers, max_restarts=MAX_RESTARTS)
+    except BaseException:
+        # only the supervisor gets here, when it exits
+        if temporary:
+            shutil.rmtree(bus_directory, ignore_errors=True)
+        raise
+    start_worker(application, port, address, worker_id, workers, bus_directory)
+    ioloop.IOLoop.current().start()
+
+
+def start_worker(application, port, address, worker_id, workers, bus_directory):
+    """
+    Serve application on port, from the worker process worker_id (out of
+    workers), connected to the other workers through the local bus in
+    bus_directory. Return the HTTPServer.
+    """
+    # workers are forked from the same process, but are distinct nodes
+    messages.PUBLISHER_NODE_ID = uuid.uuid4()
+    bus = LocalBus(bus_directory, worker_id, workers, tornwamp_topic.topics.receive)
+    bus.start()
+    tornwamp_topic.topics.bus = bus
+    server = httpserver.HTTPServer(application)
+    server.add_sockets(netutil.bind_sockets(port, address=address, reuse_port=True))
+    return server
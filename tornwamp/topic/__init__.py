@@ -1,7 +1,7 @@
 """
 Used to handle PubSub topics publishers and subscribers
 
-The two classes defined by this module shouldn't usually be instantiated by
+The classes defined by this module shouldn't usually be instantiated by
 users of this library. Instead, the singleton object topics should be used. In
 order to configure redis, the attribute topics.redis should be setted to a dict
 with host an port. Eg.:
@@ -14,19 +14,56 @@ running tornwamp instances will receive the broadcast message and will process
 it with tornwamp.topic.customize.deliver_event_messages, which, by default,
 delivers the broadcasted message to all WAMP connections subscribed to the
 topic.
+
+Topics which no longer have subscribers nor publishers are removed, see
+TopicsManager.empty_topic_ttl.
+
+Clients may also subscribe to all topics matching a prefix or a wildcard
+pattern (see tornwamp.topic.matcher). Each pattern is kept as a Topic as
+well, whose events are delivered along with those of the matching topics.
+
+All topics share the same RedisBridge, so each process keeps only two
+connections to redis (one to subscribe, one to publish), no matter how many
+topics exist.
+
+Worker processes started by tornwamp.supervisor also deliver publications
+to the other workers of their host through topics.bus (see tornwamp.bus),
+and ignore them when they come through redis.
 """
+import logging
+from functools import partial
+
 from tornado import gen, ioloop
+from tornado.concurrent import Future
 import tornadis
 
-from tornwamp import messages, utils
+from tornwamp import messages
 from tornwamp.topic import customize
-from tornwamp.identifier import create_global_id
+from tornwamp.topic.matcher import EXACT, TopicMatcher, matches, redis_pattern, topic_key
+from tornwamp.identifier import create_router_id, release_global_id, release_router_id
 
 from deprecated import deprecated
 
 PUBSUB_TIMEOUT = 60
+# the redis channel of each topic is named after it, following this prefix so
+# it can't clash with the other channels of tornwamp (see
+# tornwamp.dealer.NODE_CHANNEL_PREFIX), even through pattern subscriptions
+TOPIC_CHANNEL_PREFIX = "tornwamp:topic:"
 PUBLISHER_CONNECTION_TIMEOUT = 3 * 3600 * 1000  # 3 hours in miliseconds
 
+# PUBLISH commands are sent to redis in pipelines, once per IOLoop iteration
+# or as soon as PUBLISH_BATCH_SIZE commands are queued
+PUBLISH_BATCH_SIZE = 100
+# maximum number of PUBLISH commands queued or waiting for redis' reply
+PUBLISH_QUEUE_MAX_SIZE = 10000
+# what happens when a publication can't reach redis:
+# - "raise": the Future of the publication fails with RedisUnavailableError
+#   (publish raises it if the queue is full)
+# - "log": the error is logged and the Future is resolved with None
+PUBLISH_ERROR_POLICY = "raise"
+
+logger = logging.getLogger(__name__)
+
 
 class RedisUnavailableError(Exception):
     pass
@@ -36,10 +73,32 @@ class TopicsManager(dict):
     """
     Manages all existing topics to which connections can potentially
     publish and/or subscribe to.
+
+    Topics without subscribers and publishers are removed, according to
+    empty_topic_ttl:
+    - 0: as soon as they become empty (default)
+    - number of seconds: if they are still empty after this grace period
+    - None: never
+
+    If shared_subscriptions is True, all subscribers of a topic share the same
+    subscription id (Topic.subscription_id), so each event is encoded once and
+    the same frame is sent to all of them. Topics which already have
+    subscribers when it is set keep a subscription id per subscriber.
+
+    Topics are keyed by name, and pattern-based subscriptions by topic_key
+    (e.g. "prefix#market.eur"). These are also indexed by matcher.
     """
     def __init__(self, *args, **kwargs):
         dict.__init__(self, *args, **kwargs)
         self.redis = None
+        self.empty_topic_ttl = 0
+        self.shared_subscriptions = False
+        self.matcher = TopicMatcher()
+        # LocalBus to the other worker processes of the host, if any
+        self.bus = None
+        # subscription id -> (topic name, subscriber connection), the
+        # connection is None for subscriptions shared by a topic's subscribers
+        self.subscriptions = {}
 
     @deprecated(version='2.1.0', reason="please use create_topic_if_not_exists(topic_name)")
     def create_topic(self, topic_name):
@@ -48,51 +107,138 @@ class TopicsManager(dict):
         """
         self.create_topic_if_not_exists(topic_name)
 
-    def create_topic_if_not_exists(self, topic_name):
+    def create_topic_if_not_exists(self, topic_name, match=EXACT):
         """
         Creates a new topic with a given name and configured redis address if it doesn't already exist.
         Returns the topic (either newly created or previously registered for the given name).
+
+        If match is "prefix" or "wildcard", topic_name is a pattern, whose
+        topic is indexed by matcher.
         """
-        topic = self.get(topic_name, Topic(topic_name, self.redis))
-        self[topic_name] = topic
+        key = topic_key(topic_name, match)
+        topic = self.get(key)
+        if topic is None:
+            topic = self[key] = Topic(topic_name, self.redis, match)
+            if match != EXACT:
+                self.matcher.add(match, topic_name, topic)
         return topic
 
     def publish(self, msg):
         """
         Publish finds/creates a topic associated with `msg` via its `topic_name` property
-        and then publishes the message to it.
+        and then publishes the message to it, and to the topics of the
+        patterns which match it.
         """
         topic = self.create_topic_if_not_exists(msg.topic_name)
-        return topic.publish(msg)
-
-    def add_subscriber(self, topic_name, connection, subscription_id=None):
-        """
-        Add a connection as a topic's subscriber.
-        """
-        topic = self.create_topic_if_not_exists(topic_name)
-        subscription_id = subscription_id or create_global_id()
-        topic.add_subscriber(subscription_id, connection)
-        self[topic_name] = topic
-        connection.add_subscription_channel(subscription_id, topic_name)
+        try:
+            self._deliver_to_patterns(msg, msg.publisher_connection_id)
+            if self.bus is not None:
+                self.bus.publish(msg)
+            return topic.publish(msg)
+        finally:
+            release_global_id(msg.event_message.publication_id)
+            self.collect_if_empty(msg.topic_name)
+
+    def receive(self, msg):
+        """
+        Deliver msg, published by another worker process of this host (see
+        tornwamp.bus), to the subscribers of its topic and of the patterns
+        which match it.
+        """
+        topic = self.get(msg.topic_name)
+        if topic is not None:
+            customize.deliver_event_messages(topic, msg.event_message, None)
+        self._deliver_to_patterns(msg, None)
+
+    def _deliver_to_patterns(self, msg, publisher_connection_id):
+        pattern_topics = self.matcher.match(msg.topic_name)
+        if pattern_topics:
+            event_msg = msg.event_message.with_topic(msg.topic_name)
+            for pattern_topic in pattern_topics:
+                customize.deliver_event_messages(pattern_topic, event_msg, publisher_connection_id)
+
+    def add_subscriber(self, topic_name, connection, subscription_id=None, match=EXACT):
+        """
+        Add a connection as a topic's subscriber, or as a subscriber of the
+        topics which match topic_name, if match is "prefix" or "wildcard".
+
+        Return the subscription id, which is the existing one if connection
+        already subscribed to the topic (with the same match policy).
+        """
+        topic = self.create_topic_if_not_exists(topic_name, match)
+        self._cancel_collect(topic)
+        existing_id = connection.topics["subscriber"].get(topic.key)
+        if existing_id is not None:
+            subscriber_key = connection.id if existing_id == topic.subscription_id else existing_id
+            if topic.subscribers.get(subscriber_key) is connection:
+                return existing_id
+        if topic.subscription_id is None and self.shared_subscriptions and not topic.subscribers:
+            topic.subscription_id = subscription_id or create_router_id()
+            self.subscriptions[topic.subscription_id] = (topic.key, None)
+        if topic.subscription_id is not None:
+            subscription_id = topic.subscription_id
+            topic.add_subscriber(connection.id, connection)
+        else:
+            subscription_id = subscription_id or create_router_id()
+            self.subscriptions[subscription_id] = (topic.key, connection)
+            topic.add_subscriber(subscription_id, connection)
+        connection.add_subscription_channel(subscription_id, topic.key)
         return subscription_id
 
-    def remove_subscriber(self, topic_name, subscription_id):
+    def remove_subscriber(self, topic_name, subscription_id, connection=None):
         """
         Remove a connection a topic's subscriber provided:
-        - topic_name
+        - topic_name (the topic_key of pattern-based subscriptions)
         - subscription_id
+        - connection, if the subscription is shared by the topic's subscribers
         """
         topic = self.get(topic_name)
+        if topic is not None and topic.subscription_id is not None and topic.subscription_id == subscription_id:
+            self._remove_shared_subscriber(topic, connection)
+            return
+        if self.subscriptions.get(subscription_id, (None,))[0] == topic_name:
+            del self.subscriptions[subscription_id]
         if topic is not None:
             connection = topic.remove_subscriber(subscription_id)
-            connection.remove_subscription_channel(topic_name)
+            if connection is not None:
+                connection.remove_subscription_channel(topic_name)
+                release_router_id(subscription_id)
+            self.collect_if_empty(topic_name)
+
+    def _remove_shared_subscriber(self, topic, connection):
+        """
+        Remove connection from the subscribers of topic, releasing the
+        topic's subscription id once it has no subscribers left.
+        """
+        if connection is not None and topic.remove_subscriber(connection.id) is not None:
+            connection.remove_subscription_channel(topic.key)
+        if not topic.subscribers:
+            self.subscriptions.pop(topic.subscription_id, None)
+            release_router_id(topic.subscription_id)
+            topic.subscription_id = None
+        self.collect_if_empty(topic.key)
+
+    def unsubscribe(self, subscription_id, connection):
+        """
+        Remove connection's subscription of subscription_id, without knowing
+        its topic. Return the topic name (its topic_key, for pattern-based
+        subscriptions), or None if connection has no such subscription.
+        """
+        topic_name, subscriber = self.subscriptions.get(subscription_id, (None, None))
+        if subscriber is None and topic_name in self:
+            subscriber = self[topic_name].subscribers.get(connection.id)
+        if subscriber is not connection:
+            return None
+        self.remove_subscriber(topic_name, subscription_id, connection)
+        return topic_name
 
     def add_publisher(self, topic_name, connection, subscription_id=None):
         """
         Add a connection as a topic's publisher.
         """
         topic = self.create_topic_if_not_exists(topic_name)
-        subscription_id = subscription_id or create_global_id()
+        self._cancel_collect(topic)
+        subscription_id = subscription_id or create_router_id()
         topic.publishers[subscription_id] = connection
         connection.add_publishing_channel(subscription_id, topic_name)
         return subscription_id
@@ -105,25 +251,66 @@ class TopicsManager(dict):
         if topic and subscription_id in topic.publishers:
             connection = topic.publishers.pop(subscription_id)
             connection.remove_publishing_channel(topic_name)
+            release_router_id(subscription_id)
+            self.collect_if_empty(topic_name)
 
     def remove_connection(self, connection):
         """
         Connection is to be removed, scrap all connection
         publishers/subscribers in every topic
         """
-        for topic_name, subscription_id in connection.topics.get("publisher", {}).items():
-            topic = self.get(topic_name)
-            topic.publishers.pop(subscription_id, None)
+        for topic_name, subscription_id in list(connection.topics.get("publisher", {}).items()):
+            self.remove_publisher(topic_name, subscription_id)
+            connection.remove_publishing_channel(topic_name)
+            release_router_id(subscription_id)
 
-        for topic_name, subscription_id in connection.topics.get("subscriber", {}).items():
-            topic = self.get(topic_name)
-            topic.remove_subscriber(subscription_id)
+        for topic_name, subscription_id in list(connection.topics.get("subscriber", {}).items()):
+            # the subscriber may have been dropped from the topic already,
+            # if the connection with redis was lost
+            self.remove_subscriber(topic_name, subscription_id, connection)
+            connection.remove_subscription_channel(topic_name)
+            if subscription_id not in self.subscriptions:
+                release_router_id(subscription_id)
+
+    def collect_if_empty(self, topic_name):
+        """
+        Remove the topic if it has neither subscribers nor publishers,
+        according to empty_topic_ttl. A topic has at most one removal pending.
+        """
+        topic = self.get(topic_name)
+        if topic is None or not topic.is_empty or self.empty_topic_ttl is None:
+            return
+        if self.empty_topic_ttl:
+            if topic._collect_timeout is None:
+                topic._collect_timeout = ioloop.IOLoop.current().call_later(self.empty_topic_ttl, self._remove_if_empty, topic)
+        else:
+            self._remove_if_empty(topic)
+
+    def _cancel_collect(self, topic):
+        """
+        Cancel the pending removal of topic, which is being used again.
+        """
+        if topic._collect_timeout is not None:
+            ioloop.IOLoop.current().remove_timeout(topic._collect_timeout)
+            topic._collect_timeout = None
+
+    def _remove_if_empty(self, topic):
+        """
+        Remove topic, unless it was used meanwhile or was already replaced.
+        """
+        topic._collect_timeout = None
+        if topic.is_empty and self.get(topic.key) is topic:
+            del self[topic.key]
+            if topic.match != EXACT:
+                self.matcher.remove(topic.match, topic.name)
+            topic.close()
 
     def get_connection(self, topic_name, subscription_id):
         """
         Get topic connection provided topic_name and subscription_id.
         Try to find it in subscribers, otherwise, fetches from
-        publishers.  Return None if it is not available in any.
+        publishers.  Return None if it is not available in any (nor if the
+        subscription is shared by several subscribers).
         """
         topic = self[topic_name]
         return topic.subscribers.get(subscription_id) or topic.publishers.get(subscription_id)
@@ -139,25 +326,294 @@ class TopicsManager(dict):
 topics = TopicsManager()
 
 
+class RedisBridge(object):
+    """
+    Process-wide connections to a redis server, shared by all topics:
+    - a single PubSubClient, subscribed (SUBSCRIBE/UNSUBSCRIBE) to the
+      channel of each topic which has subscribers, without blocking the
+      subscriber. Messages are routed to the topic by channel name.
+    - a single Client, used to publish to any channel. Publications are
+      queued and sent in pipelines, without waiting for redis' replies.
+
+    Bridges shouldn't usually be instantiated directly, use
+    get_redis_bridge(redis_params) instead.
+    """
+    def __init__(self, redis_params):
+        self.redis_params = redis_params
+        # channel name => (on_message, on_lost) callbacks
+        self.channels = {}
+        # glob-style pattern => (on_message, on_lost) callbacks
+        self.patterns = {}
+        self._publisher_connection = tornadis.Client(ioloop=ioloop.IOLoop.current(), autoconnect=True, **self.redis_params)
+        self._periodical_disconnect = ioloop.PeriodicCallback(
+            self._disconnect_publisher,
+            PUBLISHER_CONNECTION_TIMEOUT
+        )
+        self._periodical_disconnect.start()
+        self._subscriber_connection = None
+        # Future resolved when _subscriber_connection is connected
+        self._subscriber_connected = None
+        # connection whose messages are being popped
+        self._listening_connection = None
+        # (channel, payload, future) of publications not sent yet
+        self._publish_queue = []
+        self._pending_publications = 0
+        self._flush_scheduled = False
+
+    def publish(self, channel, payload):
+        """
+        Queue payload to be published to the redis channel, without blocking.
+
+        Return a Future, resolved with the number of redis clients which
+        received the payload. Failures to reach redis are surfaced according
+        to PUBLISH_ERROR_POLICY.
+        """
+        future = Future()
+        if self._pending_publications >= PUBLISH_QUEUE_MAX_SIZE:
+            error = RedisUnavailableError("{0} publications are already waiting for redis".format(self._pending_publications))
+            if PUBLISH_ERROR_POLICY == "raise":
+                raise error
+            logger.warning("dropping publication to %s: %s", channel, error)
+            future.set_result(None)
+            return future
+
+        self._publish_queue.append((channel, payload, future))
+        self._pending_publications += 1
+        if len(self._publish_queue) >= PUBLISH_BATCH_SIZE:
+            self._flush_publish_queue()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            ioloop.IOLoop.current().add_callback(self._flush_publish_queue)
+        return future
+
+    def _flush_publish_queue(self):
+        """
+        Send all queued publications to redis in a single pipeline.
+        """
+        self._flush_scheduled = False
+        if not self._publish_queue:
+            return
+        queue, self._publish_queue = self._publish_queue, []
+        pipeline = tornadis.Pipeline()
+        for channel, payload, _ in queue:
+            pipeline.stack_call("PUBLISH", channel, payload)
+        future = self._publisher_connection.call(pipeline)
+        ioloop.IOLoop.current().add_future(future, partial(self._on_published, queue))
+
+    def _on_published(self, queue, fut):
+        self._pending_publications -= len(queue)
+        replies = fut.result()
+        if isinstance(replies, tornadis.TornadisException):
+            if PUBLISH_ERROR_POLICY != "raise":
+                logger.warning("dropping %d publications: %s", len(queue), replies)
+            replies = [replies] * len(queue)
+        for (_, _, future), reply in zip(queue, replies):
+            if not isinstance(reply, tornadis.TornadisException):
+                future.set_result(reply)
+            elif PUBLISH_ERROR_POLICY == "raise":
+                future.set_exception(RedisUnavailableError(reply))
+            else:
+                future.set_result(None)
+
+    def call(self, *args):
+        """
+        Send a command to redis through the publishing connection (e.g.
+        call("HGET", key, field)), returning a Future resolved with its reply
+        or with a tornadis.TornadisException.
+        """
+        return self._publisher_connection.call(*args)
+
+    def is_subscribed(self, channel):
+        return channel in self.channels
+
+    def is_psubscribed(self, pattern):
+        return pattern in self.patterns
+
+    def subscribe(self, channel, on_message, on_lost):
+        """
+        Subscribe to a redis channel, connecting to redis if this is the
+        first channel.
+
+        on_message(channel, raw_msg) is called whenever a message is received
+        in channel, and on_lost() if the connection with redis is lost.
+
+        The subscription is sent in background: return a Future resolved
+        with True once redis confirms it, or with False if it fails, in which
+        case on_lost() is called as well.
+        """
+        return self._add_subscription(self.channels, channel, on_message, on_lost)
+
+    def psubscribe(self, pattern, on_message, on_lost):
+        """
+        Subscribe to the redis channels which match a glob-style pattern (see
+        subscribe). on_message(channel, raw_msg) is called with the channel
+        in which each message was published.
+        """
+        return self._add_subscription(self.patterns, pattern, on_message, on_lost)
+
+    def _add_subscription(self, subscriptions, name, on_message, on_lost):
+        subscriptions[name] = (on_message, on_lost)
+        if self._subscriber_connection is None:
+            self._subscriber_connection = tornadis.PubSubClient(autoconnect=False, ioloop=ioloop.IOLoop.current(), **self.redis_params)
+            self._subscriber_connected = self._subscriber_connection.connect()
+        return gen.convert_yielded(self._subscribe(subscriptions, name, on_lost, self._subscriber_connection, self._subscriber_connected))
+
+    async def _subscribe(self, subscriptions, channel, on_lost, connection, connected):
+        is_connected = await connected
+        if not self._is_subscribing(subscriptions, channel, on_lost, connection):
+            # the channel was unsubscribed or dropped meanwhile
+            return False
+        if not is_connected:
+            logger.warning("could not connect to redis %s", self.redis_params)
+            self._drop_channels()
+            return False
+
+        try:
+            if subscriptions is self.patterns:
+                subscribed = await connection.pubsub_psubscribe(channel)
+            else:
+                subscribed = await connection.pubsub_subscribe(channel)
+        except TypeError:
+            # workaround tornadis bug
+            # (https://github.com/thefab/tornadis/pull/39)
+            subscribed = False
+        if not self._is_subscribing(subscriptions, channel, on_lost, connection):
+            return subscribed
+        if not subscribed:
+            logger.warning("could not subscribe to %s in redis %s", channel, self.redis_params)
+            self._remove_subscription(subscriptions, channel)
+            on_lost()
+        elif self._listening_connection is not connection:
+            self._listening_connection = connection
+            self._register_redis_callback(connection)
+        return subscribed
+
+    def _is_subscribing(self, subscriptions, channel, on_lost, connection):
+        return connection is self._subscriber_connection and subscriptions.get(channel, (None, None))[1] == on_lost
+
+    def unsubscribe(self, channel):
+        """
+        Unsubscribe from a redis channel, disconnecting from redis if it was
+        the last channel or pattern.
+        """
+        self._remove_subscription(self.channels, channel)
+
+    def punsubscribe(self, pattern):
+        """
+        Unsubscribe from a glob-style pattern, see unsubscribe.
+        """
+        self._remove_subscription(self.patterns, pattern)
+
+    def _remove_subscription(self, subscriptions, name):
+        if subscriptions.pop(name, None) is None:
+            return
+        if not self.channels and not self.patterns:
+            self._subscriber_connection.disconnect()
+            self._subscriber_connection = None
+        # there is no need to wait for the reply: messages which arrive
+        # meanwhile aren't routed anywhere
+        elif subscriptions is self.patterns:
+            self._subscriber_connection.pubsub_punsubscribe(name)
+        else:
+            self._subscriber_connection.pubsub_unsubscribe(name)
+
+    def _register_redis_callback(self, connection):
+        """
+        Listens for new messages. If connection was dropped, then notify all
+        channels.
+        """
+        if connection is not self._subscriber_connection:
+            # we've disconnected from this connection meanwhile
+            return
+        if connection.is_connected():
+            future = connection.pubsub_pop_message(deadline=PUBSUB_TIMEOUT)
+            ioloop.IOLoop.current().add_future(future, partial(self._on_redis_message, connection))
+        else:
+            # Connection with redis was lost
+            self._drop_channels()
+
+    def _drop_channels(self):
+        """
+        Forget all channels and notify them that the connection with redis
+        was lost.
+        """
+        callbacks = list(self.channels.values()) + list(self.patterns.values())
+        self.channels = {}
+        self.patterns = {}
+        self._subscriber_connection = None
+        for _, on_lost in callbacks:
+            on_lost()
+
+    def _on_redis_message(self, connection, fut):
+        if connection is not self._subscriber_connection:
+            return
+        result = fut.result()
+        if isinstance(result, tornadis.ConnectionError) or isinstance(result, tornadis.ClientError):
+            # Connection with redis was lost
+            self._drop_channels()
+        elif result is not None:
+            self._register_redis_callback(connection)
+            type_ = result[0].decode("utf-8")
+            if type_ == u"pmessage":
+                _, pattern, channel, raw_msg = result
+                channel = channel.decode("utf-8")
+                callbacks = self.patterns.get(pattern.decode("utf-8"))
+            else:
+                assert type_ == u"message", "got wrong message type from pop_message: {}".format(type_)
+                _, channel, raw_msg = result
+                channel = channel.decode("utf-8")
+                callbacks = self.channels.get(channel)
+            if callbacks is not None:
+                on_message, _ = callbacks
+                on_message(channel, raw_msg)
+        else:
+            self._register_redis_callback(connection)
+
+    def _disconnect_publisher(self):
+        """
+        Disconnect periodically in order not to keep an unused connection.
+        """
+        self._publisher_connection.disconnect()
+
+
+_bridges = {}
+
+
+def get_redis_bridge(redis_params):
+    """
+    Return the RedisBridge of the current IOLoop to the redis server
+    described by redis_params, creating it if it doesn't exist yet.
+    """
+    key = (ioloop.IOLoop.current(), tuple(sorted(redis_params.items())))
+    bridge = _bridges.get(key)
+    if bridge is None:
+        bridge = _bridges[key] = RedisBridge(redis_params)
+    return bridge
+
+
 class Topic(object):
     """
     Represent a topic, containing its name, subscribers and publishers.
+
+    Subscribers are keyed by subscription id, unless they share the topic's
+    subscription_id, in which case they are keyed by connection id.
+
+    If match is "prefix" or "wildcard", name is a pattern and the topic's
+    subscribers get the events of all topics which match it.
     """
-    def __init__(self, name, redis=None):
+    def __init__(self, name, redis=None, match=EXACT):
         self.name = name
+        self.match = match
+        self.subscription_id = None
         self.subscribers = {}
         self.publishers = {}
+        # handle of the removal scheduled by TopicsManager.collect_if_empty
+        self._collect_timeout = None
         self.redis_params = redis
         if self.redis_params is not None:
-            self._publisher_connection = tornadis.Client(ioloop=ioloop.IOLoop.current(), autoconnect=True, **self.redis_params)
-            self._periodical_disconnect = ioloop.PeriodicCallback(
-                self._disconnect_publisher,
-                PUBLISHER_CONNECTION_TIMEOUT
-            )
-            self._periodical_disconnect.start()
+            self._bridge = get_redis_bridge(self.redis_params)
         else:
-            self._publisher_connection = None
-        self._subscriber_connection = None
+            self._bridge = None
 
     @property
     def connections(self):
@@ -179,6 +635,30 @@ class Topic(object):
         conns.update(self.publishers)
         return conns
 
+    @property
+    def key(self):
+        """
+        Return the key of this topic in TopicsManager.
+        """
+        return topic_key(self.name, self.match)
+
+    @property
+    def channel(self):
+        """
+        Return the redis channel of this topic or, if it is pattern-based, the
+        glob-style pattern of the channels of the topics which match it.
+        """
+        if self.match == EXACT:
+            return TOPIC_CHANNEL_PREFIX + self.name
+        return TOPIC_CHANNEL_PREFIX + redis_pattern(self.match, self.name)
+
+    @property
+    def is_empty(self):
+        """
+        Return True if the topic has neither subscribers nor publishers.
+        """
+        return not self.subscribers and not self.publishers
+
     @property
     def dict(self):
         """
@@ -195,20 +675,17 @@ class Topic(object):
 
     def publish(self, broadcast_msg):
         """
-        Publish event_msg to all subscribers. This method will publish to
-        redis if redis is available. Otherwise, it will run locally and can
-        be called without yield.
+        Publish event_msg to all subscribers. This method will also publish
+        to redis if redis is available, in which case it returns the Future
+        returned by RedisBridge.publish.
 
         The parameter publisher_connection_id is used to not publish the
         message back to the publisher.
         """
         event_msg = broadcast_msg.event_message
         customize.deliver_event_messages(self, event_msg, broadcast_msg.publisher_connection_id)
-        if self._publisher_connection is not None:
-            ret = utils.run_async(self._publisher_connection.call("PUBLISH", self.name, broadcast_msg.json))
-            if isinstance(ret, tornadis.ConnectionError):
-                raise RedisUnavailableError(ret)
-            return ret
+        if self._bridge is not None:
+            return self._bridge.publish(self.channel, broadcast_msg.json)
 
     def remove_subscriber(self, subscriber_id):
         """
@@ -216,9 +693,11 @@ class Topic(object):
         """
         if subscriber_id in self.subscribers:
             subscriber = self.subscribers.pop(subscriber_id)
-            if self._subscriber_connection is not None and not self.subscribers:
-                self._subscriber_connection.disconnect()
-                self._subscriber_connection = None
+            if self._bridge is not None and not self.subscribers:
+                if self.match == EXACT:
+                    self._bridge.unsubscribe(self.channel)
+                else:
+                    self._bridge.punsubscribe(self.channel)
             return subscriber
 
     def add_subscriber(self, subscription_id, connection):
@@ -226,41 +705,31 @@ class Topic(object):
         Add subscriber to a topic. It will register in redis if it is
         available (ie. redis parameter was passed to the constructor),
         otherwise, it will be a simple in memory operation only.
-        """
-        if self.redis_params is not None and self._subscriber_connection is None:
-            self._subscriber_connection = tornadis.PubSubClient(autoconnect=False, ioloop=ioloop.IOLoop.current(), **self.redis_params)
-
-            ret = utils.run_async(self._subscriber_connection.connect())
-            if not ret:
-                raise RedisUnavailableError(ret)
-
-            try:
-                ret = utils.run_async(self._subscriber_connection.pubsub_subscribe(self.name))
-            except TypeError:
-                # workaround tornadis bug
-                # (https://github.com/thefab/tornadis/pull/39)
-                # This can be reached in Python 3.x
-                raise RedisUnavailableError(str(self.redis_params))
-            if not ret:
-                # this will only be reached when the previously mentioned bug
-                # is fixed
-                # This can be reached in Python 2.7
-                raise RedisUnavailableError(ret)
-
-            self._register_redis_callback()
-        self.subscribers[subscription_id] = connection
 
-    def _register_redis_callback(self):
+        If the topic had to subscribe to its redis channel, return the Future
+        returned by RedisBridge.subscribe (subscribers are dropped if the
+        subscription fails).
         """
-        Listens for new messages. If connection was dropped, then disconnect
-        all subscribers.
-        """
-        if self._subscriber_connection is not None and self._subscriber_connection.is_connected():
-            future = self._subscriber_connection.pubsub_pop_message(deadline=PUBSUB_TIMEOUT)
-            ioloop.IOLoop.current().add_future(future, self._on_redis_message)
-        else:
-            # Connection with redis was lost
-            self._drop_subscribers()
+        self.subscribers[subscription_id] = connection
+        if self._bridge is None:
+            return
+        if self.match == EXACT:
+            if not self._bridge.is_subscribed(self.channel):
+                return self._bridge.subscribe(self.channel, self._on_event_message, self._drop_subscribers)
+        elif not self._bridge.is_psubscribed(self.channel):
+            return self._bridge.psubscribe(self.channel, self._on_pattern_message, self._drop_subscribers)
+
+    def close(self):
+        """
+        Release the redis resources used by this topic.
+        """
+        if self._bridge is None:
+            return
+        if self.match == EXACT:
+            if self._bridge.channels.get(self.channel, (None,))[0] == self._on_event_message:
+                self._bridge.unsubscribe(self.channel)
+        elif self._bridge.patterns.get(self.channel, (None,))[0] == self._on_pattern_message:
+            self._bridge.punsubscribe(self.channel)
 
     def _drop_subscribers(self):
         """
@@ -275,30 +744,36 @@ class Topic(object):
             subscriber = self.remove_subscriber(subscriber_id)
             subscriber._websocket.close()
 
-    def _on_event_message(self, topic_name, raw_msg):
-        msg = messages.BroadcastMessage.from_text(raw_msg.decode("utf-8"))
+    def _on_event_message(self, channel, raw_msg):
+        msg = _parse_broadcast_message(channel, raw_msg)
+        if msg is None:
+            return
+        topic_name = channel[len(TOPIC_CHANNEL_PREFIX):]
         assert_msg = "broadcast message topic and redis pub/sub queue must match ({} != {})".format(topic_name, msg.topic_name)
         assert topic_name == msg.topic_name, assert_msg
-        if msg.publisher_node_id != messages.PUBLISHER_NODE_ID.hex:
+        if not msg.is_local:
             customize.deliver_event_messages(self, msg.event_message, None)
 
-    def _on_redis_message(self, fut):
-        result = fut.result()
-        if isinstance(result, tornadis.ConnectionError) or isinstance(result, tornadis.ClientError):
-            # Connection with redis was lost
-            self._drop_subscribers()
-        elif result is not None:
-            self._register_redis_callback()
-            type_, topic_name, raw_msg = result
-            assert type_.decode("utf-8") == u"message", "got wrong message type from pop_message: {}".format(type_)
-            self._on_event_message(topic_name.decode('utf-8'), raw_msg)
-        else:
-            self._register_redis_callback()
-
-    def _disconnect_publisher(self):
+    def _on_pattern_message(self, channel, raw_msg):
         """
-        Disconnect periodically in order not to have several unused
-        connections of old topics.
+        Deliver an event published by another node in a topic which matches
+        the redis pattern of this topic (and so, probably, its own pattern).
         """
-        if self._publisher_connection is not None:
-            self._publisher_connection.disconnect()
+        topic_name = channel[len(TOPIC_CHANNEL_PREFIX):]
+        if not matches(self.match, self.name, topic_name):
+            return
+        msg = _parse_broadcast_message(channel, raw_msg)
+        if msg is not None and not msg.is_local:
+            customize.deliver_event_messages(self, msg.event_message.with_topic(topic_name), None)
+
+
+def _parse_broadcast_message(channel, raw_msg):
+    """
+    Return the BroadcastMessage received in a redis channel, or None if it
+    can't be parsed (e.g. it was published by another application), so the
+    redis callbacks don't raise.
+    """
+    try:
+        return messages.BroadcastMessage.from_text(raw_msg.decode("utf-8"))
+    except Exception:
+        logger.warning("skipping message of redis channel %s which could not be parsed: %r", channel, raw_msg, exc_info=True)
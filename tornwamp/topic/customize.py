@@ -1,6 +1,7 @@
 """
 This module allows customization of methods used by pub/sub
 """
+from tornwamp.topic import fanout
 
 
 def deliver_event_messages(topic, event_msg, publisher_connection_id=None):
@@ -9,12 +10,13 @@ def deliver_event_messages(topic, event_msg, publisher_connection_id=None):
     is published.
 
     Parameters:
-        topic - topic in which the message was published
+        topic - topic in which the message was published, or whose pattern
+        matches it (the topic is then in event_msg.details["topic"])
         event_msg - published message
         publisher_connection_id - if it is not None, it is the websocket
         connection id of the publisher
+
+    Events of topics with many subscribers are delivered in slices, see
+    tornwamp.topic.fanout.
     """
-    for subscription_id, subscriber in topic.subscribers.items():
-        if publisher_connection_id is None or subscriber.id != publisher_connection_id:
-            event_msg.subscription_id = subscription_id
-            subscriber._websocket.write_message(event_msg.json)
+    fanout.scheduler.deliver(topic, event_msg, publisher_connection_id)
@@ -0,0 +1,180 @@
+"""
+Delivery of events to the subscribers of topics (fan-out).
+
+Events of topics with up to SLICE_SIZE subscribers are delivered at once.
+Those of larger topics are delivered by scheduler in slices of SLICE_SIZE
+subscribers, so the IOLoop keeps handling other connections (e.g. answering
+heartbeats and publications) meanwhile:
+- each IOLoop iteration, slices are delivered for up to TIME_BUDGET seconds
+  (at least one slice is delivered), then the scheduler yields to the IOLoop;
+- topics which have events being delivered take turns, one slice each, so a
+  large topic doesn't delay the events of the others;
+- events of the same topic are delivered in the order they were published.
+
+Subscribers which subscribed after an event was published don't get it,
+and those which unsubscribed before their slice was delivered are skipped.
+Errors raised while delivering to a subscriber are logged, and the delivery
+goes on with the next one.
+
+How long deliveries take, from the publication of an event to its delivery to
+the last subscriber ("delivery"), and how long the IOLoop is held by each
+scheduler run ("tick") is counted in latency_histograms, by LATENCY_BUCKETS.
+"""
+from collections import Counter, OrderedDict, deque
+import logging
+import time
+
+from tornado import ioloop
+
+from tornwamp.serializer import json_serializer
+from tornwamp.topic.matcher import EXACT
+
+# topics with more subscribers have their events delivered in slices
+SLICE_SIZE = 1000
+# maximum time (in seconds) spent delivering slices per IOLoop iteration
+TIME_BUDGET = 0.005
+
+# upper bounds (in seconds) of the buckets of latency_histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, float("inf"))
+
+logger = logging.getLogger(__name__)
+
+latency_histograms = {
+    "delivery": Counter(),
+    "tick": Counter(),
+}
+
+
+def observe(histogram, seconds):
+    """
+    Count a latency of seconds in the bucket of histogram it falls into.
+    """
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            latency_histograms[histogram][bound] += 1
+            return
+
+
+class FanOut(object):
+    """
+    Delivery of an event to the subscribers of topic, encoded once per
+    serializer.
+
+    In order to be delivered in slices, the subscribers are copied to a
+    snapshot: two lists of ids and connections, rather than a list of
+    (id, connection) items, so a snapshot of a large topic doesn't add as many
+    objects to be tracked by the garbage collector.
+    """
+    def __init__(self, topic, event_msg, publisher_connection_id, snapshot=False):
+        self.topic = topic
+        self.event_msg = event_msg
+        self.publisher_connection_id = publisher_connection_id
+        self.published_at = time.monotonic()
+        # events of different topics must not be coalesced
+        self.key = topic.name if topic.match == EXACT else event_msg.details["topic"]
+        if snapshot:
+            self._ids = list(topic.subscribers.keys())
+            self._connections = list(topic.subscribers.values())
+        self._position = 0
+        self._templates = {}
+        self._shared_events = {}
+
+    def run(self, count=None):
+        """
+        Deliver the event to the next count subscribers of the snapshot (or
+        to all current subscribers, if count is None). Return True once all
+        subscribers were handled.
+        """
+        if count is None:
+            subscribers = self.topic.subscribers.items()
+        else:
+            end = self._position + count
+            subscribers = zip(self._ids[self._position:end], self._connections[self._position:end])
+            self._position = end
+        for subscription_id, subscriber in subscribers:
+            if self.publisher_connection_id is not None and subscriber.id == self.publisher_connection_id:
+                continue
+            if count is not None and self.topic.subscribers.get(subscription_id) is not subscriber:
+                # unsubscribed since the event was published
+                continue
+            serializer = getattr(subscriber, "serializer", json_serializer)
+            try:
+                subscriber.send(self._render(serializer, subscription_id), binary=serializer.binary, key=self.key)
+            except Exception:
+                logger.exception("could not deliver an event of %s to subscription %s", self.key, subscription_id)
+        return count is None or self._position >= len(self._ids)
+
+    def _render(self, serializer, subscription_id):
+        shared_id = self.topic.subscription_id
+        if shared_id is not None:
+            # all subscribers get the very same encoded event
+            event = self._shared_events.get(serializer)
+            if event is None:
+                event = self._shared_events[serializer] = self.event_msg.template(serializer).render(shared_id)
+            return event
+        template = self._templates.get(serializer)
+        if template is None:
+            template = self._templates[serializer] = self.event_msg.template(serializer)
+        return template.render(subscription_id)
+
+
+class FanOutScheduler(object):
+    """
+    Deliver events, slicing those of large topics, see the module
+    documentation.
+    """
+    def __init__(self):
+        # topic => deque of FanOuts, in the order topics take turns
+        self._queues = OrderedDict()
+        # IOLoop in which _run is scheduled, if any
+        self._ioloop = None
+
+    def __len__(self):
+        """
+        Return the number of events being delivered.
+        """
+        return sum(len(queue) for queue in self._queues.values())
+
+    def deliver(self, topic, event_msg, publisher_connection_id=None):
+        """
+        Deliver event_msg to the subscribers of topic (except for the
+        publisher), now or in the next IOLoop iterations.
+        """
+        if len(topic.subscribers) <= SLICE_SIZE and topic not in self._queues:
+            fanout = FanOut(topic, event_msg, publisher_connection_id)
+            fanout.run()
+            observe("delivery", time.monotonic() - fanout.published_at)
+            return
+        fanout = FanOut(topic, event_msg, publisher_connection_id, snapshot=True)
+        self._queues.setdefault(topic, deque()).append(fanout)
+        if self._ioloop is not ioloop.IOLoop.current():
+            self._schedule()
+
+    def _schedule(self):
+        self._ioloop = ioloop.IOLoop.current()
+        self._ioloop.add_callback(self._run)
+
+    def _run(self):
+        """
+        Deliver slices, giving each topic a turn, until TIME_BUDGET is spent.
+        """
+        self._ioloop = None
+        started_at = time.monotonic()
+        while self._queues:
+            topic, queue = next(iter(self._queues.items()))
+            fanout = queue[0]
+            if fanout.run(SLICE_SIZE):
+                queue.popleft()
+                observe("delivery", time.monotonic() - fanout.published_at)
+            if queue:
+                self._queues.move_to_end(topic)
+            else:
+                del self._queues[topic]
+            if time.monotonic() - started_at >= TIME_BUDGET:
+                break
+        observe("tick", time.monotonic() - started_at)
+        if self._queues:
+            self._schedule()
+
+
+scheduler = FanOutScheduler()
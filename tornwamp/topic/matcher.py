@@ -0,0 +1,148 @@
+"""
+Pattern-based subscriptions: besides subscribing to a topic ("exact"
+match), clients may subscribe to all topics which start with a prefix
+("prefix" match, e.g. market.eur matches market.eur.usd) or whose
+components match a wildcard pattern ("wildcard" match, where empty
+components match any component, e.g. market..usd matches market.eur.usd).
+
+TopicMatcher indexes patterns in tries, so the patterns which match a topic
+are found in time proportional to the length of the topic, rather than to
+the number of patterns.
+"""
+EXACT = "exact"
+PREFIX = "prefix"
+WILDCARD = "wildcard"
+
+MATCH_POLICIES = (EXACT, PREFIX, WILDCARD)
+
+# characters which have a special meaning in redis' glob-style patterns
+REDIS_GLOB_CHARACTERS = "\\*?[]^"
+
+
+def topic_key(name, match=EXACT):
+    """
+    Return the key of the topic subscribed as name with the given match
+    policy in TopicsManager. Keys of pattern-based subscriptions contain "#",
+    which is not allowed in WAMP URIs, so they never clash with topic names.
+    """
+    if match == EXACT:
+        return name
+    return u"{0}#{1}".format(match, name)
+
+
+def matches(match, pattern, topic_name):
+    """
+    Return True if topic_name matches pattern according to match.
+    """
+    if match == PREFIX:
+        return topic_name.startswith(pattern)
+    if match == WILDCARD:
+        components = pattern.split(".")
+        topic_components = topic_name.split(".")
+        if len(components) != len(topic_components):
+            return False
+        return all(not component or component == topic_component for component, topic_component in zip(components, topic_components))
+    return topic_name == pattern
+
+
+def redis_pattern(match, pattern):
+    """
+    Return a redis glob-style pattern, to PSUBSCRIBE to the channels of the
+    topics which match pattern. Wildcards are translated to "?*", which also
+    matches dots, so received messages should be checked with matches.
+    """
+    escaped = u"".join(u"\\" + char if char in REDIS_GLOB_CHARACTERS else char for char in pattern)
+    if match == PREFIX:
+        return escaped + u"*"
+    if match == WILDCARD:
+        return u".".join(component or u"?*" for component in escaped.split("."))
+    return escaped
+
+
+class TopicMatcher(object):
+    """
+    Index of values (e.g. topics) by pattern.
+
+    Prefixes are kept in a trie of characters, and wildcard patterns in a
+    trie of components, in which empty components match any component. Trie
+    nodes are dicts of children, the value of the pattern which ends in a
+    node being kept under the None key.
+    """
+    def __init__(self):
+        self._prefixes = {}
+        self._wildcards = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _path(self, match, pattern):
+        if match == PREFIX:
+            return self._prefixes, pattern
+        if match == WILDCARD:
+            return self._wildcards, pattern.split(".")
+        raise ValueError("Unsupported match policy: {0}".format(match))
+
+    def add(self, match, pattern, value):
+        """
+        Index value by pattern, replacing the value previously indexed by the
+        same pattern, if any.
+        """
+        node, path = self._path(match, pattern)
+        for edge in path:
+            node = node.setdefault(edge, {})
+        if None not in node:
+            self._size += 1
+        node[None] = value
+
+    def remove(self, match, pattern):
+        """
+        Remove the value indexed by pattern, if any, and the trie nodes which
+        aren't needed anymore.
+        """
+        node, path = self._path(match, pattern)
+        nodes = [node]
+        for edge in path:
+            node = node.get(edge)
+            if node is None:
+                return
+            nodes.append(node)
+        if node.pop(None, None) is None:
+            return
+        self._size -= 1
+        for depth in range(len(path) - 1, -1, -1):
+            if nodes[depth + 1]:
+                break
+            del nodes[depth][path[depth]]
+
+    def match(self, topic_name):
+        """
+        Return the values of all patterns which match topic_name.
+        """
+        values = []
+        node = self._prefixes
+        if None in node:
+            values.append(node[None])
+        for char in topic_name:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                values.append(node[None])
+
+        nodes = [self._wildcards] if self._wildcards else []
+        for component in topic_name.split("."):
+            if not nodes:
+                break
+            children = []
+            for node in nodes:
+                child = node.get(component)
+                if child is not None:
+                    children.append(child)
+                if component:
+                    child = node.get("")
+                    if child is not None:
+                        children.append(child)
+            nodes = children
+        values.extend(node[None] for node in nodes if None in node)
+        return values
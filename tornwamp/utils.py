@@ -1,14 +1,67 @@
-from functools import partial
+import sys
 
-import greenlet
+from deprecated import deprecated
 from tornado import ioloop
+from tornado.concurrent import Future, future_set_exc_info
 
+try:
+    import greenlet
+except ImportError:
+    greenlet = None
 
+
+def call_in_greenlet(function):
+    """
+    Call function in a child greenlet, in which it may call run_async, if
+    greenlet is installed (and this isn't already such a greenlet).
+
+    Return what function returns or, if it is still waiting for a future
+    passed to run_async, a Future resolved with it once it is done.
+    """
+    if greenlet is None or greenlet.getcurrent().parent is not None:
+        return function()
+    # Future of the result, created only if function waits
+    waiting = []
+
+    def run():
+        try:
+            result = function()
+        except Exception:
+            if not waiting:
+                raise
+            future_set_exc_info(waiting[0], sys.exc_info())
+        else:
+            if not waiting:
+                return result
+            waiting[0].set_result(result)
+
+    child = greenlet.greenlet(run)
+    result = child.switch()
+    if child.dead:
+        return result
+    waiting.append(Future())
+    return waiting[0]
+
+
+@deprecated(reason="processors may be coroutines (async def), which await futures")
 def run_async(future):
     """
     Uses greenlet to return to this point after future is finished executing.
+
+    It requires greenlet, which is no longer a dependency of tornwamp (see
+    the greenlet extra), and must be called from a greenlet which isn't the
+    main one, such as those in which the process method of synchronous
+    processors is called (see call_in_greenlet). RuntimeError is raised
+    otherwise.
     """
-    gr = greenlet.getcurrent()
+    gr = greenlet.getcurrent() if greenlet is not None else None
+    if gr is None or gr.parent is None:
+        raise RuntimeError(
+            "run_async can only be called from a greenlet which isn't the main one: "
+            "install greenlet (tornwamp[greenlet]) to call it from processors, "
+            "or make process() a coroutine (async def) and await the future instead."
+        )
+
     ioloop.IOLoop.current().add_future(future, gr.switch)
 
     future = gr.parent.switch()